@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -82,11 +85,56 @@ WSGI_APPLICATION = 'alx_backend_graphql.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 plus connection-init pragmas and
+        # BEGIN IMMEDIATE for write transactions (crm/backends/sqlite3).
+        'ENGINE': 'crm.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            'pragmas': {
+                # Wait up to 5s for a lock instead of failing.
+                'busy_timeout': 5000,
+                # Readers and the writer no longer block each other.
+                'journal_mode': 'WAL',
+                # fsync at checkpoints only; durable enough with WAL.
+                'synchronous': 'NORMAL',
+                # 20 MB page cache per connection, 128 MB memory-mapped reads.
+                'cache_size': -20000,
+                'mmap_size': 134217728,
+                'temp_store': 'MEMORY',
+            },
+        },
     }
 }
 
+# Read replicas: SQLite copies of the primary, opened read-only, one alias
+# per path in CRM_SQLITE_REPLICAS (comma-separated). Refresh them with
+# `manage.py sync_sqlite_replicas`.
+for index, path in enumerate(filter(None, os.environ.get('CRM_SQLITE_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{index}'] = {
+        'ENGINE': 'crm.backends.sqlite3',
+        'NAME': f'{Path(path).resolve().as_uri()}?mode=ro',
+        'OPTIONS': {
+            'pragmas': {
+                'busy_timeout': 5000,
+                'cache_size': -20000,
+                'mmap_size': 134217728,
+                'temp_store': 'MEMORY',
+            },
+        },
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# GraphQL queries and the reporting jobs read from the replicas; see
+# crm/routers.py.
+DATABASE_ROUTERS = ['crm.routers.ReadReplicaRouter']
+CRM_DATABASE_ROUTING = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    # Reads stay on the primary this long after a write.
+    'STICKY_SECONDS': 5,
+    # A failed replica is skipped this long.
+    'RETRY_SECONDS': 30,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -131,7 +179,119 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # GraphQL Configuration
 GRAPHENE = {
-    'SCHEMA': 'alx_backend_graphql_crm.schema.schema'
+    'SCHEMA': 'alx_backend_graphql_crm.schema.schema',
+    # Static query limits (see crm/cost.py); QUERY_COSTS overrides the cost
+    # of single fields, e.g. {'Query.totalRevenue': 5}.
+    'MAX_QUERY_DEPTH': 10,
+    'MAX_QUERY_COST': 10000,
+    'DEFAULT_LIST_SIZE': 10,
+    'QUERY_COSTS': {},
+}
+
+# Cache used by the GraphQL response cache. Entries beyond MAX_ENTRIES are
+# evicted least recently used first; point it at Redis in production.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'graphql': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'graphql-responses',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    # Persisted query texts: kept apart so response churn cannot evict them.
+    'graphql-apq': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'graphql-persisted-queries',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Opt-in cache for read-only GraphQL responses (see crm/response_cache.py)
+CRM_GRAPHQL_CACHE = {
+    'ENABLED': False,
+    'CACHE_ALIAS': 'graphql',
+    'TIMEOUT': 60,
+}
+
+# Parsed-document LRU and automatic persisted queries (see crm/documents.py)
+CRM_GRAPHQL_DOCUMENTS = {
+    'CACHE_SIZE': 500,
+    'PERSISTED_QUERIES': True,
+    'CACHE_ALIAS': 'graphql-apq',
+    'TIMEOUT': None,
+}
+
+# Per-operation tracing (see crm/tracing.py). Traces go to every sink; the
+# header returns them in extensions.tracing when DEBUG is on or for staff.
+CRM_GRAPHQL_TRACING = {
+    'ENABLED': False,
+    'RESOLVERS': True,
+    'HEADER': 'X-GraphQL-Trace',
+    'SINKS': [
+        'crm.tracing.LogSink',
+        # {'class': 'crm.tracing.StatsdSink', 'host': 'localhost', 'port': 8125},
+    ],
+}
+
+# Bulk import endpoint (import/<kind>/): staff sessions, or clients sending
+# "Authorization: Bearer <TOKEN>". No token means staff sessions only.
+CRM_IMPORT = {
+    'TOKEN': os.environ.get('CRM_IMPORT_TOKEN'),
+}
+
+# Prometheus metrics at /metrics (see crm/metrics.py). Set MULTIPROCESS_DIR
+# to a directory shared by all worker processes to aggregate across them.
+# Operations are labelled by their root fields; OPERATION_NAMES lists the
+# client operation names that may be used as labels instead.
+CRM_METRICS = {
+    'MULTIPROCESS_DIR': os.environ.get('CRM_METRICS_DIR'),
+    'FLUSH_INTERVAL': 1.0,
+    'OPERATION_NAMES': [],
+}
+
+# Serve /graphql/ with AsyncCRMGraphQLView (run under an ASGI server such as
+# uvicorn or daphne): queries execute on the event loop with the async ORM.
+CRM_GRAPHQL_ASYNC = os.environ.get('CRM_GRAPHQL_ASYNC') == '1'
+
+# Opt-in parallel resolution of independent root query fields (see
+# crm/execution.py). MAX_WORKERS bounds the shared pool (each thread holds its
+# own database connection); MAX_FIELDS_PER_REQUEST caps the threads one
+# request may use.
+CRM_GRAPHQL_CONCURRENCY = {
+    'ENABLED': False,
+    'MAX_WORKERS': 8,
+    'MAX_FIELDS_PER_REQUEST': 4,
+}
+
+# How createOrder reserves stock (see crm/orders.py): 'lock' takes row locks
+# in product ID order; 'optimistic' uses conditional UPDATEs without locks.
+CRM_STOCK_RESERVATION = 'lock'
+
+# Cron jobs and Celery tasks run their GraphQL operations in process (see
+# crm/client.py); set CRM_GRAPHQL_URL to send them to a remote endpoint.
+CRM_GRAPHQL_CLIENT = {
+    'URL': os.environ.get('CRM_GRAPHQL_URL'),
+    'TIMEOUT': 30,
+    'RETRIES': 3,
+}
+
+# Order reminders: orders of the last DAYS days, sent by Celery tasks of
+# CHUNK_SIZE orders each, rate limited per worker (see crm/reminders.py).
+CRM_ORDER_REMINDERS = {
+    'DAYS': 7,
+    'CHUNK_SIZE': 500,
+    'CHUNK_RATE_LIMIT': '10/s',
+}
+
+# Inactive customer cleanup: customers with no order in INACTIVE_DAYS days,
+# deleted BATCH_SIZE at a time with SLEEP seconds between batches (see
+# crm/cleanup.py).
+CRM_CUSTOMER_CLEANUP = {
+    'INACTIVE_DAYS': 365,
+    'BATCH_SIZE': 500,
+    'SLEEP': 0.5,
+    'CHECKPOINT': '/tmp/crm_customer_cleanup.json',
 }
 
 # Celery Configuration
@@ -148,4 +308,8 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'crm.tasks.generate_crm_report',
         'schedule': crontab(day_of_week='mon', hour=6, minute=0),
     },
+    'send-order-reminders': {
+        'task': 'crm.tasks.send_order_reminders',
+        'schedule': crontab(hour=8, minute=0),
+    },
 }
\ No newline at end of file
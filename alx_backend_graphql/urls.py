@@ -14,12 +14,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
-from graphene_django.views import GraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from crm.views import AsyncCRMGraphQLView, CRMGraphQLView, import_data, metrics
+
+graphql_view = AsyncCRMGraphQLView if settings.CRM_GRAPHQL_ASYNC else CRMGraphQLView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('graphql/', csrf_exempt(GraphQLView.as_view(graphiql=True))),
+    path('graphql/', csrf_exempt(graphql_view.as_view(graphiql=True))),
+    path('import/<str:kind>/', import_data),
+    path('metrics', metrics),
 ]
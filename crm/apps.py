@@ -7,3 +7,17 @@ class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
     verbose_name = 'Customer Relationship Management'
+
+    def ready(self):
+        # Keeps the DailyStats buckets in sync with customer/order writes
+        from . import stats  # noqa: F401
+        # Keeps Order.total_amount equal to the sum of its line items
+        from . import orders  # noqa: F401
+        # Invalidates cached GraphQL responses on model writes
+        from . import response_cache  # noqa: F401
+        # Restores the SQLite search triggers after table remakes
+        from . import search  # noqa: F401
+        # Celery task timings for /metrics
+        from . import metrics  # noqa: F401
+        # Read replica health tracking
+        from . import routers  # noqa: F401
@@ -0,0 +1,59 @@
+# crm/backends/sqlite3/base.py
+
+"""
+SQLite backend with connection-init pragmas and a per-transaction BEGIN mode.
+
+Two extra ``OPTIONS`` keys, removed before ``sqlite3.connect`` sees them:
+
+* ``pragmas``: ``{name: value}`` run as ``PRAGMA name = value``, in order,
+  on every new connection (``journal_mode``, ``synchronous``, ...).
+* ``transaction_mode``: ``'DEFERRED'`` (SQLite's default), ``'IMMEDIATE'``
+  or ``'EXCLUSIVE'``, the ``BEGIN`` of every ``atomic`` block.
+
+``crm.transactions.write_atomic`` begins its transaction ``IMMEDIATE``
+whatever ``transaction_mode`` says. A deferred transaction that reads
+before it writes has to upgrade its lock, and SQLite fails that upgrade
+with "database is locked" instead of waiting whenever another connection
+wrote in between. ``BEGIN IMMEDIATE`` takes the write lock up front, where
+``busy_timeout`` applies.
+
+Django 5.1 has ``init_command`` and ``transaction_mode`` for SQLite; this
+backend covers 4.2.
+"""
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        options = self.settings_dict.get('OPTIONS', {})
+        self.pragmas = dict(options.get('pragmas', {}))
+        self.transaction_mode = options.get('transaction_mode')
+        if self.transaction_mode is not None and self.transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}."
+            )
+        # BEGIN mode of the next transaction only (see write_atomic).
+        self.next_transaction_mode = None
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.next_transaction_mode or self.transaction_mode
+        self.next_transaction_mode = None
+        self.cursor().execute(f'BEGIN {mode.upper()}' if mode else 'BEGIN')
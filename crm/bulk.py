@@ -0,0 +1,276 @@
+# crm/bulk.py
+
+"""
+Set-based bulk creation shared by the bulk mutations and importers.
+
+Rows are processed in fixed-size batches: each batch costs one lookup per
+referenced model (``email__in``, ``pk__in``) and one ``bulk_create`` per
+table, and only the current batch is held in memory.
+A row may also be an exception raised while reading it (e.g. a malformed
+NDJSON line); it is reported as a rejected row.
+"""
+
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .models import Customer, Order, OrderItem, Product, validate_phone
+from .response_cache import invalidate
+from .stats import record_customers, record_orders
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def get_batch_size(batch_size=None):
+    """Returns ``batch_size`` or the ``CRM_BULK_BATCH_SIZE`` setting."""
+    return max(1, batch_size or getattr(settings, 'CRM_BULK_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+
+
+def chunked(iterable, size):
+    """Yields lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def format_field_errors(error):
+    """Flattens a model ValidationError into ``field: message; ...``."""
+    if hasattr(error, 'error_dict'):
+        return '; '.join(
+            f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items()
+        )
+    return ' '.join(error.messages)
+
+
+def create_customers(rows, batch_size=None, validate_fields=False):
+    """
+    Validates and inserts customer rows (mappings with name/email/phone).
+
+    Yields ``(created_customers, error_messages)`` once per batch. Row numbers
+    in the messages are 1-based positions in ``rows``. Emails already stored,
+    including those written by an earlier batch, are reported as existing.
+    With ``validate_fields`` every model field constraint is checked too
+    (``Model.clean_fields``), not only the phone format.
+    """
+    for batch in chunked(enumerate(rows, start=1), get_batch_size(batch_size)):
+        emails = {row.get('email') for _, row in batch if not isinstance(row, Exception)}
+        existing = set(
+            Customer.objects.filter(email__in=emails).values_list('email', flat=True)
+        )
+
+        seen = set()
+        customers_to_create = []
+        error_messages = []
+        for number, row in batch:
+            if isinstance(row, Exception):
+                error_messages.append(f"Row {number}: {row}")
+                continue
+            email = row.get('email')
+            if email in existing:
+                error_messages.append(f"Row {number}: Customer with email '{email}' already exists.")
+                continue
+            if email in seen:
+                error_messages.append(f"Row {number}: Duplicate email '{email}' in the same request.")
+                continue
+            phone = row.get('phone')
+            if phone:
+                try:
+                    validate_phone(phone)
+                except ValidationError as e:
+                    error_messages.append(f"Row {number} ({email}): {e.messages[0]}")
+                    continue
+
+            customer = Customer(name=row.get('name'), email=email, phone=phone)
+            if validate_fields:
+                try:
+                    customer.clean_fields()
+                except ValidationError as e:
+                    error_messages.append(f"Row {number} ({email}): {format_field_errors(e)}")
+                    continue
+
+            seen.add(email)
+            customers_to_create.append(customer)
+
+        created = Customer.objects.bulk_create(customers_to_create) if customers_to_create else []
+        # bulk_create sends no post_save signals
+        record_customers(created)
+        if created:
+            invalidate('customer')
+        yield created, error_messages
+
+
+def create_products(rows, batch_size=None):
+    """
+    Validates and inserts product rows (name/description/price/stock).
+
+    Every row is checked against the model field constraints and a positive
+    price. Yields ``(created_products, error_messages)`` once per batch.
+    """
+    for batch in chunked(enumerate(rows, start=1), get_batch_size(batch_size)):
+        products_to_create = []
+        error_messages = []
+        for number, row in batch:
+            if isinstance(row, Exception):
+                error_messages.append(f"Row {number}: {row}")
+                continue
+            name = row.get('name')
+            product = Product(
+                name=name,
+                description=row.get('description') or None,
+                price=row.get('price'),
+                stock=row.get('stock') or 0,
+            )
+            try:
+                product.clean_fields()
+                if product.price <= 0:
+                    raise ValidationError({'price': ["Price must be a positive number."]})
+            except ValidationError as e:
+                error_messages.append(f"Row {number} ({name}): {format_field_errors(e)}")
+                continue
+            products_to_create.append(product)
+
+        created = Product.objects.bulk_create(products_to_create) if products_to_create else []
+        if created:
+            invalidate('product')
+        yield created, error_messages
+
+
+def parse_pk(value):
+    """Returns ``value`` as an integer primary key, or None if it is not one."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def order_quantities(product_ids=None, items=None):
+    """
+    Returns ``{product pk: quantity}`` for an order given as ``items``
+    (mappings with product_id and quantity) and/or ``product_ids`` (one of
+    each; a product listed twice is still ordered once). Raises ValueError
+    for IDs that are not numbers and quantities below one.
+    """
+    quantities = {}
+    invalid_ids = []
+    for item in items or ():
+        pk, quantity = parse_pk(item.get('product_id')), item.get('quantity', 1)
+        if pk is None:
+            invalid_ids.append(str(item.get('product_id')))
+        elif not isinstance(quantity, int) or quantity < 1:
+            raise ValueError(f"Quantity for product ID {pk} must be at least 1.")
+        else:
+            quantities[pk] = quantities.get(pk, 0) + quantity
+    for product_id in product_ids or ():
+        pk = parse_pk(product_id)
+        if pk is None:
+            invalid_ids.append(str(product_id))
+        else:
+            quantities.setdefault(pk, 1)
+    if invalid_ids:
+        raise ValueError(f"Invalid Product IDs found: {', '.join(invalid_ids)}")
+    return quantities
+
+
+def create_orders(rows, batch_size=None):
+    """
+    Validates and inserts order rows (customer_id, product_ids and/or items,
+    order_date) and takes the ordered quantities off the product stock.
+
+    Each batch fetches its customers with one ``pk__in`` query and locks its
+    products (``SELECT ... FOR UPDATE`` in primary key order) with another.
+    Line totals, order totals and remaining stock are worked out in Python
+    from those prices, then the orders, their ``OrderItem`` rows and the new
+    stock levels are written with one bulk query each. A row is rejected if
+    its customer or any of its products does not exist, or if the stock
+    left by the rows before it does not cover it. Yields
+    ``(created_orders, error_messages)`` once per batch.
+    """
+    for batch in chunked(enumerate(rows, start=1), get_batch_size(batch_size)):
+        customer_ids = set()
+        product_ids = set()
+        requests = []
+        for number, row in batch:
+            if isinstance(row, Exception):
+                requests.append((number, row, None))
+                continue
+            try:
+                quantities = order_quantities(row.get('product_ids'), row.get('items'))
+            except ValueError as e:
+                requests.append((number, row, e))
+                continue
+            customer_ids.add(parse_pk(row.get('customer_id')))
+            product_ids.update(quantities)
+            requests.append((number, row, quantities))
+        customer_ids.discard(None)
+        existing_customers = set(
+            Customer.objects.filter(pk__in=customer_ids).values_list('pk', flat=True)
+        )
+        products = {
+            pk: (price, stock)
+            for pk, price, stock in Product.objects.select_for_update()
+            .filter(pk__in=product_ids).order_by('pk').values_list('pk', 'price', 'stock')
+        }
+
+        orders_to_create = []
+        order_items = []
+        stock = {}
+        error_messages = []
+        for number, row, quantities in requests:
+            if isinstance(row, Exception):
+                error_messages.append(f"Row {number}: {row}")
+                continue
+            if isinstance(quantities, Exception):
+                error_messages.append(f"Row {number}: {quantities}")
+                continue
+            customer_id = row.get('customer_id')
+            if parse_pk(customer_id) not in existing_customers:
+                error_messages.append(f"Row {number}: Customer with ID '{customer_id}' does not exist.")
+                continue
+            if not quantities:
+                error_messages.append(f"Row {number}: At least one product must be selected for an order.")
+                continue
+            invalid_ids = [str(pk) for pk in quantities if pk not in products]
+            if invalid_ids:
+                error_messages.append(f"Row {number}: Invalid Product IDs found: {', '.join(invalid_ids)}")
+                continue
+            short = [pk for pk, quantity in quantities.items() if stock.get(pk, products[pk][1]) < quantity]
+            if short:
+                error_messages.append(
+                    f"Row {number}: Insufficient stock for product IDs {', '.join(map(str, short))}."
+                )
+                continue
+
+            items = []
+            for pk, quantity in quantities.items():
+                stock[pk] = stock.get(pk, products[pk][1]) - quantity
+                price = products[pk][0]
+                items.append(OrderItem(
+                    product_id=pk, quantity=quantity, unit_price=price, line_total=price * quantity,
+                ))
+            order = Order(
+                customer_id=parse_pk(customer_id),
+                total_amount=sum((item.line_total for item in items), Decimal('0.00')),
+            )
+            if row.get('order_date'):
+                order.order_date = row['order_date']
+            orders_to_create.append(order)
+            order_items.append(items)
+
+        created = Order.objects.bulk_create(orders_to_create) if orders_to_create else []
+        if created:
+            for order, items in zip(created, order_items):
+                for item in items:
+                    item.order = order
+            OrderItem.objects.bulk_create([item for items in order_items for item in items])
+            Product.objects.bulk_update(
+                [Product(pk=pk, stock=value) for pk, value in sorted(stock.items())], ['stock']
+            )
+            # bulk_create sends no post_save signals
+            record_orders(created)
+            invalidate('order', 'product')
+        yield created, error_messages
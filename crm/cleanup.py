@@ -0,0 +1,176 @@
+# crm/cleanup.py
+
+"""
+Batched deletion of inactive customers.
+
+A customer is inactive when none of their orders was created since the
+cutoff. ``inactive_customers`` finds them with a ``NOT EXISTS`` subquery
+instead of a join. ``delete_inactive_customers`` walks them in primary key
+order, ``BATCH_SIZE`` customers at a time. Each batch commits on its own, so
+SQLite is locked briefly, and ``SLEEP`` seconds pass between batches for
+the writes of the site.
+
+The deletes are raw (``_raw_delete``): order lines, then orders, then
+customers, one statement each per batch. Nothing is collected in memory and
+no delete signals are sent. What those signals would do happens explicitly:
+``crm.stats.record_deleted`` updates the day buckets and the response cache
+is invalidated. The search index triggers live in the database and still
+fire.
+
+After every committed batch the cutoff and the last deleted primary key go
+to the ``CHECKPOINT`` file, so an interrupted run can resume where it
+stopped. A finished run removes the file.
+
+Configured through ``CRM_CUSTOMER_CLEANUP``.
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Customer, Order, OrderItem
+from .response_cache import invalidate
+from .stats import record_deleted
+from .transactions import write_atomic
+
+DEFAULTS = {
+    'INACTIVE_DAYS': 365,
+    'BATCH_SIZE': 500,
+    'SLEEP': 0.5,
+    'CHECKPOINT': '/tmp/crm_customer_cleanup.json',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_CUSTOMER_CLEANUP', {})}
+
+
+def default_cutoff():
+    return timezone.now() - timedelta(days=get_config()['INACTIVE_DAYS'])
+
+
+def inactive_customers(cutoff):
+    """Customers with no order created at or after ``cutoff``."""
+    recent = Order.objects.filter(customer=OuterRef('pk'), created_at__gte=cutoff)
+    return Customer.objects.filter(~Exists(recent))
+
+
+class CleanupReport:
+    """Counters and timing for one cleanup run."""
+
+    def __init__(self, cutoff, dry_run=False):
+        self.cutoff = cutoff
+        self.dry_run = dry_run
+        self.customers = 0
+        self.orders = 0
+        self.items = 0
+        self.batches = 0
+        self.last_pk = None
+        self.batch_seconds = 0.0
+        self.started = time.monotonic()
+        self.seconds = 0.0
+
+
+def delete_batch(ids, dry_run=False):
+    """
+    Deletes the customers ``ids`` with their orders and order lines.
+    Returns the ``(customers, orders, items)`` counts; with ``dry_run`` only
+    counts them.
+    """
+    customers = Customer.objects.filter(pk__in=ids)
+    orders = Order.objects.filter(customer_id__in=ids)
+    items = OrderItem.objects.filter(order_id__in=orders.values('pk'))
+    if dry_run:
+        return len(ids), orders.count(), items.count()
+
+    record_deleted(customers, orders)
+    # Children first: the rows go without the collector, so nothing may be
+    # left pointing at a deleted parent.
+    deleted_items = items._raw_delete(items.db)
+    deleted_orders = orders._raw_delete(orders.db)
+    deleted_customers = customers._raw_delete(customers.db)
+    invalidate('customer', 'order')
+    return deleted_customers, deleted_orders, deleted_items
+
+
+def delete_inactive_customers(cutoff=None, batch_size=None, sleep=None, after=None,
+                              dry_run=False, on_batch=None):
+    """
+    Deletes the customers inactive since ``cutoff`` whose primary key is
+    above ``after``, in batches of ``batch_size``.
+
+    ``on_batch(report)`` is called after every batch. Returns the final
+    CleanupReport.
+    """
+    config = get_config()
+    cutoff = cutoff or default_cutoff()
+    batch_size = batch_size or config['BATCH_SIZE']
+    sleep = config['SLEEP'] if sleep is None else sleep
+    if batch_size < 1:
+        raise ValueError("The batch size must be positive.")
+
+    report = CleanupReport(cutoff, dry_run)
+    report.last_pk = after
+    candidates = inactive_customers(cutoff).order_by('pk').values_list('pk', flat=True)
+    while True:
+        started = time.monotonic()
+        with write_atomic():
+            # Selected in the batch transaction, so a customer who ordered
+            # since the previous batch is not deleted.
+            batch = candidates if report.last_pk is None else candidates.filter(pk__gt=report.last_pk)
+            ids = list(batch[:batch_size])
+            if not ids:
+                break
+            customers, orders, items = delete_batch(ids, dry_run)
+        report.batches += 1
+        report.customers += customers
+        report.orders += orders
+        report.items += items
+        report.last_pk = ids[-1]
+        report.batch_seconds = time.monotonic() - started
+        report.seconds = time.monotonic() - report.started
+        if not dry_run:
+            save_checkpoint(cutoff, report.last_pk)
+        if on_batch is not None:
+            on_batch(report)
+        if len(ids) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    if not dry_run:
+        clear_checkpoint()
+    report.seconds = time.monotonic() - report.started
+    return report
+
+
+# --- Checkpoint ---
+
+def load_checkpoint():
+    """Returns the ``(cutoff, last_pk)`` of an interrupted run, or None."""
+    try:
+        with open(get_config()['CHECKPOINT']) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    return datetime.fromisoformat(state['cutoff']), state['last_pk']
+
+
+def save_checkpoint(cutoff, last_pk):
+    path = get_config()['CHECKPOINT']
+    # Written aside and renamed, so an interruption cannot leave half a file.
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump({'cutoff': cutoff.isoformat(), 'last_pk': last_pk}, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def clear_checkpoint():
+    try:
+        os.remove(get_config()['CHECKPOINT'])
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,142 @@
+# crm/client.py
+
+"""
+GraphQL client for the cron jobs and Celery tasks.
+
+``execute`` runs an operation in the calling process against the schema
+the view serves (``GRAPHENE['SCHEMA']``). It reuses the parsed and
+validated documents of ``crm.documents`` and resolves through the
+DataLoader execution context. There is no HTTP round trip and no schema
+introspection, and the jobs keep their query documents and result shapes.
+Mutations run in a transaction when ``ATOMIC_MUTATIONS`` is set, and
+invalidate the response cache as they do through the view. Queries read
+from a replica when there are any (see ``crm.routers``).
+
+When ``CRM_GRAPHQL_CLIENT['URL']`` is set, operations go to that endpoint
+instead. Each process uses one gql session for all of them: a pooled
+keep-alive ``requests`` session with the schema introspected once.
+"""
+
+import threading
+from functools import lru_cache
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db import connection, transaction
+from graphene_django.settings import graphene_settings
+from graphql import OperationType, get_operation_ast
+
+from .documents import get_document
+from .execution import execute_sync
+from .response_cache import invalidate, mutation_tags
+from .routers import use_replica
+from .transactions import write_atomic
+
+DEFAULTS = {
+    'URL': None,
+    'TIMEOUT': 30,
+    'RETRIES': 3,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_CLIENT', {})}
+
+
+class GraphQLClientError(Exception):
+    """An operation returned errors; ``errors`` holds them as sent."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(str(getattr(error, 'message', error)) for error in errors))
+
+
+def execute(query, variables=None, operation_name=None):
+    """
+    Runs the operation ``query`` and returns its ``data`` as a JSON-like
+    dict. Raises GraphQLClientError if the result has errors.
+    """
+    url = get_config()['URL']
+    if url:
+        return execute_remote(url, query, variables, operation_name)
+    return execute_local(query, variables, operation_name)
+
+
+def execute_local(query, variables=None, operation_name=None):
+    schema = graphene_settings.SCHEMA.graphql_schema
+    document, errors = get_document(schema, query)
+    if errors:
+        raise GraphQLClientError(errors)
+    operation = get_operation_ast(document, operation_name)
+    is_mutation = operation is not None and operation.operation == OperationType.MUTATION
+
+    def run():
+        return execute_sync(
+            schema,
+            document,
+            context_value=SimpleNamespace(),
+            variable_values=variables,
+            operation_name=operation_name,
+        )
+
+    if is_mutation and (
+        graphene_settings.ATOMIC_MUTATIONS is True
+        or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+    ):
+        with write_atomic():
+            result = run()
+            if result.errors:
+                transaction.set_rollback(True)
+    elif is_mutation:
+        result = run()
+    else:
+        with use_replica():
+            result = run()
+
+    if result.errors:
+        raise GraphQLClientError(result.errors)
+    if is_mutation:
+        invalidate(*mutation_tags(operation))
+    return result.data
+
+
+# --- Remote endpoint ---
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_remote_session(url):
+    """The process-wide gql session for ``url``, connected on first use."""
+    with _sessions_lock:
+        session = _sessions.get(url)
+        if session is None:
+            # Only needed when a remote endpoint is configured.
+            from gql import Client
+            from gql.transport.requests import RequestsHTTPTransport
+
+            config = get_config()
+            transport = RequestsHTTPTransport(
+                url=url, verify=True, retries=config['RETRIES'], timeout=config['TIMEOUT'],
+            )
+            client = Client(transport=transport, fetch_schema_from_transport=True)
+            # Opens the pooled session and fetches the schema once.
+            session = _sessions[url] = client.connect_sync()
+        return session
+
+
+@lru_cache(maxsize=64)
+def parse_remote(query):
+    from gql import gql
+    return gql(query)
+
+
+def execute_remote(url, query, variables=None, operation_name=None):
+    from gql.transport.exceptions import TransportQueryError
+
+    try:
+        return get_remote_session(url).execute(
+            parse_remote(query), variable_values=variables, operation_name=operation_name,
+        )
+    except TransportQueryError as e:
+        raise GraphQLClientError(e.errors or [str(e)]) from e
@@ -0,0 +1,160 @@
+# crm/cost.py
+
+"""
+Static query cost and depth analysis.
+
+``QueryCostRule`` is a validation rule that walks the selected operation
+before anything executes. Every field costs ``QUERY_COSTS['Type.field']``,
+or by default 1 for object fields and 0 for scalars. A connection multiplies
+the cost of its selection by ``first``/``last``, or by
+``RELAY_CONNECTION_MAX_LIMIT`` when neither is given; so does a list that
+takes ``first`` (``Query.orders``). Any other list multiplies it by
+``DEFAULT_LIST_SIZE``. Operations deeper than
+``MAX_QUERY_DEPTH`` or costlier than ``MAX_QUERY_COST`` are rejected.
+
+All limits are read from the ``GRAPHENE`` setting.
+"""
+
+from django.conf import settings
+from graphene_django.settings import graphene_settings
+from graphql import (
+    FieldNode,
+    FragmentSpreadNode,
+    GraphQLError,
+    GraphQLInt,
+    InlineFragmentNode,
+    ValidationRule,
+    get_named_type,
+    get_nullable_type,
+    is_composite_type,
+    is_list_type,
+    value_from_ast,
+)
+from graphql.execution.values import get_variable_values
+from graphql.language import visitor
+
+DEFAULTS = {
+    'MAX_QUERY_DEPTH': 10,
+    'MAX_QUERY_COST': 10000,
+    'QUERY_COSTS': {},
+    'DEFAULT_LIST_SIZE': 10,
+}
+
+
+def get_config():
+    graphene = getattr(settings, 'GRAPHENE', {})
+    return {name: graphene.get(name, default) for name, default in DEFAULTS.items()}
+
+
+def is_connection(graphql_type):
+    return get_named_type(graphql_type).name.endswith('Connection')
+
+
+class QueryCostRule(ValidationRule):
+    """
+    Rejects operations over the depth or cost limits.
+
+    Use ``QueryCostRule.bind(variables, operation_name)`` to get a rule class
+    that reads ``first``/``last`` from the request variables; the measured
+    ``cost`` and ``depth`` are left on ``rule.result`` of the bound class.
+    """
+
+    variables = None
+    operation_name = None
+    result = None
+
+    @classmethod
+    def bind(cls, variables=None, operation_name=None):
+        return type(cls.__name__, (cls,), {
+            'variables': variables or {},
+            'operation_name': operation_name,
+            'result': {},
+        })
+
+    def __init__(self, context):
+        super().__init__(context)
+        self.config = get_config()
+        self.max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+
+    def enter_operation_definition(self, node, *args):
+        name = node.name.value if node.name else None
+        if self.operation_name is not None and name != self.operation_name:
+            return visitor.SKIP
+
+        schema = self.context.schema
+        coerced = get_variable_values(schema, node.variable_definitions, self.variables or {})
+        if isinstance(coerced, dict):
+            self.variables = coerced
+        root_type = schema.get_root_type(node.operation)
+        cost, depth = self.measure(root_type, node.selection_set, 1)
+        if self.result is not None:
+            self.result.update(cost=cost, depth=depth)
+
+        max_depth = self.config['MAX_QUERY_DEPTH']
+        if max_depth is not None and depth > max_depth:
+            self.report_error(GraphQLError(
+                f"Query depth {depth} exceeds the maximum of {max_depth}.",
+                node, extensions={'code': 'QUERY_TOO_DEEP', 'depth': depth},
+            ))
+        max_cost = self.config['MAX_QUERY_COST']
+        if max_cost is not None and cost > max_cost:
+            self.report_error(GraphQLError(
+                f"Query cost {cost} exceeds the maximum of {max_cost}.",
+                node, extensions={'code': 'QUERY_TOO_COSTLY', 'cost': cost},
+            ))
+        return visitor.SKIP
+
+    def measure(self, parent_type, selection_set, depth):
+        """Returns ``(cost, depth)`` of a selection set on ``parent_type``."""
+        total, max_depth = 0, depth - 1
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                cost, field_depth = self.measure_field(parent_type, selection, depth)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = self.context.schema.get_type(selection.type_condition.name.value)
+                cost, field_depth = self.measure(fragment_type, selection.selection_set, depth)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = self.context.get_fragment(selection.name.value)
+                if fragment is None:
+                    continue
+                fragment_type = self.context.schema.get_type(fragment.type_condition.name.value)
+                cost, field_depth = self.measure(fragment_type, fragment.selection_set, depth)
+            else:
+                continue
+            total += cost
+            max_depth = max(max_depth, field_depth)
+        return total, max_depth
+
+    def measure_field(self, parent_type, node, depth):
+        name = node.name.value
+        fields = getattr(parent_type, 'fields', None)
+        # Introspection is cheap and deeply nested; leave it out.
+        if name.startswith('__') or not fields or name not in fields:
+            return 0, depth - 1
+
+        field = fields[name]
+        named_type = get_named_type(field.type)
+        cost = self.config['QUERY_COSTS'].get(
+            f"{parent_type.name}.{name}", 1 if is_composite_type(named_type) else 0
+        )
+        if not node.selection_set:
+            return cost, depth
+
+        child_cost, child_depth = self.measure(named_type, node.selection_set, depth + 1)
+        return cost + self.multiplier(parent_type, field, node) * child_cost, child_depth
+
+    def multiplier(self, parent_type, field, node):
+        is_list = is_list_type(get_nullable_type(field.type))
+        if is_connection(field.type) or (is_list and 'first' in field.args):
+            for argument in node.arguments:
+                if argument.name.value in ('first', 'last'):
+                    value = value_from_ast(argument.value, GraphQLInt, self.variables)
+                    if isinstance(value, int):
+                        return max(value, 0)
+            return self.max_limit or 1
+        # edges are already counted by their connection
+        if is_list and not parent_type.name.endswith('Connection'):
+            return self.config['DEFAULT_LIST_SIZE']
+        return 1
@@ -1,7 +1,7 @@
 import logging
 from datetime import datetime
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+
+from crm.client import execute
 
 # Configure logging to append to a file
 logging.basicConfig(filename='/tmp/low_stock_updates_log.txt', level=logging.INFO,
@@ -11,13 +11,8 @@ def update_low_stock():
     # Generate timestamp in DD/MM/YYYY-HH:MM:SS format
     timestamp = datetime.now().strftime('%d/%m/%Y-%H:%M:%S')
 
-    # GraphQL endpoint
-    graphql_url = "http://localhost:8000/graphql"
-    transport = RequestsHTTPTransport(url=graphql_url, verify=True, retries=3)
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    # GraphQL mutation
-    mutation = gql("""
+    # GraphQL mutation (run in process, see crm/client.py)
+    mutation = """
         mutation {
             updateLowStockProducts {
                 updatedProducts {
@@ -27,10 +22,10 @@ def update_low_stock():
                 message
             }
         }
-    """)
+    """
 
     try:
-        result = client.execute(mutation)
+        result = execute(mutation)
         updated_products = result['updateLowStockProducts']['updatedProducts']
         message = result['updateLowStockProducts']['message']
 
@@ -53,18 +48,14 @@ def log_crm_heartbeat():
     # Log the heartbeat message
     logging.info(heartbeat_message)
 
-    # Verify GraphQL endpoint responsiveness with hello field
-    graphql_url = "http://localhost:8000/graphql"
-    transport = RequestsHTTPTransport(url=graphql_url, verify=True, retries=3)
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
+    # Verify the GraphQL schema responds with the hello field
     try:
-        query = gql("""
+        query = """
             query {
                 hello
             }
-        """)
-        result = client.execute(query)
+        """
+        result = execute(query)
         hello_message = result.get('hello', 'No response')
         logging.info(f"GraphQL endpoint responsive: {hello_message}")
     except Exception as e:
@@ -17,22 +17,10 @@ LOG_FILE="$LOG_DIR/customer_cleanup_log.txt"
 mkdir -p "$LOG_DIR"  # Create tmp directory if it doesn't exist
 echo "Log file set to: $LOG_FILE"
 
-# Run Django shell command and capture output, including timestamp in Python
-echo "Executing Django shell command..."
-DELETED_COUNT=$(python manage.py shell <<'EOF'
-from datetime import timedelta
-from django.utils import timezone
-from crm.models import Customer
-from time import strftime
-
-one_year_ago = timezone.now() - timedelta(days=365)
-inactive_customers = Customer.objects.exclude(orders__created_at__gte=one_year_ago)
-count = inactive_customers.count()
-inactive_customers.delete()
-timestamp = strftime('%Y-%m-%d %H:%M:%S')
-print(f"{timestamp} - Deleted {count} inactive customers.")
-EOF
-)
+# Run the batched cleanup command (crm/cleanup.py); its last line is the summary
+echo "Executing cleanup command..."
+OUTPUT=$(python manage.py clean_inactive_customers)
+DELETED_COUNT=$(echo "$OUTPUT" | tail -n 1)
 echo "Shell command output: $DELETED_COUNT"
 
 # Check if DELETED_COUNT is empty (error occurred) and log it
@@ -41,6 +29,6 @@ if [ -z "$DELETED_COUNT" ]; then
     echo "$ERROR_TIMESTAMP - Error during cleanup. Check Django logs or script output." >> "$LOG_FILE"
     echo "Error logged due to empty DELETED_COUNT"
 else
-    echo "$DELETED_COUNT" >> "$LOG_FILE"
+    echo "$OUTPUT" >> "$LOG_FILE"
     echo "Successfully logged deletion count"
 fi
\ No newline at end of file
@@ -1,57 +1,37 @@
-import requests
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+import os
+import sys
 from datetime import timedelta, datetime
 import logging
 
-# Configure logging to append to a file
-logging.basicConfig(filename='E:/Coding Workspace/ALX/alx-backend-graphql_crm/tmp/order_reminders_log.txt', level=logging.INFO,
-                    format='%(asctime)s - %(message)s')
+import django
 
-# GraphQL endpoint (adjust if your server runs on a different port or host)
-url = "http://localhost:8000/graphql"
-transport = RequestsHTTPTransport(url=url, verify=True, retries=3)
-client = Client(transport=transport, fetch_schema_from_transport=True)
+# Uses the models and Celery tasks of the project, so the script sets up
+# Django from the project root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alx_backend_graphql_crm.settings')
+django.setup()
 
-# Test connection before query
-try:
-    response = requests.get(url)
-    response.raise_for_status()
-    logging.info("Successfully connected to GraphQL endpoint")
-except requests.exceptions.RequestException as e:
-    logging.error(f"Connection test failed: {str(e)}")
-    print(f"Connection test failed: {str(e)}")
-    exit(1)
+from crm import reminders  # noqa: E402
+from crm.tasks import send_order_reminders  # noqa: E402
 
-# GraphQL query to get pending orders from the last 7 days
-query = gql("""
-    query {
-        orders(order_date_Gte: "%s") {
-            id
-            order_date
-            customer {
-                email
-            }
-        }
-    }
-""" % (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d'))
+# Configure logging to append to a file
+logging.basicConfig(filename='E:/Coding Workspace/ALX/alx-backend-graphql_crm/tmp/order_reminders_log.txt', level=logging.INFO,
+                    format='%(asctime)s - %(message)s')
 
-# Execute the query
+# Pending orders go to the Celery pipeline in chunks (see crm/reminders.py).
+# With --local the chunks run one after the other in this process instead.
 try:
-    result = client.execute(query)
-    orders = result.get('orders', [])
-
-    if orders:
-        for order in orders:
-            order_id = order['id']
-            customer_email = order['customer']['email']
-            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            log_message = f"Order ID: {order_id}, Customer Email: {customer_email}"
-            logging.info(log_message)
+    if '--local' in sys.argv[1:]:
+        config = reminders.get_config()
+        since = datetime.now().astimezone() - timedelta(days=config['DAYS'])
+        reminders.summarize([
+            reminders.send_reminders(since, first_id, last_id)
+            for first_id, last_id in reminders.order_ranges(since, config['CHUNK_SIZE'])
+        ])
     else:
-        logging.info("No pending orders found in the last 7 days.")
+        send_order_reminders.delay()
 
     print("Order reminders processed!")
 except Exception as e:
     logging.error(f"Error processing order reminders: {str(e)}")
-    print(f"Error processing order reminders: {str(e)}")
\ No newline at end of file
+    print(f"Error processing order reminders: {str(e)}")
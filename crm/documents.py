@@ -0,0 +1,173 @@
+# crm/documents.py
+
+"""
+Parsed-document cache and automatic persisted queries.
+
+``get_document`` keeps a bounded LRU of parsed and validated DocumentNodes,
+keyed by the SHA-256 of the query text, so a repeated operation skips
+``parse()`` and ``validate()``. ``resolve_persisted_query`` implements the
+automatic persisted query protocol: the client sends
+``extensions.persistedQuery.sha256Hash`` alone, and the full query text
+only after a ``PersistedQueryNotFound`` reply. Known hashes are stored in a
+Django cache so every worker can serve them. Give that cache its own alias:
+sharing one with the response cache lets response churn evict the stored
+queries and send clients back through the NotFound round trip.
+
+Configured through ``CRM_GRAPHQL_DOCUMENTS``.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import GraphQLError, parse, validate
+
+DEFAULTS = {
+    'CACHE_SIZE': 500,
+    'PERSISTED_QUERIES': True,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': None,
+}
+
+KEY_PREFIX = 'graphql-apq'
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_DOCUMENTS', {})}
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+class DocumentCache:
+    """Bounded LRU of parsed and validated documents."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, schema, query, timings=None):
+        """
+        Returns ``(document, errors)`` for ``query``. Only documents that
+        validate against ``schema`` are kept; ``document`` is None when the
+        query does not parse. ``timings``, if given, receives the parse and
+        validate durations in milliseconds (zero on a cache hit).
+        """
+        key = (schema, query_hash(query))
+        with self._lock:
+            document = self._entries.get(key)
+            if document is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if timings is not None:
+            timings.setdefault('parse', 0)
+            timings.setdefault('validate', 0)
+        if document is not None:
+            return document, []
+
+        start = time.perf_counter()
+        try:
+            document = parse(query)
+        except GraphQLError as e:
+            return None, [e]
+        finally:
+            if timings is not None:
+                timings['parse'] += round((time.perf_counter() - start) * 1000, 3)
+
+        start = time.perf_counter()
+        errors = validate(schema, document)
+        if timings is not None:
+            timings['validate'] += round((time.perf_counter() - start) * 1000, 3)
+        if errors:
+            return document, errors
+
+        with self._lock:
+            self._entries[key] = document
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return document, []
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_document_cache = None
+
+
+def get_document_cache():
+    global _document_cache
+    size = get_config()['CACHE_SIZE']
+    if _document_cache is None or _document_cache.maxsize != size:
+        _document_cache = DocumentCache(size)
+    return _document_cache
+
+
+def get_document(schema, query, timings=None):
+    """Parses and validates ``query``, reusing earlier results."""
+    return get_document_cache().get(schema, query, timings)
+
+
+def get_extensions(request, data):
+    """Returns the request ``extensions`` object (GET parameter or body)."""
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise GraphQLError("Extensions must be a JSON object.")
+    return extensions or {}
+
+
+def resolve_persisted_query(query, extensions):
+    """
+    Returns the query text for a request, looking it up (or storing it) by
+    ``extensions.persistedQuery.sha256Hash`` when one is given.
+    """
+    persisted = extensions.get('persistedQuery') if isinstance(extensions, dict) else None
+    if not persisted:
+        return query
+
+    config = get_config()
+    if not config['PERSISTED_QUERIES']:
+        raise GraphQLError(
+            'PersistedQueryNotSupported', extensions={'code': 'PERSISTED_QUERY_NOT_SUPPORTED'}
+        )
+    if persisted.get('version') != 1:
+        raise GraphQLError("Unsupported persisted query version.")
+    digest = persisted.get('sha256Hash')
+    if not isinstance(digest, str):
+        raise GraphQLError("Persisted query is missing its sha256Hash.")
+
+    cache = caches[config['CACHE_ALIAS']]
+    key = f"{KEY_PREFIX}:{digest}"
+    if query:
+        if query_hash(query) != digest:
+            raise GraphQLError(
+                "Provided sha256Hash does not match the query.",
+                extensions={'code': 'PERSISTED_QUERY_HASH_MISMATCH'},
+            )
+        cache.set(key, query, config['TIMEOUT'])
+        return query
+
+    query = cache.get(key)
+    if query is None:
+        raise GraphQLError(
+            'PersistedQueryNotFound', extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'}
+        )
+    return query
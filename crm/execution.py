@@ -0,0 +1,245 @@
+# crm/execution.py
+
+"""
+Execution contexts for the CRM schema.
+
+graphql-core 3 only understands coroutines, so a resolver returning a
+``Promise`` (for example from a ``crm.loaders`` DataLoader) would otherwise be
+completed as a plain value. ``DataLoaderExecutionContext`` defers such fields:
+every sibling field is resolved first, which queues all of their loader keys,
+and the pending promises are only drained once the whole operation has been
+walked. ``Promise`` also defines ``__await__``, which graphql-core's
+awaitable check would take for a coroutine, so the context leaves promises
+out of that check; it works with a plain ``graphql.execute`` call.
+
+``ConcurrentExecutionContext`` additionally resolves the root fields of a
+query in parallel on a bounded thread pool (``CRM_GRAPHQL_CONCURRENCY``).
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from copy import copy
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from graphql import ExecutionContext, OperationType, execute, located_error
+from graphql.execution.execute import assume_not_awaitable
+from graphql.execution.collect_fields import collect_fields
+from graphql.pyutils import Path, Undefined, is_awaitable as default_is_awaitable
+from promise import Promise
+
+from .tracing import capture_sql
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_WORKERS': 8,
+    'MAX_FIELDS_PER_REQUEST': 4,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_CONCURRENCY', {})}
+
+
+def in_event_loop():
+    """
+    Whether the caller runs on an asyncio event loop (the async view), where
+    resolvers must return awaitables and use the async ORM instead of
+    blocking on the database.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class DataLoaderExecutionContext(ExecutionContext):
+    """Completes ``Promise`` results lazily so DataLoaders can batch them."""
+
+    @staticmethod
+    def is_awaitable(value):
+        # Promises are completed by complete_value, never awaited.
+        return not isinstance(value, Promise) and default_is_awaitable(value)
+
+    def execute_operation(self, operation, root_value):
+        # Running the operation as a promise job keeps the promise queue from
+        # draining until every field of the current level has been resolved,
+        # so loader dispatches are queued behind them instead of firing per
+        # field.
+        parent = super()
+        data = Promise.resolve(None).then(
+            lambda _: parent.execute_operation(operation, root_value)
+        ).get()
+        return self.resolve_deferred(data)
+
+    def complete_value(self, return_type, field_nodes, info, path, result):
+        if not Promise.is_thenable(result):
+            return super().complete_value(return_type, field_nodes, info, path, result)
+
+        def on_resolve(value):
+            return self.complete_value(return_type, field_nodes, info, path, value)
+
+        def on_error(raw_error):
+            error = located_error(raw_error, field_nodes, path.as_list())
+            self.handle_field_error(error, return_type, path)
+            return None
+
+        return Promise.resolve(result).then(on_resolve).catch(on_error)
+
+    def resolve_deferred(self, value):
+        """
+        Replaces every pending promise in the completed result with its value.
+
+        The first ``get()`` drains the promise queue, which dispatches every
+        loader batch queued so far in one go.
+        """
+        if Promise.is_thenable(value):
+            try:
+                value = Promise.resolve(value).get()
+            except Exception as error:
+                # A non-null field failed after being deferred; null it out
+                # here since its parent has already been completed.
+                self.collected_errors.errors.append(error)
+                return None
+            return self.resolve_deferred(value)
+        if isinstance(value, dict):
+            return {key: self.resolve_deferred(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.resolve_deferred(item) for item in value]
+        return value
+
+
+def execute_sync(schema, document, execution_context_class=DataLoaderExecutionContext, **kwargs):
+    """
+    ``graphql.execute`` for synchronous callers (the sync view,
+    ``crm.client``). As in ``graphql_sync``, no result is taken for an
+    awaitable, so resolvers never run as coroutines.
+    """
+    return execute(
+        schema,
+        document,
+        execution_context_class=execution_context_class,
+        is_awaitable=assume_not_awaitable,
+        **kwargs,
+    )
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns the process-wide pool for root fields (``MAX_WORKERS`` threads)."""
+    global _executor
+    size = get_config()['MAX_WORKERS']
+    with _executor_lock:
+        if _executor is None or _executor[0] != size:
+            _executor = size, ThreadPoolExecutor(size, thread_name_prefix='graphql-field')
+        return _executor[1]
+
+
+def fork_context(context):
+    """A shallow copy of ``context`` without its loaders, for another thread."""
+    if context is None:
+        return None
+    context = copy(context)
+    if isinstance(context, dict):
+        context.pop('loaders', None)
+    elif hasattr(context, '__dict__'):
+        context.__dict__.pop('loaders', None)
+    return context
+
+
+class ConcurrentExecutionContext(DataLoaderExecutionContext):
+    """
+    Resolves the root fields of a query in parallel.
+
+    Each root field runs on the shared pool in a child context with its own
+    promise queue, loaders and (thread-local) database connection, and at
+    most ``MAX_FIELDS_PER_REQUEST`` fields of one request run at a time. A
+    query then takes about as long as its slowest root field instead of the
+    sum of all of them. Mutations, single-field queries and requests inside
+    a transaction or on an in-memory SQLite database, whose rows other
+    threads cannot see, execute as usual.
+    """
+
+    def execute_operation(self, operation, root_value):
+        config = get_config()
+        if not (
+            config['ENABLED']
+            and config['MAX_FIELDS_PER_REQUEST'] > 1
+            and operation.operation == OperationType.QUERY
+            and not connection.in_atomic_block
+            and not (connection.vendor == 'sqlite' and connection.is_in_memory_db())
+        ):
+            return super().execute_operation(operation, root_value)
+
+        root_type = self.schema.query_type
+        root_fields = collect_fields(
+            self.schema, self.fragments, self.variable_values, root_type, operation.selection_set
+        )
+        if len(root_fields) < 2:
+            return super().execute_operation(operation, root_value)
+
+        # Every task takes the next field until none are left, so a request
+        # never occupies more than MAX_FIELDS_PER_REQUEST pool threads.
+        pending = iter(root_fields.items())
+        lock = threading.Lock()
+
+        def run():
+            results = {}
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return results
+                response_name, field_nodes = item
+                results[response_name] = self.execute_root_field(
+                    root_type, root_value, response_name, field_nodes
+                )
+
+        executor = get_executor()
+        tasks = min(config['MAX_FIELDS_PER_REQUEST'], len(root_fields))
+        # Each task runs in a copy of this context, which carries the read
+        # replica routing (crm.routers).
+        futures = [executor.submit(copy_context().run, run) for _ in range(tasks)]
+        results = {}
+        for future in futures:
+            results.update(future.result())
+        return {
+            name: results[name]
+            for name in root_fields
+            if results.get(name, Undefined) is not Undefined
+        }
+
+    def execute_root_field(self, root_type, root_value, response_name, field_nodes):
+        """Resolves one root field completely; runs on a pool thread."""
+        context = fork_context(self.context_value)
+        child = DataLoaderExecutionContext(
+            self.schema,
+            self.fragments,
+            root_value,
+            context,
+            self.operation,
+            self.variable_values,
+            self.field_resolver,
+            self.type_resolver,
+            self.subscribe_field_resolver,
+            self.collected_errors,
+            self.middleware_manager,
+            self.is_awaitable,
+        )
+        path = Path(None, response_name, root_type.name)
+        try:
+            with capture_sql(context):
+                data = Promise.resolve(None).then(
+                    lambda _: child.execute_field(root_type, root_value, field_nodes, path)
+                ).get()
+                return child.resolve_deferred(data)
+        finally:
+            # Pool threads keep their connection only as long as CONN_MAX_AGE
+            # allows, as request threads do.
+            close_old_connections()
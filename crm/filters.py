@@ -1,10 +1,111 @@
 # crm/filters.py
 
+import threading
+import time
+
 import django_filters
-from .models import Customer, Product, Order
+from django.db.models import BooleanField, Exists, Expression, OuterRef, Q
+from django_filters.constants import EMPTY_VALUES
+
+from . import search
+from .execution import in_event_loop
+from .models import Customer, Order, OrderItem, Product
+
+
+# Line count from which an order-product filter pages with EXISTS
+# (see OrderFilter.with_lines).
+SELECTIVE_LINES = 10_000
+# How long the line count of a filter is reused, and for how many filters.
+PLAN_CACHE_SECONDS = 300
+PLAN_CACHE_SIZE = 1000
+
+_broad_lines = {}
+_broad_lines_lock = threading.Lock()
+
+
+def lines_are_broad(lines, probe=True):
+    """
+    Whether ``lines`` reaches ``SELECTIVE_LINES``. The bounded count runs at
+    most once per ``PLAN_CACHE_SECONDS`` for the same lines query; match
+    counts move slowly, and a stale answer only picks the slower plan, never
+    different rows. Without ``probe`` an uncached answer is None.
+    """
+    sql, params = lines.query.sql_with_params()
+    key = (lines.db, sql, params)
+    now = time.monotonic()
+    with _broad_lines_lock:
+        cached = _broad_lines.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    if not probe:
+        return None
+    broad = lines[:SELECTIVE_LINES].count() >= SELECTIVE_LINES
+    with _broad_lines_lock:
+        _broad_lines.pop(key, None)
+        if len(_broad_lines) >= PLAN_CACHE_SIZE:
+            del _broad_lines[next(iter(_broad_lines))]
+        _broad_lines[key] = (now + PLAN_CACHE_SECONDS, broad)
+    return broad
+
+
+def clear_plan_cache():
+    with _broad_lines_lock:
+        _broad_lines.clear()
+
+
+class LinesSemiJoin(Expression):
+    """
+    ``id IN (lines)`` in counts, and a correlated ``EXISTS`` over
+    ``per_order`` in pages. A page of a broad filter then walks the ordering
+    index and stops after its first rows, instead of sorting every match.
+    """
+
+    conditional = True
+    output_field = BooleanField()
+
+    def __init__(self, lines, per_order):
+        super().__init__()
+        self.membership = Q(id__in=lines.values('order_id'))
+        self.exists = Exists(per_order.filter(order=OuterRef('pk')))
+
+    def get_source_expressions(self):
+        return [self.membership, self.exists]
+
+    def set_source_expressions(self, exprs):
+        self.membership, self.exists = exprs
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(self.exists if compiler.query.is_sliced else self.membership)
 
 
-class CustomerFilter(django_filters.FilterSet):
+class ContainsFilter(django_filters.CharFilter):
+    """``icontains`` filter served by the search index where there is one (see crm/search.py)."""
+
+    def filter(self, qs, value):
+        if value in EMPTY_VALUES:
+            return qs
+        if self.distinct:
+            qs = qs.distinct()
+        return search.contains(qs, self.field_name, value)
+
+
+class SearchFilterSet(django_filters.FilterSet):
+    """FilterSet whose ``icontains`` lookups use ContainsFilter, plus a ranked ``search``."""
+
+    search = django_filters.CharFilter(method='filter_search', label="Search (best match first)")
+
+    @classmethod
+    def filter_for_lookup(cls, field, lookup_type):
+        filter_class, params = super().filter_for_lookup(field, lookup_type)
+        if lookup_type == 'icontains':
+            filter_class = ContainsFilter
+        return filter_class, params
+
+    def filter_search(self, queryset, name, value):
+        return search.search(queryset, value)
+
+
+class CustomerFilter(SearchFilterSet):
     # Custom filter for phone number pattern (e.g., starts with a specific prefix)
     phone_pattern = django_filters.CharFilter(method='filter_by_phone_pattern', label="Phone starts with")
 
@@ -27,11 +128,15 @@ class CustomerFilter(django_filters.FilterSet):
         }
 
     def filter_by_phone_pattern(self, queryset, name, value):
-        # This custom method is linked to the 'phone_pattern' filter
-        return queryset.filter(phone__startswith=value)
+        # This custom method is linked to the 'phone_pattern' filter.
+        # The range lets the phone index serve the prefix on every backend
+        # (SQLite's LIKE is case-insensitive and cannot use a plain index).
+        return queryset.filter(
+            phone__gte=value, phone__lt=value + '\U0010ffff', phone__startswith=value
+        )
 
 
-class ProductFilter(django_filters.FilterSet):
+class ProductFilter(SearchFilterSet):
     # Custom filter for finding products with low stock
     low_stock = django_filters.BooleanFilter(method='filter_low_stock', label="Low Stock (less than 10)")
 
@@ -57,13 +162,19 @@ class ProductFilter(django_filters.FilterSet):
         return queryset
 
 
-class OrderFilter(django_filters.FilterSet):
+class OrderFilter(SearchFilterSet):
+    # Orders have no index of their own: ``search`` matches the indexed
+    # customer and product columns, and keeps the requested ordering.
+    search = django_filters.CharFilter(method='filter_search', label="Customer or product contains")
+
     # Filters for related fields
-    customer_name = django_filters.CharFilter(field_name='customer__name', lookup_expr='icontains')
-    product_name = django_filters.CharFilter(field_name='products__name', lookup_expr='icontains')
+    customer_name = ContainsFilter(field_name='customer__name', lookup_expr='icontains')
+    # The product filters are id__in subqueries over the order lines rather
+    # than joins, which would repeat an order once per matching line.
+    product_name = django_filters.CharFilter(method='filter_product_name', label="Product name contains")
 
     # Challenge: Filter orders that contain a specific product ID
-    product_id = django_filters.NumberFilter(field_name='products__id', lookup_expr='exact')
+    product_id = django_filters.NumberFilter(method='filter_product_id', label="Product ID")
 
     order_by = django_filters.OrderingFilter(
         fields=(
@@ -77,4 +188,44 @@ class OrderFilter(django_filters.FilterSet):
         fields = {
             'total_amount': ['gte', 'lte'],
             'order_date': ['gte', 'lte'],
-        }
\ No newline at end of file
+        }
+
+    def filter_search(self, queryset, name, value):
+        # Every term in the customer's name or email, or in the name of a
+        # product on one of the order's lines.
+        customers = Customer.objects.all()
+        for term in value.split():
+            lines = search.contains(OrderItem.objects.all(), 'product__name', term)
+            queryset = queryset.filter(
+                Q(customer__in=search.contains(customers, 'name', term))
+                | Q(customer__in=search.contains(customers, 'email', term))
+                | Q(id__in=lines.values('order_id'))
+            )
+        return queryset
+
+    def filter_product_name(self, queryset, name, value):
+        products = search.contains(Product.objects.all(), 'name', value)
+        return self.with_lines(
+            queryset,
+            OrderItem.objects.filter(product__in=products),
+            # Checking an order's own lines by name beats seeking each of
+            # the matching products in them.
+            per_order=OrderItem.objects.filter(product__name__icontains=value),
+        )
+
+    def filter_product_id(self, queryset, name, value):
+        return self.with_lines(queryset, OrderItem.objects.filter(product_id=value))
+
+    def with_lines(self, queryset, lines, per_order=None):
+        """
+        Orders with at least one of ``lines``, as a semi-join so no order
+        repeats. Selective filters are ``id IN (lines)``, which reads only the
+        matching orders. Broader ones, whose lines reach ``SELECTIVE_LINES``
+        (``lines_are_broad``), are a ``LinesSemiJoin`` over ``per_order``
+        (default ``lines``). The async view cannot query here, so it uses
+        ``IN`` unless the count is cached.
+        """
+        if not lines_are_broad(lines, probe=not in_event_loop()):
+            return queryset.filter(id__in=lines.values('order_id'))
+        per_order = lines if per_order is None else per_order
+        return queryset.filter(LinesSemiJoin(lines, per_order))
@@ -0,0 +1,133 @@
+# crm/importers.py
+
+"""
+Streaming CSV/NDJSON import of customers and products.
+
+Input is consumed line by line and written through ``crm.bulk`` in fixed-size
+batches, each in its own transaction, so memory use does not grow with the
+size of the file. Used by the ``import_crm_data`` management command and the
+``import/<kind>/`` upload endpoint.
+"""
+
+import csv
+import json
+import time
+
+from .bulk import create_customers, create_products
+from .transactions import write_atomic
+
+IMPORTERS = {
+    'customers': lambda rows, batch_size: create_customers(rows, batch_size, validate_fields=True),
+    'products': create_products,
+}
+
+FORMATS = ('csv', 'ndjson')
+
+# Rejected rows kept on the report; the rest are only counted (and passed to
+# the on_batch callback) so a bad file cannot exhaust memory.
+MAX_REPORTED_ERRORS = 1000
+
+
+def guess_format(name=None, content_type=None):
+    """Picks ``ndjson`` for .ndjson/.jsonl files or NDJSON content types."""
+    if content_type and ('ndjson' in content_type or 'jsonlines' in content_type):
+        return 'ndjson'
+    if name and name.lower().endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return 'csv'
+
+
+def decode_lines(lines, encoding='utf-8'):
+    """Decodes an iterable of byte lines (files, uploads, requests) lazily."""
+    for line in lines:
+        yield line.decode(encoding) if isinstance(line, bytes) else line
+
+
+def read_csv(lines):
+    """Yields one dict per CSV record; empty cells become None."""
+    for record in csv.DictReader(decode_lines(lines)):
+        yield {key: (value if value != '' else None) for key, value in record.items()}
+
+
+def read_ndjson(lines):
+    """Yields one dict per non-blank line, or a ValueError for a bad line."""
+    for line in decode_lines(lines):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(record, dict):
+            yield ValueError("Each NDJSON line must be a JSON object.")
+            continue
+        yield record
+
+
+class ImportReport:
+    """Counters and timing for one import run."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.created = 0
+        self.rejected = 0
+        self.batches = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self.seconds = 0.0
+
+    @property
+    def processed(self):
+        return self.created + self.rejected
+
+    @property
+    def rows_per_second(self):
+        return self.processed / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'processed': self.processed,
+            'created': self.created,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'seconds': round(self.seconds, 3),
+            'rowsPerSecond': round(self.rows_per_second, 1),
+            'errors': self.errors,
+        }
+
+
+def import_rows(kind, lines, fmt='csv', batch_size=None, on_batch=None):
+    """
+    Imports ``kind`` ('customers' or 'products') from an iterable of lines.
+
+    ``on_batch(report, errors)`` is called after every committed batch.
+    Returns the final ImportReport.
+    """
+    if kind not in IMPORTERS:
+        raise ValueError(f"Unknown import kind '{kind}'; expected one of {', '.join(IMPORTERS)}.")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'; expected one of {', '.join(FORMATS)}.")
+
+    rows = read_ndjson(lines) if fmt == 'ndjson' else read_csv(lines)
+    report = ImportReport(kind)
+    batches = IMPORTERS[kind](rows, batch_size)
+    while True:
+        # Each batch commits on its own so locks are held briefly and a
+        # failure late in the file keeps the earlier batches.
+        with write_atomic():
+            batch = next(batches, None)
+        if batch is None:
+            break
+        created, errors = batch
+        report.batches += 1
+        report.created += len(created)
+        report.rejected += len(errors)
+        report.errors.extend(errors[:MAX_REPORTED_ERRORS - len(report.errors)])
+        report.seconds = time.monotonic() - report.started
+        if on_batch is not None:
+            on_batch(report, errors)
+
+    report.seconds = time.monotonic() - report.started
+    return report
@@ -0,0 +1,248 @@
+# crm/loaders.py
+
+"""
+Per-request DataLoaders for the CRM GraphQL types.
+
+Each loader collects the keys requested while a level of the query is being
+resolved and fetches them with a single ``IN (...)`` query once the execution
+context drains its pending promises (see ``crm.execution``).
+
+Under the async view the same batches run through ``AsyncDataLoader``: keys
+requested during one event loop iteration are fetched together with the
+async ORM, and ``load()`` returns an ``asyncio.Future``.
+"""
+
+import asyncio
+from collections import defaultdict
+
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .execution import in_event_loop
+from .models import Customer, Order, OrderItem, Product
+
+
+class AsyncDataLoader:
+    """asyncio counterpart of ``promise.dataloader.DataLoader``."""
+
+    def __init__(self):
+        self.cache = {}
+        self.queue = []
+
+    def load(self, key):
+        future = self.cache.get(key)
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        future = self.cache[key] = loop.create_future()
+        self.queue.append((key, future))
+        if len(self.queue) == 1:
+            # Runs once the resolvers of the current level have all queued
+            # their keys.
+            loop.call_soon(lambda: loop.create_task(self.dispatch()))
+        return future
+
+    async def dispatch(self):
+        queue, self.queue = self.queue, []
+        try:
+            values = await self.batch_load([key for key, _ in queue])
+        except Exception as e:
+            for _, future in queue:
+                future.set_exception(e)
+            return
+        for (_, future), value in zip(queue, values):
+            future.set_result(value)
+
+    async def batch_load(self, keys):
+        raise NotImplementedError
+
+
+class BatchLoader(DataLoader):
+    """Sync loader over ``queryset(keys)`` and ``group(keys, rows)``."""
+
+    def batch_load_fn(self, keys):
+        return Promise.resolve(self.group(keys, list(self.queryset(keys))))
+
+
+class AsyncBatchLoader(AsyncDataLoader):
+    """Async loader over ``queryset(keys)`` and ``group(keys, rows)``."""
+
+    async def batch_load(self, keys):
+        return self.group(keys, [row async for row in self.queryset(keys)])
+
+
+# --- Batches ---
+
+class CustomerBatch:
+    """Loads customers by primary key (``Order.customer``)."""
+
+    def queryset(self, keys):
+        return Customer.objects.filter(pk__in=keys)
+
+    def group(self, keys, rows):
+        customers = {customer.pk: customer for customer in rows}
+        return [customers.get(key) for key in keys]
+
+
+class ProductBatch:
+    """Loads products by primary key (``OrderItem.product``)."""
+
+    def queryset(self, keys):
+        return Product.objects.filter(pk__in=keys)
+
+    def group(self, keys, rows):
+        products = {product.pk: product for product in rows}
+        return [products.get(key) for key in keys]
+
+
+class OrderItemsBatch:
+    """Loads the line items of each order id (``Order.items``)."""
+
+    def queryset(self, keys):
+        return OrderItem.objects.filter(order_id__in=keys).order_by('order_id', 'product_id')
+
+    def group(self, keys, rows):
+        items_by_order = defaultdict(list)
+        for item in rows:
+            items_by_order[item.order_id].append(item)
+        return [items_by_order[key] for key in keys]
+
+
+class OrderProductsBatch:
+    """Loads the list of products for each order id (``Order.products``)."""
+
+    def queryset(self, keys):
+        return (
+            OrderItem.objects
+            .filter(order_id__in=keys)
+            .select_related('product')
+            .order_by('order_id', 'product_id')
+        )
+
+    def group(self, keys, rows):
+        products_by_order = defaultdict(list)
+        for row in rows:
+            products_by_order[row.order_id].append(row.product)
+        return [products_by_order[key] for key in keys]
+
+
+class CustomerOrdersBatch:
+    """Loads the list of orders for each customer id (``Customer.orders``)."""
+
+    def queryset(self, keys):
+        return Order.objects.filter(customer_id__in=keys).order_by('id')
+
+    def group(self, keys, rows):
+        orders_by_customer = defaultdict(list)
+        for order in rows:
+            orders_by_customer[order.customer_id].append(order)
+        return [orders_by_customer[key] for key in keys]
+
+
+class ProductOrdersBatch:
+    """Loads the list of orders for each product id (``Product.orders``)."""
+
+    def queryset(self, keys):
+        return (
+            OrderItem.objects
+            .filter(product_id__in=keys)
+            .select_related('order')
+            .order_by('product_id', 'order_id')
+        )
+
+    def group(self, keys, rows):
+        orders_by_product = defaultdict(list)
+        for row in rows:
+            orders_by_product[row.product_id].append(row.order)
+        return [orders_by_product[key] for key in keys]
+
+
+class CustomerLoader(CustomerBatch, BatchLoader):
+    pass
+
+
+class ProductLoader(ProductBatch, BatchLoader):
+    pass
+
+
+class OrderItemsLoader(OrderItemsBatch, BatchLoader):
+    pass
+
+
+class OrderProductsLoader(OrderProductsBatch, BatchLoader):
+    pass
+
+
+class CustomerOrdersLoader(CustomerOrdersBatch, BatchLoader):
+    pass
+
+
+class ProductOrdersLoader(ProductOrdersBatch, BatchLoader):
+    pass
+
+
+class AsyncCustomerLoader(CustomerBatch, AsyncBatchLoader):
+    pass
+
+
+class AsyncProductLoader(ProductBatch, AsyncBatchLoader):
+    pass
+
+
+class AsyncOrderItemsLoader(OrderItemsBatch, AsyncBatchLoader):
+    pass
+
+
+class AsyncOrderProductsLoader(OrderProductsBatch, AsyncBatchLoader):
+    pass
+
+
+class AsyncCustomerOrdersLoader(CustomerOrdersBatch, AsyncBatchLoader):
+    pass
+
+
+class AsyncProductOrdersLoader(ProductOrdersBatch, AsyncBatchLoader):
+    pass
+
+
+class Loaders:
+    """The set of loaders shared by every resolver of a single request."""
+
+    def __init__(self):
+        self.customer = CustomerLoader()
+        self.product = ProductLoader()
+        self.order_items = OrderItemsLoader()
+        self.order_products = OrderProductsLoader()
+        self.customer_orders = CustomerOrdersLoader()
+        self.product_orders = ProductOrdersLoader()
+
+
+class AsyncLoaders:
+    """The loaders of a single request executed by the async view."""
+
+    def __init__(self):
+        self.customer = AsyncCustomerLoader()
+        self.product = AsyncProductLoader()
+        self.order_items = AsyncOrderItemsLoader()
+        self.order_products = AsyncOrderProductsLoader()
+        self.customer_orders = AsyncCustomerOrdersLoader()
+        self.product_orders = AsyncProductOrdersLoader()
+
+
+def get_loaders(info):
+    """
+    Returns the loaders attached to ``info.context``, creating them on first use
+    so that every resolver in the same request shares one cache and one batch.
+    On an event loop these are the ``AsyncLoaders``.
+    """
+    name, factory = ('async_loaders', AsyncLoaders) if in_event_loop() else ('loaders', Loaders)
+    context = info.context
+    if context is None:
+        return factory()
+    if isinstance(context, dict):
+        return context.setdefault(name, factory())
+    loaders = getattr(context, name, None)
+    if loaders is None:
+        loaders = factory()
+        setattr(context, name, loaders)
+    return loaders
@@ -0,0 +1,147 @@
+# crm/management/commands/bench_filter_indexes.py
+
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from crm.filters import CustomerFilter, OrderFilter, ProductFilter
+from crm.models import Customer, Order, Product
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds customers, products and orders, runs the filtered and ordered connection "
+        "queries and checks through EXPLAIN that each one uses its index. Everything "
+        "runs in one transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=20, help="Timed runs of each query.")
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--explain', action='store_true', help="Print the full plans.")
+
+    def handle(self, *args, **options):
+        if min(options['customers'], options['products'], options['orders'], options['repeat']) < 1:
+            raise CommandError("--customers, --products, --orders and --repeat must be positive.")
+
+        failures = 0
+        try:
+            with transaction.atomic():
+                now = self.seed(options)
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                for label, index, queryset in self.cases(now):
+                    failures += not self.check(label, index, queryset[:options['page_size']], options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if failures:
+            raise CommandError(f"{failures} queries do not use their index.")
+        self.stdout.write(self.style.SUCCESS("Every query uses its index."))
+
+    def seed(self, options):
+        rng = random.Random(0)
+        now = timezone.now()
+        run = time.time_ns()
+        customers = Customer.objects.bulk_create(
+            Customer(
+                name=f'bench customer {i}',
+                email=f'bench-{run}-{i}@example.com',
+                phone=f'+1{rng.randrange(10 ** 9, 10 ** 10)}',
+            )
+            for i in range(options['customers'])
+        )
+        # created_at is auto_now_add; spread it so the range filter is selective
+        for customer in customers:
+            customer.created_at = now - timedelta(minutes=rng.randrange(60 * 24 * 365))
+        Customer.objects.bulk_update(customers, ['created_at'], batch_size=500)
+
+        products = Product.objects.bulk_create(
+            Product(
+                name=f'bench product {i}',
+                price=Decimal(rng.randrange(100, 100000)) / 100,
+                stock=rng.randrange(500),
+            )
+            for i in range(options['products'])
+        )
+        Order.objects.bulk_create(
+            (
+                Order(
+                    customer=rng.choice(customers),
+                    total_amount=Decimal(rng.randrange(100, 500000)) / 100,
+                    order_date=now - timedelta(minutes=rng.randrange(60 * 24 * 365)),
+                )
+                for _ in range(options['orders'])
+            ),
+            batch_size=1000,
+        )
+        self.stdout.write(
+            f"Seeded {len(customers)} customers, {len(products)} products, {options['orders']} orders."
+        )
+        self.customer_id = customers[0].pk
+        self.phone_prefix = customers[0].phone[:6]
+        return now
+
+    def cases(self, now):
+        """(label, expected index, queryset) for each filter, ordered as the connections page."""
+        month_ago = (now - timedelta(days=30)).isoformat()
+        week_ago = (now - timedelta(days=7)).isoformat()
+        orders = Order.objects.all()
+        customers = Customer.objects.all()
+        products = Product.objects.all()
+        return [
+            (
+                'orders by order_date in a date range', 'crm_order_date_id_idx',
+                OrderFilter({'order_date__gte': month_ago}, orders).qs.order_by('-order_date', '-id'),
+            ),
+            (
+                'orders by total_amount in a range', 'crm_order_total_id_idx',
+                OrderFilter({'total_amount__gte': '4900'}, orders).qs.order_by('total_amount', 'id'),
+            ),
+            (
+                "a customer's orders by order_date", 'crm_order_customer_date_idx',
+                orders.filter(customer_id=self.customer_id).order_by('-order_date'),
+            ),
+            (
+                'low stock products', 'crm_product_low_stock_idx',
+                ProductFilter({'low_stock': 'true'}, products).qs.order_by('stock', 'id'),
+            ),
+            (
+                'products by price', 'crm_product_price_id_idx',
+                ProductFilter({'order_by': 'price'}, products).qs.order_by('price', 'id'),
+            ),
+            (
+                'customers created in a date range', 'crm_customer_created_id_idx',
+                CustomerFilter({'created_at__gte': week_ago}, customers).qs.order_by('created_at', 'id'),
+            ),
+            (
+                'customers by phone prefix', 'crm_customer_phone_idx',
+                CustomerFilter({'phone_pattern': self.phone_prefix}, customers).qs.order_by('phone', 'id'),
+            ),
+        ]
+
+    def check(self, label, index, queryset, options):
+        plan = queryset.explain()
+        start = time.perf_counter()
+        for _ in range(options['repeat']):
+            list(queryset)
+        ms = (time.perf_counter() - start) * 1000 / options['repeat']
+        used = index in plan
+        status = self.style.SUCCESS('PASS') if used else self.style.ERROR('FAIL')
+        self.stdout.write(f"{status} {label}: {index} {'used' if used else 'not used'} ({ms:.2f} ms)")
+        if options['explain'] or not used:
+            self.stdout.write(f"    {plan}".replace('\n', '\n    '))
+        return used
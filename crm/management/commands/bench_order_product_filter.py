@@ -0,0 +1,159 @@
+# crm/management/commands/bench_order_product_filter.py
+
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from crm.filters import OrderFilter, clear_plan_cache
+from crm.models import Customer, Order, OrderItem, Product
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the join, EXISTS and id__in forms of the allOrders productId/productName "
+        "filters with what OrderFilter picks (first page and count) on a seeded dataset. "
+        "Everything runs in one transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1_000_000)
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--lines', type=int, default=4, help="Maximum lines per order.")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs of each query.")
+        parser.add_argument('--page-size', type=int, default=20)
+
+    def handle(self, *args, **options):
+        if min(options['orders'], options['products'], options['lines'], options['repeat']) < 1:
+            raise CommandError("--orders, --products, --lines and --repeat must be positive.")
+
+        mismatches = 0
+        try:
+            with transaction.atomic():
+                products = self.seed(options)
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                for label, forms in self.cases(products):
+                    mismatches += not self.compare(label, forms, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        if mismatches:
+            raise CommandError(f"{mismatches} cases return different orders per form.")
+        self.stdout.write(self.style.SUCCESS("Every form returns the same orders."))
+
+    def seed(self, options):
+        rng = random.Random(0)
+        now = timezone.now()
+        run = time.time_ns()
+        customers = Customer.objects.bulk_create(
+            Customer(name=f'bench customer {i}', email=f'bench-{run}-{i}@example.com')
+            for i in range(100)
+        )
+        products = Product.objects.bulk_create(
+            Product(name=f'bench product {i}', price=i % 100 + 1, stock=0)
+            for i in range(options['products'])
+        )
+        # A few products appear in most orders; the rest are rare.
+        weights = [1 / (i + 1) for i in range(len(products))]
+
+        start = time.perf_counter()
+        remaining = options['orders']
+        while remaining:
+            size = min(remaining, 10_000)
+            remaining -= size
+            orders = Order.objects.bulk_create(
+                Order(
+                    customer=rng.choice(customers),
+                    order_date=now - timedelta(minutes=rng.randrange(60 * 24 * 365)),
+                )
+                for _ in range(size)
+            )
+            items = []
+            for order in orders:
+                lines = {
+                    product.pk: product
+                    for product in rng.choices(products, weights, k=rng.randint(1, options['lines']))
+                }
+                items.extend(OrderItem.for_product(product, order=order) for product in lines.values())
+            OrderItem.objects.bulk_create(items, batch_size=5000)
+        self.stdout.write(
+            f"Seeded {options['orders']} orders over {len(products)} products "
+            f"in {time.perf_counter() - start:.1f}s."
+        )
+        return products
+
+    def cases(self, products):
+        """(label, {form: queryset}) pairs; the first form is the old join."""
+        orders = Order.objects.all()
+        self.plans = {}
+        cases = []
+        for label, product in [('hot', products[0]), ('mid', products[len(products) // 20]), ('rare', products[-1])]:
+            cases.append((f'productId ({label} product)', {
+                'join': orders.filter(products__id=product.pk),
+                'join + distinct': orders.filter(products__id=product.pk).distinct(),
+                'exists': orders.filter(Exists(OrderItem.objects.filter(order=OuterRef('pk'), product=product))),
+                'id__in': orders.filter(id__in=OrderItem.objects.filter(product=product).values('order_id')),
+                'OrderFilter': self.plan(f'productId ({label} product)', {'product_id': product.pk}, orders),
+            }))
+        # Matches products 1, 10-19 and 100-199: many orders hold several.
+        name = 'bench product 1'
+        cases.append((f'productName "{name}"', {
+            'join': orders.filter(products__name__icontains=name),
+            'join + distinct': orders.filter(products__name__icontains=name).distinct(),
+            'exists': orders.filter(Exists(OrderItem.objects.filter(
+                order=OuterRef('pk'), product__name__icontains=name,
+            ))),
+            'id__in': orders.filter(id__in=OrderItem.objects.filter(
+                product__name__icontains=name,
+            ).values('order_id')),
+            'OrderFilter': self.plan(f'productName "{name}"', {'product_name': name}, orders),
+        }))
+        return cases
+
+    def plan(self, label, data, orders):
+        """``OrderFilter(data).qs``, timing its plan choice uncached and cached."""
+        clear_plan_cache()
+        uncached_ms, queryset = self.time(lambda: OrderFilter(data, orders).qs, 1)
+        cached_ms, _ = self.time(lambda: OrderFilter(data, orders).qs, 1)
+        self.plans[label] = uncached_ms, cached_ms
+        return queryset
+
+    def compare(self, label, forms, options):
+        self.stdout.write(label)
+        uncached_ms, cached_ms = self.plans[label]
+        self.stdout.write(f"  {'OrderFilter plan':<22} uncached {uncached_ms:.2f} ms  cached {cached_ms:.2f} ms")
+        expected = None
+        consistent = True
+        for form, queryset in forms.items():
+            # ordered as the connection pages it
+            page = queryset.order_by('-order_date', '-id')[:options['page_size'] + 1]
+            page_ms, ids = self.time(lambda: [order.pk for order in page], options['repeat'])
+            count_ms, count = self.time(queryset.count, options['repeat'])
+            self.stdout.write(
+                f"  {form:<22} page {page_ms:9.2f} ms  count {count_ms:9.2f} ms  "
+                f"rows {count}{'' if len(set(ids)) == len(ids) else '  (duplicates in page)'}"
+            )
+            if form.startswith('join') and form != 'join + distinct':
+                continue
+            if expected is None:
+                expected = (ids, count)
+            elif (ids, count) != expected:
+                consistent = False
+                self.stderr.write(self.style.ERROR(f"  {form} returns different orders."))
+        return consistent
+
+    def time(self, fn, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = fn()
+        return (time.perf_counter() - start) * 1000 / repeat, result
@@ -0,0 +1,143 @@
+# crm/management/commands/bench_sqlite_concurrency.py
+
+import multiprocessing
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Readers run what the allOrders page of the site asks for.
+READ_QUERY = """
+    query {
+        allOrders(first: 20) {
+            edges { node { id totalAmount orderDate customer { name } } }
+        }
+    }
+"""
+
+
+def setup_worker(database):
+    """Pool initializer: points this process's default database at ``database``."""
+    import django
+
+    settings.DATABASES['default'] = database
+    django.setup()
+
+
+def prepare(customers, products):
+    from django.core.management import call_command
+
+    from crm.models import Customer, Product
+    from crm.orders import place_order
+    from crm.transactions import write_atomic
+
+    call_command('migrate', verbosity=0)
+    with write_atomic():
+        customer_list = Customer.objects.bulk_create(
+            Customer(name=f'bench customer {i}', email=f'bench-{i}@example.com') for i in range(customers)
+        )
+        product_list = Product.objects.bulk_create(
+            Product(name=f'bench product {i}', price=i % 50 + 1, stock=10 ** 9) for i in range(products)
+        )
+        for i in range(1000):
+            place_order(customer_list[i % customers], {product_list[i % products].pk: 1})
+    return [c.pk for c in customer_list], [p.pk for p in product_list]
+
+
+def run_worker(role, start_at, seconds, customer_ids, product_ids, seed):
+    """Runs ``role`` operations from ``start_at`` for ``seconds``; returns counts and latencies."""
+    from django.db import OperationalError, close_old_connections
+
+    from crm.client import execute
+    from crm.models import Customer
+    from crm.orders import place_order
+
+    rng = random.Random(seed)
+    latencies = []
+    errors = 0
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = start_at + seconds
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            if role == 'writer':
+                # the CreateOrder path: read the stock, then write
+                quantities = {pk: 1 for pk in rng.sample(product_ids, 2)}
+                place_order(Customer(pk=rng.choice(customer_ids)), quantities)
+            else:
+                execute(READ_QUERY)
+        except OperationalError:
+            errors += 1
+            close_old_connections()
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+    return role, latencies, errors
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs concurrent GraphQL readers and CreateOrder writers, one process each, against a "
+        "fresh SQLite file per profile: 'stock' (Django's sqlite3 backend and defaults) and "
+        "'tuned' (the DATABASES['default'] engine and OPTIONS). Reports throughput, "
+        "'database is locked' errors and latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--profiles', nargs='+', choices=['stock', 'tuned'], default=['stock', 'tuned'])
+
+    def handle(self, *args, **options):
+        default = settings.DATABASES['default']
+        if default['ENGINE'] not in ('django.db.backends.sqlite3', 'crm.backends.sqlite3'):
+            raise CommandError("The default database is not SQLite.")
+        if options['readers'] < 0 or options['writers'] < 0 or options['readers'] + options['writers'] < 1:
+            raise CommandError("--readers and --writers must not be negative, nor both 0.")
+
+        profiles = {
+            'stock': {'ENGINE': 'django.db.backends.sqlite3'},
+            'tuned': {'ENGINE': default['ENGINE'], 'OPTIONS': default.get('OPTIONS', {})},
+        }
+        summary = {}
+        with tempfile.TemporaryDirectory() as directory:
+            for name in options['profiles']:
+                database = {**profiles[name], 'NAME': str(Path(directory) / f'{name}.sqlite3')}
+                summary[name] = self.run_profile(name, database, options)
+
+        if len(summary) == 2:
+            stock, tuned = summary['stock'], summary['tuned']
+            for role in ('reader', 'writer'):
+                if stock[role] and tuned[role]:
+                    self.stdout.write(f"{role}s: {tuned[role] / stock[role]:.2f}x the stock throughput")
+
+    def run_profile(self, name, database, options):
+        workers = ['reader'] * options['readers'] + ['writer'] * options['writers']
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(len(workers), initializer=setup_worker, initargs=(database,)) as pool:
+            customer_ids, product_ids = pool.apply(prepare, (100, 50))
+            # every process has set up Django by now; start them together
+            start_at = time.time() + 1
+            results = pool.starmap(run_worker, [
+                (role, start_at, options['seconds'], customer_ids, product_ids, seed)
+                for seed, role in enumerate(workers)
+            ])
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{name}: {database.get('OPTIONS') or 'defaults'}"))
+        throughput = {}
+        for role in ('reader', 'writer'):
+            latencies = sorted(ms for r, values, _ in results if r == role for ms in values)
+            errors = sum(e for r, _, e in results if r == role)
+            throughput[role] = len(latencies) / options['seconds']
+            if not latencies:
+                self.stdout.write(f"  {role}s: no completed operations, {errors} locked errors")
+                continue
+            self.stdout.write(
+                f"  {role}s: {throughput[role]:8.1f} ops/s  {errors:5d} locked errors  "
+                f"p50 {latencies[len(latencies) // 2]:7.1f} ms  "
+                f"p99 {latencies[int(len(latencies) * 0.99)]:7.1f} ms"
+            )
+        return throughput
@@ -0,0 +1,110 @@
+# crm/management/commands/bench_stock_reservation.py
+
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from crm.models import Customer, InsufficientStock, Order, Product
+from crm.orders import RESERVATION_MODES, place_order
+
+
+class Command(BaseCommand):
+    help = (
+        "Places orders for the same few products from several threads and reports "
+        "throughput per stock reservation mode. Creates and then deletes its own rows."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=[*RESERVATION_MODES, 'both'], default='both')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=400, help="Orders per run, across all threads.")
+        parser.add_argument('--products', type=int, default=3, help="Hot products in every order.")
+        parser.add_argument('--quantity', type=int, default=1, help="Units of each product per order.")
+        parser.add_argument(
+            '--stock', type=int,
+            help="Initial stock per product (default: enough for every order).",
+        )
+        parser.add_argument(
+            '--retries', type=int, default=10,
+            help="Retries of an order that fails with a database error (lock timeout, deadlock).",
+        )
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['orders'] < 1 or options['products'] < 1:
+            raise CommandError("--threads, --orders and --products must be positive.")
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("The benchmark needs a database shared between threads.")
+
+        modes = RESERVATION_MODES if options['mode'] == 'both' else [options['mode']]
+        for mode in modes:
+            self.run(mode, options)
+
+    def run(self, mode, options):
+        quantity = options['quantity']
+        initial_stock = options['stock']
+        if initial_stock is None:
+            initial_stock = options['orders'] * quantity
+
+        customer = Customer.objects.create(name='bench', email=f'bench-{time.time_ns()}@example.com')
+        products = [
+            Product.objects.create(name=f'bench-hot-{i}', price=1, stock=initial_stock)
+            for i in range(options['products'])
+        ]
+        pks = [product.pk for product in products]
+        remaining = [options['orders']]
+        counts = {'placed': 0, 'rejected': 0, 'failed': 0, 'retries': 0}
+        lock = threading.Lock()
+
+        def worker(index):
+            # Odd threads list the products in reverse; without the sorted
+            # locking this is the classic lock-order deadlock.
+            order_pks = pks if index % 2 == 0 else pks[::-1]
+            try:
+                while True:
+                    with lock:
+                        if not remaining[0]:
+                            return
+                        remaining[0] -= 1
+                    for attempt in range(options['retries'] + 1):
+                        try:
+                            place_order(customer, {pk: quantity for pk in order_pks}, mode=mode)
+                            outcome = 'placed'
+                        except InsufficientStock:
+                            outcome = 'rejected'
+                        except DatabaseError:
+                            outcome = 'failed'
+                            time.sleep(0.001 * 2 ** attempt)
+                            continue
+                        break
+                    with lock:
+                        counts[outcome] += 1
+                        counts['retries'] += attempt
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+
+        expected = max(initial_stock - counts['placed'] * quantity, 0)
+        stock = set(Product.objects.filter(pk__in=pks).values_list('stock', flat=True))
+        consistent = stock == {expected}
+        self.stdout.write(
+            f"{mode}: {counts['placed']} placed, {counts['rejected']} out of stock, "
+            f"{counts['failed']} failed ({counts['retries']} retries) in {seconds:.2f}s "
+            f"({counts['placed'] / seconds:.0f} orders/s); "
+            f"stock {sorted(stock)} (expected {expected})"
+        )
+        if not consistent:
+            self.stderr.write(self.style.ERROR("Stock does not match the placed orders."))
+
+        with transaction.atomic():
+            Order.objects.filter(customer=customer).delete()
+            Product.objects.filter(pk__in=pks).delete()
+            customer.delete()
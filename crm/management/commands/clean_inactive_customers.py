@@ -0,0 +1,60 @@
+# crm/management/commands/clean_inactive_customers.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from crm.cleanup import delete_inactive_customers, get_config, load_checkpoint
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes customers with no order created in the last --days days, with their "
+        "orders, in primary key batches that each commit on their own."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Inactivity period (default INACTIVE_DAYS).")
+        parser.add_argument('--batch-size', type=int, help="Customers per batch and transaction.")
+        parser.add_argument('--sleep', type=float, help="Seconds to wait between batches.")
+        parser.add_argument('--dry-run', action='store_true', help="Count what would be deleted.")
+        parser.add_argument(
+            '--resume', action='store_true',
+            help="Continue an interrupted run from its checkpoint, with its cutoff.",
+        )
+
+    def handle(self, *args, **options):
+        config = get_config()
+        cutoff = timezone.now() - timedelta(days=options['days'] or config['INACTIVE_DAYS'])
+        after = None
+        if options['resume']:
+            checkpoint = load_checkpoint()
+            if checkpoint is None:
+                self.stdout.write("No checkpoint found; starting from the first customer.")
+            else:
+                cutoff, after = checkpoint
+                self.stdout.write(f"Resuming after customer {after} (cutoff {cutoff:%Y-%m-%d %H:%M:%S}).")
+
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+
+        def on_batch(report):
+            self.stdout.write(
+                f"Batch {report.batches}: up to customer {report.last_pk}, "
+                f"{report.customers} customers, {report.orders} orders so far "
+                f"in {report.batch_seconds * 1000:.0f} ms"
+            )
+
+        try:
+            report = delete_inactive_customers(
+                cutoff, options['batch_size'], options['sleep'], after,
+                dry_run=options['dry_run'], on_batch=on_batch,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        timestamp = timezone.localtime().strftime('%Y-%m-%d %H:%M:%S')
+        self.stdout.write(self.style.SUCCESS(
+            f"{timestamp} - {verb} {report.customers} inactive customers, {report.orders} orders "
+            f"and {report.items} order lines in {report.batches} batches ({report.seconds:.2f}s)."
+        ))
@@ -0,0 +1,45 @@
+# crm/management/commands/import_crm_data.py
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importers import FORMATS, IMPORTERS, guess_format, import_rows
+
+
+class Command(BaseCommand):
+    help = "Streams customers or products from a CSV or NDJSON file into the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help="What the file contains.")
+        parser.add_argument('path', help="CSV or NDJSON file to import ('-' for stdin).")
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension, else csv.")
+        parser.add_argument('--batch-size', type=int, help="Rows per INSERT batch and transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or guess_format(name=path)
+
+        def on_batch(report, errors):
+            for message in errors:
+                self.stderr.write(f"Rejected {message}")
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f"Batch {report.batches}: {report.processed} rows, "
+                    f"{report.rows_per_second:.0f} rows/s"
+                )
+
+        try:
+            if path == '-':
+                report = import_rows(options['kind'], sys.stdin.buffer, fmt, options['batch_size'], on_batch)
+            else:
+                with open(path, 'rb') as stream:
+                    report = import_rows(options['kind'], stream, fmt, options['batch_size'], on_batch)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.created} {report.kind}, rejected {report.rejected} rows "
+            f"in {report.seconds:.2f}s ({report.rows_per_second:.0f} rows/s)."
+        ))
+
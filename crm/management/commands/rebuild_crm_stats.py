@@ -0,0 +1,13 @@
+# crm/management/commands/rebuild_crm_stats.py
+
+from django.core.management.base import BaseCommand
+
+from crm.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recomputes the DailyStats buckets from the customer and order tables."
+
+    def handle(self, *args, **options):
+        days = rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt CRM stats for {days} days."))
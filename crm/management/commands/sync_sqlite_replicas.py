@@ -0,0 +1,54 @@
+# crm/management/commands/sync_sqlite_replicas.py
+
+import sqlite3
+import time
+from urllib.parse import unquote, urlparse
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from crm.routers import get_config
+
+
+def replica_path(name):
+    """The file behind a replica NAME, which may be a read-only ``file:`` URI."""
+    name = str(name)
+    if name.startswith('file:'):
+        return unquote(urlparse(name).path)
+    return name
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the primary SQLite database over the SQLite read replicas with the online "
+        "backup API, for running the replica routing locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('aliases', nargs='*', help="Replicas to refresh (default: all).")
+
+    def handle(self, *args, **options):
+        replicas = get_config()['REPLICAS']
+        aliases = options['aliases'] or replicas
+        unknown = sorted(set(aliases) - set(replicas))
+        if unknown:
+            raise CommandError(f"Not replicas: {', '.join(unknown)}.")
+        if not aliases:
+            raise CommandError("No replicas configured; set CRM_SQLITE_REPLICAS.")
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite' or any(connections[alias].vendor != 'sqlite' for alias in aliases):
+            raise CommandError("Only SQLite databases can be copied.")
+
+        primary.ensure_connection()
+        for alias in aliases:
+            path = replica_path(connections[alias].settings_dict['NAME'])
+            start = time.perf_counter()
+            target = sqlite3.connect(path)
+            try:
+                primary.connection.backup(target)
+                # Read-only connections cannot create the -shm file WAL needs.
+                target.execute('PRAGMA journal_mode = DELETE')
+            finally:
+                target.close()
+            self.stdout.write(f"{alias}: {path} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {len(aliases)} replicas."))
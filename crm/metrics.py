@@ -0,0 +1,416 @@
+# crm/metrics.py
+
+"""
+In-process metrics registry with a Prometheus text exposition.
+
+``REGISTRY`` holds counters and bucketed histograms keyed by label values.
+``CRMGraphQLView`` records every GraphQL request per operation, and the
+Celery signal receivers below record every task run. The ``metrics`` view
+serves the text format, so p50/p95/p99 come from ``histogram_quantile()``
+over the ``_bucket`` series.
+
+Operations are labelled by their sorted root field names (e.g.
+``createOrder``), which the schema bounds. A client-chosen operation name is
+used only if it is listed in ``CRM_METRICS['OPERATION_NAMES']``, so clients
+cannot create label values at will.
+
+With several worker processes (gunicorn, Celery prefork), set
+``CRM_METRICS['MULTIPROCESS_DIR']`` to a directory shared by all of them (on
+one host: processes are told apart by PID). Each process writes its samples
+to ``<dir>/metrics-<pid>-<token>.json`` at most every ``FLUSH_INTERVAL``
+seconds and on exit; the token is new in every process, so a reused PID
+never overwrites an exited worker's file. ``/metrics`` sums the files. When
+a process starts, the files of processes that are no longer running are
+merged into ``metrics-retired.json`` and removed, so counters never go down
+and the directory does not grow with every restart.
+"""
+
+import atexit
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from graphql import FieldNode, FragmentDefinitionNode, FragmentSpreadNode, InlineFragmentNode
+
+DEFAULTS = {
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 1.0,
+    'OPERATION_NAMES': (),
+}
+
+PROCESS_FILE = re.compile(r'^metrics-(\d+)-([0-9a-f]+)\.json$')
+RETIRED_FILE = 'metrics-retired.json'
+LOCK_FILE = 'metrics.lock'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_METRICS', {})}
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Histogram of seconds; values are ``[bucket counts..., sum]`` per labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            sample = self.values.get(key)
+            if sample is None:
+                sample = self.values[key] = [0] * (len(self.buckets) + 2)
+            sample[bisect_left(self.buckets, value)] += 1
+            sample[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def merge_samples(totals, samples):
+    """Adds ``samples`` (as returned by ``Registry.collect``) into ``totals``."""
+    for name, values in samples.items():
+        merged = totals.setdefault(name, {})
+        for key, value in values.items():
+            if isinstance(value, list):
+                current = merged.setdefault(key, [0] * len(value))
+                merged[key] = [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return totals
+
+
+def read_json(path, default=None):
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return default
+    except ValueError:
+        # being replaced or truncated; picked up on the next read
+        return default
+
+
+def write_json(path, data):
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps(data))
+    os.replace(tmp, path)
+
+
+def pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # alive, but another user's
+        return True
+    return True
+
+
+@contextmanager
+def directory_lock(directory, exclusive=False):
+    """Serializes retiring files (exclusive) against reading them (shared)."""
+    # POSIX only, like the multiprocess servers that need it.
+    import fcntl
+
+    with open(Path(directory) / LOCK_FILE, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class Registry:
+    """A set of metrics, serializable for cross-process aggregation."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Starts over as a new process: new file token, no samples. Called in
+        forked children, whose inherited samples belong to the parent.
+        """
+        self.pid = os.getpid()
+        self.token = uuid.uuid4().hex
+        self.last_flush = 0.0
+        self.started = False
+        for metric in self.metrics.values():
+            metric.values = {}
+
+    @property
+    def filename(self):
+        return f"metrics-{self.pid}-{self.token}.json"
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def collect(self):
+        """Returns ``{name: {labels_json: value}}`` for every metric."""
+        samples = {}
+        for metric in self.metrics.values():
+            with metric.lock:
+                samples[metric.name] = {
+                    json.dumps(key): (list(value) if isinstance(value, list) else value)
+                    for key, value in metric.values.items()
+                }
+        return samples
+
+    def flush(self, force=False):
+        """Writes this process' samples to the multiprocess directory."""
+        directory = get_config()['MULTIPROCESS_DIR']
+        if not directory:
+            return
+        if not self.started:
+            self.started = True
+            self.retire_exited(directory)
+        now = time.monotonic()
+        if not force and now - self.last_flush < get_config()['FLUSH_INTERVAL']:
+            return
+        self.last_flush = now
+        write_json(Path(directory) / self.filename, self.collect())
+
+    def retire_exited(self, directory):
+        """
+        Merges the files of processes that are no longer running into the
+        retired totals and removes them. The retired file lists what it
+        holds, so a file is never counted twice.
+        """
+        directory = Path(directory)
+        with directory_lock(directory, exclusive=True):
+            retired = read_json(directory / RETIRED_FILE) or {'files': [], 'samples': {}}
+            done = set(retired['files'])
+            exited = []
+            for path in directory.glob('metrics-*.json'):
+                match = PROCESS_FILE.match(path.name)
+                if match is None or path.name == self.filename or pid_running(int(match.group(1))):
+                    continue
+                if path.name not in done:
+                    samples = read_json(path)
+                    if samples is None:
+                        continue
+                    merge_samples(retired['samples'], samples)
+                exited.append(path)
+            if not exited:
+                return
+            # Files already removed need no entry.
+            present = {path.name for path in directory.glob('metrics-*.json')}
+            retired['files'] = sorted((done & present) | {path.name for path in exited})
+            write_json(directory / RETIRED_FILE, retired)
+            for path in exited:
+                path.unlink(missing_ok=True)
+
+    def aggregate(self):
+        """Returns the samples of every process (or just this one)."""
+        directory = get_config()['MULTIPROCESS_DIR']
+        if not directory:
+            return self.collect()
+        self.flush(force=True)
+        directory = Path(directory)
+        with directory_lock(directory):
+            retired = read_json(directory / RETIRED_FILE) or {'files': [], 'samples': {}}
+            totals = merge_samples({}, retired['samples'])
+            done = set(retired['files'])
+            for path in directory.glob('metrics-*.json'):
+                if PROCESS_FILE.match(path.name) is None or path.name in done:
+                    continue
+                samples = read_json(path)
+                if samples is not None:
+                    merge_samples(totals, samples)
+        return totals
+
+    def expose(self):
+        """Renders the Prometheus text exposition format (0.0.4)."""
+        samples = self.aggregate()
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for key, value in sorted(samples.get(metric.name, {}).items()):
+                labels = list(zip(metric.labelnames, json.loads(key)))
+                if metric.type == 'counter':
+                    lines.append(f"{metric.name}{format_labels(labels)} {format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip([*metric.buckets, '+Inf'], value[:-1]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else format_value(bound)
+                    lines.append(
+                        f"{metric.name}_bucket{format_labels([*labels, ('le', le)])} {cumulative}"
+                    )
+                lines.append(f"{metric.name}_sum{format_labels(labels)} {format_value(value[-1])}")
+                lines.append(f"{metric.name}_count{format_labels(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+GRAPHQL_DURATION = Histogram(
+    'crm_graphql_request_duration_seconds',
+    'GraphQL request latency by operation.',
+    ('operation', 'operation_type'),
+    registry=REGISTRY,
+)
+GRAPHQL_REQUESTS = Counter(
+    'crm_graphql_requests_total',
+    'GraphQL requests by operation and outcome.',
+    ('operation', 'operation_type', 'status'),
+    registry=REGISTRY,
+)
+GRAPHQL_CACHE_LOOKUPS = Counter(
+    'crm_graphql_cache_lookups_total',
+    'GraphQL response cache lookups by result (hit or miss).',
+    ('result',),
+    registry=REGISTRY,
+)
+GRAPHQL_CACHE_INVALIDATIONS = Counter(
+    'crm_graphql_cache_invalidations_total',
+    'GraphQL response cache invalidations by model tag.',
+    ('tag',),
+    registry=REGISTRY,
+)
+TASK_DURATION = Histogram(
+    'crm_celery_task_duration_seconds',
+    'Celery task run time.',
+    ('task',),
+    registry=REGISTRY,
+)
+TASKS = Counter(
+    'crm_celery_tasks_total',
+    'Celery task runs by final state.',
+    ('task', 'state'),
+    registry=REGISTRY,
+)
+
+atexit.register(REGISTRY.flush, force=True)
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+def root_fields(selection_set, fragments):
+    """The field names of a selection set, looking through fragments."""
+    names = set()
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            names.add(selection.name.value)
+        elif isinstance(selection, InlineFragmentNode):
+            names |= root_fields(selection.selection_set, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                names |= root_fields(fragment.selection_set, fragments)
+    return names
+
+
+def operation_label(operation, document=None):
+    """
+    Returns ``(name, type)`` for a validated GraphQL operation of
+    ``document``: the operation name if it is in ``OPERATION_NAMES``, else
+    the sorted root field names (e.g. ``createOrder``).
+    """
+    if operation is None:
+        return 'unknown', 'unknown'
+    if operation.name and operation.name.value in get_config()['OPERATION_NAMES']:
+        return operation.name.value, operation.operation.value
+    fragments = {
+        definition.name.value: definition
+        for definition in (document.definitions if document is not None else ())
+        if isinstance(definition, FragmentDefinitionNode)
+    }
+    name = ','.join(sorted(root_fields(operation.selection_set, fragments))) or 'anonymous'
+    return name, operation.operation.value
+
+
+def record_graphql_request(operation, duration, error=False):
+    name, operation_type = operation
+    GRAPHQL_DURATION.observe(duration, operation=name, operation_type=operation_type)
+    GRAPHQL_REQUESTS.inc(
+        operation=name, operation_type=operation_type, status='error' if error else 'ok'
+    )
+    REGISTRY.flush()
+
+
+# --- Celery hooks ---
+
+_task_starts = {}
+
+
+@task_prerun.connect
+def task_started(task_id=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def task_finished(task_id=None, task=None, state=None, **kwargs):
+    start = _task_starts.pop(task_id, None)
+    name = getattr(task, 'name', 'unknown')
+    if start is not None:
+        TASK_DURATION.observe(time.perf_counter() - start, task=name)
+    TASKS.inc(task=name, state=state or 'UNKNOWN')
+    REGISTRY.flush()
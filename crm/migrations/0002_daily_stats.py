@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:05
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_daily_stats(apps, schema_editor):
+    Customer = apps.get_model('crm', 'Customer')
+    Order = apps.get_model('crm', 'Order')
+    DailyStats = apps.get_model('crm', 'DailyStats')
+
+    buckets = defaultdict(dict)
+    customers = (
+        Customer.objects.annotate(day=TruncDate('created_at'))
+        .values('day').annotate(count=Count('id'))
+    )
+    for row in customers:
+        buckets[row['day']]['customers'] = row['count']
+    orders = (
+        Order.objects.annotate(day=TruncDate('order_date'))
+        .values('day').annotate(count=Count('id'), revenue=Sum('total_amount'))
+    )
+    for row in orders:
+        buckets[row['day']]['orders'] = row['count']
+        buckets[row['day']]['revenue'] = row['revenue'] or 0
+
+    DailyStats.objects.bulk_create(
+        [DailyStats(date=day, **values) for day, values in sorted(buckets.items())]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('customers', models.IntegerField(default=0)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 1000
+
+
+def copy_order_products(apps, schema_editor):
+    """
+    Turns every row of the old ``crm_order_products`` table into an item of
+    quantity 1 at the product's current price. Order totals are left as they
+    were charged.
+    """
+    Order = apps.get_model('crm', 'Order')
+    OrderItem = apps.get_model('crm', 'OrderItem')
+    rows = (
+        Order.products.through.objects
+        .values_list('order_id', 'product_id', 'product__price')
+        .order_by('pk')
+    )
+    batch = []
+    for order_id, product_id, price in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(OrderItem(
+            order_id=order_id, product_id=product_id, quantity=1, unit_price=price, line_total=price,
+        ))
+        if len(batch) >= BATCH_SIZE:
+            OrderItem.objects.bulk_create(batch)
+            batch = []
+    OrderItem.objects.bulk_create(batch)
+
+
+def copy_order_items(apps, schema_editor):
+    Order = apps.get_model('crm', 'Order')
+    OrderItem = apps.get_model('crm', 'OrderItem')
+    through = Order.products.through
+    rows = OrderItem.objects.values_list('order_id', 'product_id').order_by('pk')
+    batch = []
+    for order_id, product_id in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(through(order_id=order_id, product_id=product_id))
+        if len(batch) >= BATCH_SIZE:
+            through.objects.bulk_create(batch)
+            batch = []
+    through.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('line_total', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='crm.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='crm.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'product'), name='crm_orderitem_order_product_uniq'),
+        ),
+        migrations.RunPython(copy_order_products, copy_order_items),
+        # A through model cannot be added to an existing M2M field, so the
+        # old auto-created table is dropped and the field re-added on top of
+        # crm_orderitem.
+        migrations.RemoveField(
+            model_name='order',
+            name='products',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(related_name='orders', through='crm.OrderItem', to='crm.product'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:40
+
+import crm.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def install_search_index(apps, schema_editor):
+    # FTS5 tables and triggers on SQLite, pg_trgm indexes on PostgreSQL
+    from crm.search import install
+    install(schema_editor.connection)
+
+
+def uninstall_search_index(apps, schema_editor):
+    from crm.search import uninstall
+    uninstall(schema_editor.connection)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0004_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerSearch',
+            fields=[
+                ('rank', models.FloatField()),
+                ('customer', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='crm.customer')),
+                ('query', crm.models.FtsQueryField(db_column='crm_customer_fts')),
+            ],
+            options={
+                'db_table': 'crm_customer_fts',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearch',
+            fields=[
+                ('rank', models.FloatField()),
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='crm.product')),
+                ('query', crm.models.FtsQueryField(db_column='crm_product_fts')),
+            ],
+            options={
+                'db_table': 'crm_product_fts',
+                'abstract': False,
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0005_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='customer',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=100),
+        ),
+    ]
@@ -1,10 +1,15 @@
 # crm/models.py
 
 import re
-from django.db import models
+from decimal import Decimal
+
+from django.db import connections, models
+from django.db.models import F, Q, Sum
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .transactions import write_atomic
+
 
 def validate_phone(value):
     """
@@ -22,9 +27,150 @@ class Customer(models.Model):
     phone = models.CharField(max_length=20, blank=True, null=True, validators=[validate_phone])
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Keyset pages order by (column, id); see crm.pagination and CustomerFilter.
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='crm_customer_created_id_idx'),
+            models.Index(fields=['name', 'id'], name='crm_customer_name_id_idx'),
+            # phone_pattern prefix lookups; the opclass makes LIKE 'x%' use
+            # the index on PostgreSQL and is ignored elsewhere.
+            models.Index(fields=['phone'], name='crm_customer_phone_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return self.name
 
+class InsufficientStock(Exception):
+    """Raised when an order asks for more of a product than is in stock."""
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__('; '.join(
+            f"Insufficient stock for {product.name} (ID {product.pk}): {product.stock} available."
+            for product in products
+        ))
+
+
+class ProductQuerySet(models.QuerySet):
+    def reserve_stock(self, quantities, optimistic=False):
+        """
+        Takes ``quantities`` ({product pk: amount}) off the stock of those
+        products and returns them as ``{pk: product}``. Raises
+        ``Product.DoesNotExist`` for unknown IDs and ``InsufficientStock``
+        when a product has too little; call it inside a transaction so that
+        nothing is decremented then.
+
+        By default the rows are locked with ``SELECT ... FOR UPDATE`` in
+        primary key order, so concurrent orders for overlapping products
+        queue up instead of deadlocking, and written back with one
+        ``bulk_update``. With ``optimistic`` nothing is locked: each product
+        gets ``UPDATE ... SET stock = stock - n WHERE stock >= n``, also in
+        key order, and an update that matches no row means other orders took
+        the stock first. The returned stock is then the value read before the
+        update minus the quantity, which concurrent orders may have lowered.
+        """
+        pks = sorted(quantities)
+        queryset = self if optimistic else self.select_for_update()
+        products = {product.pk: product for product in queryset.filter(pk__in=pks).order_by('pk')}
+        missing = [str(pk) for pk in pks if pk not in products]
+        if missing:
+            raise self.model.DoesNotExist(f"Invalid Product IDs found: {', '.join(missing)}")
+
+        if optimistic:
+            for pk in pks:
+                quantity = quantities[pk]
+                if not self.filter(pk=pk, stock__gte=quantity).update(stock=F('stock') - quantity):
+                    products[pk].refresh_from_db(fields=['stock'])
+                    raise InsufficientStock([products[pk]])
+                products[pk].stock -= quantity
+            self.invalidate_cache()
+            return products
+
+        short = [products[pk] for pk in pks if products[pk].stock < quantities[pk]]
+        if short:
+            raise InsufficientStock(short)
+        for pk in pks:
+            products[pk].stock -= quantities[pk]
+        self.bulk_update(products.values(), ['stock'])
+        self.invalidate_cache()
+        return products
+
+    def restock_low_stock(self, threshold=10, increment=10):
+        """
+        Adds ``increment`` to the stock of every product below ``threshold``
+        in one ``UPDATE ... SET stock = stock + n`` and returns the updated rows.
+        Always applies to the whole table, not to a filtered queryset.
+
+        On backends with ``UPDATE ... RETURNING`` (SQLite 3.35+, PostgreSQL)
+        the rows come back from the UPDATE itself; elsewhere they are locked,
+        updated and re-read inside a transaction.
+        """
+        connection = connections[self.db]
+        if connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_columns_from_insert:
+            products = self._update_returning(
+                connection,
+                "{stock} = {stock} + %s",
+                "{stock} < %s",
+                [increment, threshold],
+            )
+            self.invalidate_cache()
+            return products
+
+        with write_atomic(using=self.db):
+            ids = list(
+                self.select_for_update().filter(stock__lt=threshold).values_list('pk', flat=True)
+            )
+            self.filter(pk__in=ids).update(stock=F('stock') + increment)
+            self.invalidate_cache()
+            return list(self.filter(pk__in=ids))
+
+    def invalidate_cache(self):
+        """
+        Invalidates cached product responses; the stock UPDATEs above send no
+        ``post_save`` signals (see ``crm.response_cache``).
+        """
+        # crm.response_cache imports this module
+        from .response_cache import invalidate
+        invalidate('product')
+
+    def _update_returning(self, connection, assignment, condition, params):
+        """
+        Runs ``UPDATE <table> SET <assignment> WHERE <condition> RETURNING *``
+        and builds model instances from the returned rows. ``{column}``
+        placeholders in the SQL fragments are replaced by quoted column names.
+        """
+        quote = connection.ops.quote_name
+        fields = self.model._meta.concrete_fields
+        table = self.model._meta.db_table
+        columns = {field.column: quote(field.column) for field in fields}
+        sql = (
+            f"UPDATE {quote(table)} SET {assignment.format(**columns)} "
+            f"WHERE {condition.format(**columns)} "
+            f"RETURNING {', '.join(columns.values())}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        # Apply the same value converters Django uses for a normal SELECT.
+        converters = []
+        for field in fields:
+            expression = field.get_col(table)
+            converters.append((
+                expression,
+                connection.ops.get_db_converters(expression) + field.get_db_converters(connection),
+            ))
+        instances = []
+        for row in rows:
+            values = []
+            for value, (expression, field_converters) in zip(row, converters):
+                for converter in field_converters:
+                    value = converter(value, expression, connection)
+                values.append(value)
+            instances.append(self.model.from_db(self.db, [f.attname for f in fields], values))
+        return instances
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100) # <-- Change this from 255 to 100
     description = models.TextField(blank=True, null=True)
@@ -32,20 +178,146 @@ class Product(models.Model):
     stock = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='crm_product_price_id_idx'),
+            # lowStock and the restock job; only the few low rows are indexed,
+            # so the stock decrement of every order rarely touches it.
+            models.Index(fields=['stock', 'id'], name='crm_product_low_stock_idx', condition=Q(stock__lt=10)),
+        ]
+
     def __str__(self):
         return self.name
 
 
 class Order(models.Model):
-    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders')
-    products = models.ManyToManyField(Product, related_name='orders')
+    # Indexed by crm_order_customer_date_idx, which leads with customer_id
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    products = models.ManyToManyField(Product, through='OrderItem', related_name='orders')
     order_date = models.DateTimeField(default=timezone.now)
+    # Sum of the line totals; kept in step by crm.orders
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['order_date', 'id'], name='crm_order_date_id_idx'),
+            models.Index(fields=['total_amount', 'id'], name='crm_order_total_id_idx'),
+            models.Index(fields=['customer', 'order_date'], name='crm_order_customer_date_idx'),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.customer.name}"
 
+    def update_total(self):
+        """Recomputes ``total_amount`` from the line totals and saves it if it changed."""
+        total = self.items.aggregate(total=Sum('line_total'))['total'] or Decimal('0.00')
+        if total != self.total_amount:
+            self.total_amount = total
+            self.save(update_fields=['total_amount'])
+        return total
+
+
+class OrderItem(models.Model):
+    """
+    One product line of an order. ``unit_price`` is the product price when
+    the order was placed, so later price changes do not alter the order.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='order_items')
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    line_total = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='crm_orderitem_order_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in order {self.order_id}"
+
+    @classmethod
+    def for_product(cls, product, quantity=1, **kwargs):
+        """An unsaved line for ``quantity`` of ``product`` at its current price."""
+        return cls(
+            product=product,
+            quantity=quantity,
+            unit_price=product.price,
+            line_total=product.price * quantity,
+            **kwargs,
+        )
+
+    def save(self, *args, **kwargs):
+        self.line_total = self.unit_price * self.quantity
+        super().save(*args, **kwargs)
+
+
+class DailyStats(models.Model):
+    """
+    Per-day CRM counters, kept up to date by ``crm.stats`` as customers and
+    orders are created or deleted. Totals are sums over these buckets.
+    """
+    date = models.DateField(unique=True)
+    customers = models.IntegerField(default=0)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"Stats for {self.date}"
+
+
+# --- Search index (crm.search) ---
+
+class FtsQueryField(models.TextField):
+    """The hidden column named after an FTS5 table; filter it with ``__match``."""
+
+
+@FtsQueryField.register_lookup
+class Match(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+
+class SearchIndex(models.Model):
+    """
+    Read-only view of an FTS5 table created by ``crm.search`` on SQLite,
+    joined to its content row through ``rowid``.
+    """
+    rank = models.FloatField()
+
+    class Meta:
+        abstract = True
+        managed = False
+
+
+class CustomerSearch(SearchIndex):
+    customer = models.OneToOneField(
+        Customer, models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_index',
+    )
+    query = FtsQueryField(db_column='crm_customer_fts')
+
+    class Meta(SearchIndex.Meta):
+        db_table = 'crm_customer_fts'
+
+
+class ProductSearch(SearchIndex):
+    product = models.OneToOneField(
+        Product, models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_index',
+    )
+    query = FtsQueryField(db_column='crm_product_fts')
+
+    class Meta(SearchIndex.Meta):
+        db_table = 'crm_product_fts'
+
 
 from django.db import models
 
@@ -0,0 +1,146 @@
+# crm/optimizer.py
+
+"""
+Query planning from the GraphQL selection set.
+
+Given the ``info`` of a field returning one of the CRM object types (directly,
+as a list, or as a Relay connection), these helpers work out which model
+columns and relations the client actually asked for and turn them into
+``only()``, ``select_related()`` and ``prefetch_related()`` calls.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from graphene.utils.str_converters import to_snake_case
+from graphene_django import DjangoObjectType
+from graphql import FieldNode, FragmentSpreadNode, InlineFragmentNode, get_named_type
+
+from .execution import in_event_loop
+
+
+def collect_fields(field_nodes, fragments):
+    """
+    Merges the sub-selections of ``field_nodes`` into a mapping of
+    response field name -> list of FieldNodes, expanding fragments.
+    """
+    fields = {}
+
+    def visit(selection_set):
+        if selection_set is None:
+            return
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                fields.setdefault(selection.name.value, []).append(selection)
+            elif isinstance(selection, InlineFragmentNode):
+                visit(selection.selection_set)
+            elif isinstance(selection, FragmentSpreadNode):
+                fragment = fragments.get(selection.name.value)
+                if fragment is not None:
+                    visit(fragment.selection_set)
+
+    for node in field_nodes:
+        visit(node.selection_set)
+    return fields
+
+
+def get_node_fields(info):
+    """
+    Returns the selected fields of the object type behind ``info``, looking
+    through ``edges { node { ... } }`` when the field is a connection.
+    """
+    fields = collect_fields(info.field_nodes, info.fragments)
+    return_type = get_named_type(info.return_type)
+    if 'edges' in getattr(return_type, 'fields', {}):
+        edges = collect_fields(fields.get('edges', []), info.fragments)
+        fields = collect_fields(edges.get('node', []), info.fragments)
+    return fields
+
+
+def plan(model, fields, fragments, prefix=''):
+    """
+    Returns ``(only, select_related, prefetch_related)`` lookups for the
+    selected ``fields`` of ``model``; ``prefix`` is the select_related path
+    that leads to ``model``.
+    """
+    only = [prefix + model._meta.pk.name]
+    select = []
+    prefetch = []
+
+    for name, nodes in fields.items():
+        try:
+            field = model._meta.get_field(to_snake_case(name))
+        except FieldDoesNotExist:
+            # Computed fields and connection metadata (__typename, ...)
+            continue
+
+        path = prefix + field.name
+        if not field.is_relation:
+            only.append(path)
+        elif field.concrete and (field.many_to_one or field.one_to_one):
+            sub_only, sub_select, sub_prefetch = plan(
+                field.related_model, collect_fields(nodes, fragments), fragments, path + '__'
+            )
+            only.append(path)
+            only.extend(sub_only)
+            select.append(path)
+            select.extend(sub_select)
+            prefetch.extend(sub_prefetch)
+        else:
+            # Reverse FK prefetches need the FK column to attach rows back.
+            required = (field.field.name,) if field.one_to_many else ()
+            related_queryset = optimize(
+                field.related_model._default_manager.all(),
+                collect_fields(nodes, fragments),
+                fragments,
+                required,
+            )
+            prefetch.append(Prefetch(path, queryset=related_queryset.order_by('pk')))
+
+    return only, select, prefetch
+
+
+def optimize(queryset, fields, fragments, required=()):
+    """Applies the plan for ``fields`` (plus ``required`` columns) to ``queryset``."""
+    only, select, prefetch = plan(queryset.model, fields, fragments)
+    only.extend(required)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset.only(*only)
+
+
+def optimize_queryset(queryset, info):
+    """Restricts ``queryset`` to what the selection set behind ``info`` uses."""
+    return optimize(queryset.all(), get_node_fields(info), info.fragments)
+
+
+class OptimizedDjangoObjectType(DjangoObjectType):
+    """
+    DjangoObjectType whose querysets are planned from the selection set.
+
+    Applies to every queryset graphene-django routes through ``get_queryset``:
+    connection fields, list fields and ``get_node``. On an event loop
+    ``get_node`` returns a coroutine using ``QuerySet.aget``.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_queryset(cls, queryset, info):
+        return optimize_queryset(queryset, info)
+
+    @classmethod
+    def get_node(cls, info, id):
+        if in_event_loop():
+            return cls.aget_node(info, id)
+        return super().get_node(info, id)
+
+    @classmethod
+    async def aget_node(cls, info, id):
+        queryset = cls.get_queryset(cls._meta.model.objects, info)
+        try:
+            return await queryset.aget(pk=id)
+        except cls._meta.model.DoesNotExist:
+            return None
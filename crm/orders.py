@@ -0,0 +1,95 @@
+# crm/orders.py
+
+"""
+Order placement with stock reservation, and order totals.
+
+``place_order`` creates an order with one ``OrderItem`` per product and
+takes the ordered quantities off ``Product.stock`` in the same transaction,
+so an order is never saved for stock that is not there.
+``CRM_STOCK_RESERVATION`` picks the strategy of
+``ProductQuerySet.reserve_stock``: ``'lock'`` (row locks in primary key
+order) or ``'optimistic'`` (conditional UPDATEs, no locks), which holds up
+better when many orders hit the same few products.
+
+``Order.total_amount`` is the sum of the line totals. The bulk paths set it
+when they insert the lines; the receivers below recompute it when lines are
+saved, deleted or linked one at a time (admin, shell, ``order.products``).
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Order, OrderItem, Product
+from .transactions import write_atomic
+
+RESERVATION_MODES = ('lock', 'optimistic')
+
+
+def get_reservation_mode():
+    return getattr(settings, 'CRM_STOCK_RESERVATION', 'lock')
+
+
+def order_total(items):
+    return sum((item.line_total for item in items), Decimal('0.00'))
+
+
+def place_order(customer, quantities, order_date=None, mode=None):
+    """
+    Reserves ``quantities`` ({product pk: amount}) and saves an order for
+    ``customer`` with its items priced at the current product prices.
+    Raises ``Product.DoesNotExist`` or ``InsufficientStock`` (see
+    ``reserve_stock``) with nothing written.
+    """
+    mode = mode or get_reservation_mode()
+    if mode not in RESERVATION_MODES:
+        raise ValueError(f"Unknown stock reservation mode '{mode}'.")
+
+    with write_atomic():
+        products = Product.objects.reserve_stock(quantities, optimistic=mode == 'optimistic')
+        items = [OrderItem.for_product(products[pk], quantity) for pk, quantity in quantities.items()]
+        order = Order(customer=customer, total_amount=order_total(items))
+        if order_date:
+            order.order_date = order_date
+        order.save()
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+    return order
+
+
+# --- Signal receivers (connected in CrmConfig.ready) ---
+
+@receiver(post_save, sender=OrderItem)
+def order_item_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.order.update_total()
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, origin=None, **kwargs):
+    # Lines removed by deleting their order or product keep the order total
+    # as charged.
+    if isinstance(origin, OrderItem) or getattr(origin, 'model', None) is OrderItem:
+        instance.order.update_total()
+
+
+@receiver(m2m_changed, sender=OrderItem)
+def order_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_add' and pk_set:
+        # add() inserts the lines without OrderItem.save()
+        if reverse:
+            items = OrderItem.objects.filter(product=instance, order_id__in=pk_set)
+        else:
+            items = OrderItem.objects.filter(order=instance, product_id__in=pk_set)
+        items.update(line_total=F('unit_price') * F('quantity'))
+    if not reverse:
+        instance.update_total()
+    elif pk_set:
+        for order in Order.objects.filter(pk__in=pk_set):
+            order.update_total()
@@ -0,0 +1,194 @@
+# crm/pagination.py
+
+"""
+Keyset (cursor-on-column) pagination for the CRM connections.
+
+Cursors encode the values of the active ``order_by`` columns plus the primary
+key of the row, so fetching the next page is a range condition on those
+columns instead of an ``OFFSET``. The total count is only computed when the
+client selects ``totalCount``. Under the async view the page and the count
+are fetched with the async ORM.
+"""
+
+import base64
+import json
+
+import graphene
+from django.db.models import Q
+from graphene.relay import PageInfo
+from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.utils import maybe_queryset
+from graphql import GraphQLError
+
+from .execution import in_event_loop
+
+
+class CountableConnection(graphene.relay.Connection):
+    """Connection with a lazily computed ``totalCount``."""
+
+    class Meta:
+        abstract = True
+
+    total_count = graphene.Int()
+
+    def resolve_total_count(root, info):
+        if in_event_loop():
+            return root.iterable.acount()
+        return root.iterable.count()
+
+
+def get_ordering(queryset):
+    """
+    Returns the ordering of ``queryset`` as ``[(field, descending), ...]``,
+    always ending with the primary key so every row has a unique key.
+    """
+    ordering = []
+    for term in queryset.query.order_by:
+        if not isinstance(term, str) or term == '?':
+            continue
+        descending = term.startswith('-')
+        name = term.lstrip('-')
+        if name == 'pk' or name == queryset.model._meta.pk.name:
+            break
+        ordering.append((name, descending))
+    ordering.append((queryset.model._meta.pk.name, False))
+    return ordering
+
+
+def encode_cursor(node, ordering):
+    values = []
+    for name, _ in ordering:
+        value = getattr(node, name)
+        values.append(value if isinstance(value, (int, type(None))) else str(value))
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def get_key_field(queryset, name):
+    """The model field or annotation (e.g. ``search_rank``) behind a key column."""
+    if name in queryset.query.annotations:
+        return queryset.query.annotations[name].output_field
+    return queryset.model._meta.get_field(name)
+
+
+def decode_cursor(cursor, queryset, ordering):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        if len(values) != len(ordering):
+            raise ValueError(cursor)
+        return [
+            get_key_field(queryset, name).to_python(value)
+            for (name, _), value in zip(ordering, values)
+        ]
+    except Exception:
+        raise GraphQLError(f"Invalid cursor '{cursor}' for the current ordering.")
+
+
+def keyset_filter(ordering, values, after=True):
+    """
+    Builds the condition selecting rows strictly after (or before) ``values``
+    in ``ordering``, i.e. a lexicographic comparison spelled out in Q objects.
+    """
+    condition = Q()
+    equal = Q()
+    for (name, descending), value in zip(ordering, values):
+        forward = after != descending
+        condition |= equal & Q(**{f"{name}__{'gt' if forward else 'lt'}": value})
+        equal &= Q(**{name: value})
+
+    # Bounding the leading column lets the database range-scan its index.
+    name, descending = ordering[0]
+    forward = after != descending
+    return Q(**{f"{name}__{'gte' if forward else 'lte'}": values[0]}) & condition
+
+
+class KeysetConnectionField(DjangoFilterConnectionField):
+    """
+    DjangoFilterConnectionField paginating by key instead of by offset.
+
+    The ``order_by`` argument of the FilterSet decides the key columns; the
+    optional ``offset`` argument skips rows after the cursor.
+    """
+
+    @classmethod
+    def resolve_connection(cls, connection, args, iterable, max_limit=None):
+        queryset = maybe_queryset(iterable)
+        window, finish = cls.plan_page(queryset, args, max_limit)
+        if in_event_loop():
+            async def resolve():
+                return finish(connection, [node async for node in window])
+            return resolve()
+        return finish(connection, list(window))
+
+    @classmethod
+    def plan_page(cls, queryset, args, max_limit=None):
+        """
+        Returns ``(window, finish)``: the sliced queryset holding the page
+        (plus one row to detect more pages), and ``finish(connection, nodes)``
+        building the connection from its rows.
+        """
+        for name in ('first', 'last', 'offset'):
+            if (args.get(name) or 0) < 0:
+                raise GraphQLError(f"{name} must not be negative.")
+
+        ordering = get_ordering(queryset)
+        names = [name for name, _ in ordering]
+
+        first = args.get('first')
+        last = args.get('last')
+        after = args.get('after')
+        before = args.get('before')
+        offset = args.get('offset') or 0
+        if max_limit is not None and first is None and last is None:
+            first = max_limit
+
+        # Cursor columns must be loaded even if the optimizer deferred them.
+        loaded, defer = queryset.query.deferred_loading
+        if loaded and not defer:
+            queryset = queryset.only(
+                *loaded, *(name for name in names if name not in queryset.query.annotations)
+            )
+
+        page = queryset.order_by(*(f"-{n}" if d else n for n, d in ordering))
+        if after:
+            page = page.filter(keyset_filter(ordering, decode_cursor(after, queryset, ordering)))
+        if before:
+            page = page.filter(
+                keyset_filter(ordering, decode_cursor(before, queryset, ordering), after=False)
+            )
+
+        forward = first is not None or last is None
+        if forward:
+            window = page[offset:offset + first + 1]
+        else:
+            window = page.reverse()[offset:offset + last + 1]
+
+        def finish(connection, nodes):
+            has_previous_page = bool(after) or bool(offset)
+            has_next_page = bool(before)
+            if forward:
+                has_next_page = len(nodes) > first
+                nodes = nodes[:first]
+                if last is not None and len(nodes) > last:
+                    nodes = nodes[-last:]
+                    has_previous_page = True
+            else:
+                has_previous_page = len(nodes) > last
+                nodes = nodes[:last][::-1]
+
+            edges = [
+                connection.Edge(node=node, cursor=encode_cursor(node, ordering))
+                for node in nodes
+            ]
+            result = connection(
+                edges=edges,
+                page_info=PageInfo(
+                    start_cursor=edges[0].cursor if edges else None,
+                    end_cursor=edges[-1].cursor if edges else None,
+                    has_previous_page=has_previous_page,
+                    has_next_page=has_next_page,
+                ),
+            )
+            result.iterable = queryset
+            return result
+
+        return window, finish
@@ -0,0 +1,102 @@
+# crm/reminders.py
+
+"""
+Order reminder pipeline.
+
+Pending orders are the ones placed in the last ``DAYS`` days.
+``order_ranges`` streams their ids with a server-side cursor and cuts them
+into primary key ranges of ``CHUNK_SIZE`` orders. ``crm.tasks`` turns each
+range into a ``send_order_reminder_chunk`` task. A chord passes the
+per-chunk counts to ``summarize_order_reminders``. Task messages carry only
+range bounds and each chunk loads its own orders, so memory stays bounded
+whatever the number of orders, and throughput grows with the number of
+workers. ``CHUNK_RATE_LIMIT`` is the Celery rate limit of the chunk task,
+per worker.
+
+Configured through ``CRM_ORDER_REMINDERS``.
+"""
+
+import logging
+
+from django.conf import settings
+
+from .models import Order
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'DAYS': 7,
+    'CHUNK_SIZE': 500,
+    'CHUNK_RATE_LIMIT': '10/s',
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_ORDER_REMINDERS', {})}
+
+
+def pending_orders(since):
+    return Order.objects.filter(order_date__gte=since)
+
+
+def order_ranges(since, chunk_size):
+    """Yields ``(first_id, last_id)`` ranges of ``chunk_size`` pending orders each."""
+    ids = (
+        pending_orders(since)
+        .order_by('pk')
+        .values_list('pk', flat=True)
+        .iterator(chunk_size=chunk_size)
+    )
+    first = last = None
+    count = 0
+    for pk in ids:
+        if first is None:
+            first = pk
+        last = pk
+        count += 1
+        if count == chunk_size:
+            yield first, last
+            first = None
+            count = 0
+    if first is not None:
+        yield first, last
+
+
+def send_reminder(order):
+    logger.info("Order ID: %s, Customer Email: %s", order.pk, order.customer.email)
+
+
+def send_reminders(since, first_id, last_id):
+    """
+    Sends the reminders of the pending orders with ids in
+    ``[first_id, last_id]``. Returns ``{'sent': n, 'failed': n}``.
+    """
+    orders = (
+        pending_orders(since)
+        .filter(pk__range=(first_id, last_id))
+        .select_related('customer')
+        .only('pk', 'order_date', 'customer__email')
+        .order_by('pk')
+    )
+    counts = {'sent': 0, 'failed': 0}
+    for order in orders.iterator(chunk_size=get_config()['CHUNK_SIZE']):
+        try:
+            send_reminder(order)
+        except Exception:
+            logger.exception("Reminder for order %s failed", order.pk)
+            counts['failed'] += 1
+        else:
+            counts['sent'] += 1
+    return counts
+
+
+def summarize(results):
+    """Adds up the per-chunk counts and logs the run."""
+    totals = {'chunks': len(results), 'sent': 0, 'failed': 0}
+    for counts in results:
+        totals['sent'] += counts['sent']
+        totals['failed'] += counts['failed']
+    logger.info(
+        "Order reminders: %(sent)s sent, %(failed)s failed in %(chunks)s chunks", totals,
+    )
+    return totals
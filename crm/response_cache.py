@@ -0,0 +1,235 @@
+# crm/response_cache.py
+
+"""
+Opt-in cache for read-only GraphQL responses.
+
+Responses are stored in a Django cache (``CRM_GRAPHQL_CACHE['CACHE_ALIAS']``)
+under a key built from the normalized query document, the variables and the
+operation name. Invalidation uses per-model tag versions: every cached key
+embeds the current version of each model the query reads, and a write to
+Customer, Product or Order bumps that model's version so older entries are
+never looked up again and simply age out.
+
+The versions are bumped by the GraphQL mutations, by the model signals
+below and by the write paths that bypass those signals (``bulk_create`` in
+``crm.bulk``, the stock UPDATEs of ``ProductQuerySet``, the raw deletes of
+``crm.cleanup``). Any other ``QuerySet.update()``, raw SQL or write from
+outside this process is not seen: call ``invalidate`` after it, or cached
+responses stay stale until ``TIMEOUT``.
+
+TTL comes from ``TIMEOUT``; the size bound and LRU eviction come from the
+cache backend (``MAX_ENTRIES`` on locmem, ``maxmemory-policy allkeys-lru``
+on Redis). Lookups and invalidations are counted in ``crm.metrics``, so the
+hit rate is on ``/metrics``.
+"""
+
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from graphql import (
+    OperationType,
+    TypeInfo,
+    TypeInfoVisitor,
+    Visitor,
+    get_named_type,
+    get_operation_ast,
+    print_ast,
+    visit,
+)
+
+from .metrics import GRAPHQL_CACHE_INVALIDATIONS, GRAPHQL_CACHE_LOOKUPS
+from .models import Customer, Order, OrderItem, Product
+
+DEFAULTS = {
+    'ENABLED': False,
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60,
+}
+
+KEY_PREFIX = 'graphql-cache'
+
+TAGS = ('customer', 'product', 'order')
+
+# Which model tags a response depends on, by GraphQL type and by root field.
+TYPE_TAGS = {
+    'CustomerType': ('customer',),
+    'ProductType': ('product',),
+    'OrderType': ('order',),
+    'OrderItemType': ('order',),
+    'DailyStatsType': ('customer', 'order'),
+}
+ROOT_FIELD_TAGS = {
+    'totalCustomers': ('customer',),
+    'totalOrders': ('order',),
+    'totalRevenue': ('order',),
+}
+
+# Which model tags each mutation writes; unknown mutations invalidate all.
+MUTATION_TAGS = {
+    'createCustomer': ('customer',),
+    'bulkCreateCustomers': ('customer',),
+    'createProduct': ('product',),
+    'createOrder': ('order', 'product'),
+    'bulkCreateOrders': ('order', 'product'),
+    'updateLowStockProducts': ('product',),
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_CACHE', {})}
+
+
+def type_tags(type_name):
+    for suffix in ('Connection', 'Edge'):
+        if type_name.endswith(suffix):
+            type_name = type_name[:-len(suffix)]
+    return TYPE_TAGS.get(type_name, ())
+
+
+class _TagCollector(Visitor):
+    def __init__(self, type_info, query_type):
+        super().__init__()
+        self.type_info = type_info
+        self.query_type = query_type
+        self.tags = set()
+
+    def enter_field(self, node, *args):
+        if self.type_info.get_parent_type() is self.query_type:
+            self.tags.update(ROOT_FIELD_TAGS.get(node.name.value, ()))
+        field_type = self.type_info.get_type()
+        if field_type is not None:
+            self.tags.update(type_tags(get_named_type(field_type).name))
+
+
+def query_tags(schema, document):
+    """Returns the model tags the query in ``document`` reads."""
+    type_info = TypeInfo(schema)
+    collector = _TagCollector(type_info, schema.query_type)
+    visit(document, TypeInfoVisitor(type_info, collector))
+    return collector.tags
+
+
+def mutation_tags(operation):
+    """Returns the model tags the mutation ``operation`` writes."""
+    tags = set()
+    for selection in operation.selection_set.selections:
+        name = getattr(getattr(selection, 'name', None), 'value', None)
+        tags.update(MUTATION_TAGS.get(name, TAGS))
+    return tags
+
+
+class ResponseCache:
+    """Tag-versioned response store."""
+
+    def __init__(self, alias, timeout):
+        self.alias = alias
+        self.timeout = timeout
+        self.cache = caches[alias]
+
+    def make_key(self, schema, document, variables=None, operation_name=None, variant=''):
+        """
+        Returns the cache key for a validated ``document``, or None when it
+        must not be cached (not a query operation).
+        """
+        operation = get_operation_ast(document, operation_name)
+        if operation is None or operation.operation != OperationType.QUERY:
+            return None
+
+        payload = json.dumps(
+            [print_ast(document), variables or {}, operation_name, variant],
+            sort_keys=True,
+            default=str,
+        )
+        digest = hashlib.sha256(payload.encode()).hexdigest()
+        versions = self.tag_versions(sorted(query_tags(schema, document)))
+        suffix = '.'.join(f"{tag}{version}" for tag, version in versions.items())
+        return f"{KEY_PREFIX}:{digest}:{suffix}"
+
+    def tag_versions(self, tags):
+        keys = {tag: f"{KEY_PREFIX}:tag:{tag}" for tag in tags}
+        found = self.cache.get_many(list(keys.values()))
+        versions = {}
+        for tag, key in keys.items():
+            if key not in found:
+                # A missing (or evicted) version restarts from the clock, so
+                # entries cached under an older version cannot come back.
+                self.cache.add(key, time.time_ns(), None)
+                found[key] = self.cache.get(key, 0)
+            versions[tag] = found[key]
+        return versions
+
+    def get(self, key):
+        value = self.cache.get(key)
+        GRAPHQL_CACHE_LOOKUPS.inc(result='miss' if value is None else 'hit')
+        return value
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def invalidate(self, tags):
+        for tag in tags:
+            key = f"{KEY_PREFIX}:tag:{tag}"
+            try:
+                self.cache.incr(key)
+            except ValueError:
+                self.cache.set(key, time.time_ns(), None)
+            GRAPHQL_CACHE_INVALIDATIONS.inc(tag=tag)
+
+
+_response_cache = None
+
+
+def get_response_cache():
+    """Returns the process-wide ResponseCache, or None when disabled."""
+    global _response_cache
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    if (
+        _response_cache is None
+        or (_response_cache.alias, _response_cache.timeout) != (config['CACHE_ALIAS'], config['TIMEOUT'])
+    ):
+        _response_cache = ResponseCache(config['CACHE_ALIAS'], config['TIMEOUT'])
+    return _response_cache
+
+
+def invalidate(*tags):
+    """
+    Bumps the given model tags if the response cache is enabled.
+
+    The bump waits for the surrounding transaction to commit, so a concurrent
+    read cannot cache pre-commit data under the new version.
+    """
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        transaction.on_commit(lambda: response_cache.invalidate(tags))
+
+
+# --- Signal receivers (connected in CrmConfig.ready) ---
+# Cover ORM writes made outside the GraphQL mutations (admin, shell, jobs).
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def customer_changed(sender, **kwargs):
+    invalidate('customer')
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, **kwargs):
+    invalidate('product')
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+@receiver(m2m_changed, sender=Order.products.through)
+def order_changed(sender, **kwargs):
+    invalidate('order')
@@ -0,0 +1,231 @@
+# crm/routers.py
+
+"""
+Read replica routing.
+
+``ReadReplicaRouter`` sends reads to a replica only inside ``use_replica``.
+GraphQL query operations (``CRMGraphQLView``, ``crm.client``) and the
+reporting jobs run in it. Everything else, mutations included, reads from
+the primary. Inside the block the reads still go to the primary:
+
+* within a transaction on the primary, which may hold uncommitted writes;
+* for ``STICKY_SECONDS`` after a write in the same context. A job that
+  writes and then reads sees its writes. Each view request is a context of
+  its own (``request_scope``), so one client's writes do not pin another
+  client's requests to the primary. Instead, a client whose mutation
+  succeeded gets the ``STICKY_COOKIE`` cookie, and its queries read from
+  the primary until it expires;
+* when no replica is healthy.
+
+``use_replica`` picks one replica for the whole block, so an operation reads
+from one snapshot. Async code uses ``read_alias`` and ``route_reads``
+instead. The pick compares two random healthy replicas and takes the one
+with the lower average query time. A replica whose connection or query
+fails is skipped for ``RETRY_SECONDS``.
+
+Configured through ``CRM_DATABASE_ROUTING``. ``REPLICAS`` lists the aliases
+in ``DATABASES``.
+"""
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'REPLICAS': [],
+    'STICKY_SECONDS': 5,
+    'STICKY_COOKIE': 'crm_read_primary',
+    'RETRY_SECONDS': 30,
+}
+
+# Weight of the newest query time in a replica's moving average.
+LATENCY_SMOOTHING = 0.2
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_DATABASE_ROUTING', {})}
+
+
+# Alias reads go to inside use_replica; None outside.
+_read_alias = ContextVar('crm_read_alias', default=None)
+# time.monotonic() of the last write in this context.
+_last_write = ContextVar('crm_last_write', default=None)
+
+
+def record_write():
+    _last_write.set(time.monotonic())
+
+
+@contextmanager
+def request_scope():
+    """Forgets the writes of the earlier requests this thread served."""
+    token = _last_write.set(None)
+    try:
+        yield
+    finally:
+        _last_write.reset(token)
+
+
+def is_sticky():
+    """Whether this context wrote within the last ``STICKY_SECONDS``."""
+    last_write = _last_write.get()
+    return last_write is not None and time.monotonic() - last_write < get_config()['STICKY_SECONDS']
+
+
+# --- Replica health ---
+
+_health_lock = threading.Lock()
+_down_until = {}
+_latency = {}
+
+
+def mark_down(alias, error):
+    with _health_lock:
+        already_down = _down_until.get(alias, 0) > time.monotonic()
+        _down_until[alias] = time.monotonic() + get_config()['RETRY_SECONDS']
+    if not already_down:
+        logger.warning("Read replica %s is unavailable: %s", alias, error)
+
+
+def record_latency(alias, seconds):
+    with _health_lock:
+        average = _latency.get(alias)
+        _latency[alias] = seconds if average is None else average + LATENCY_SMOOTHING * (seconds - average)
+
+
+def healthy_replicas():
+    now = time.monotonic()
+    with _health_lock:
+        return [alias for alias in get_config()['REPLICAS'] if _down_until.get(alias, 0) <= now]
+
+
+def probe(alias):
+    """Opens this thread's connection to ``alias``; False (and marked down) if it fails."""
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        mark_down(alias, e)
+        return False
+    return True
+
+
+def choose_replica():
+    """A healthy replica, the faster of two random ones, or None."""
+    candidates = healthy_replicas()
+    while candidates:
+        pair = random.sample(candidates, min(2, len(candidates)))
+        with _health_lock:
+            alias = min(pair, key=lambda name: _latency.get(name, 0.0))
+        if probe(alias):
+            return alias
+        candidates.remove(alias)
+    return None
+
+
+@receiver(connection_created)
+def track_replica(sender, connection, **kwargs):
+    # Times every query on a replica connection and takes the replica out of
+    # rotation when one fails at the database level.
+    if connection.alias not in get_config()['REPLICAS']:
+        return
+
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            result = execute(sql, params, many, context)
+        except DatabaseError as e:
+            mark_down(connection.alias, e)
+            raise
+        record_latency(connection.alias, time.perf_counter() - started)
+        return result
+
+    connection.execute_wrappers.append(wrapper)
+
+
+# --- Routing ---
+
+def read_alias(primary=False):
+    """
+    A replica to read from, or the primary when ``primary`` is set, this
+    context wrote recently or no replica is healthy. Opens a connection, so
+    async code calls it through ``sync_to_async``.
+    """
+    if primary or is_sticky():
+        return DEFAULT_DB_ALIAS
+    return choose_replica() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def route_reads(alias):
+    """Routes the reads of the block to ``alias``."""
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def use_replica(primary=False):
+    """Routes the reads of the block to ``read_alias(primary)``; yields the alias."""
+    with route_reads(read_alias(primary)) as alias:
+        yield alias
+
+
+def reads_primary(request):
+    """Whether ``request`` carries the cookie of a recent mutation."""
+    try:
+        until = float(request.COOKIES.get(get_config()['STICKY_COOKIE'], 0))
+    except ValueError:
+        return False
+    return until > time.time()
+
+
+def set_sticky_cookie(response):
+    config = get_config()
+    if config['STICKY_SECONDS']:
+        response.set_cookie(
+            config['STICKY_COOKIE'],
+            str(time.time() + config['STICKY_SECONDS']),
+            max_age=config['STICKY_SECONDS'],
+            httponly=True,
+            samesite='Lax',
+        )
+
+
+class ReadReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or alias == DEFAULT_DB_ALIAS:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block or is_sticky():
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        record_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *get_config()['REPLICAS']}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        if db in get_config()['REPLICAS']:
+            return False
+        return None
@@ -1,90 +1,212 @@
 # crm/schema.py
 
+from datetime import datetime, time
+
 import graphene
 from graphene_django import DjangoObjectType
-from graphene_django.filter import DjangoFilterConnectionField
+from graphene_django.settings import graphene_settings
 from graphql import GraphQLError
-from django.db import transaction
-from django.db.models import Sum, Count
+from django.utils import timezone
 
 from crm.models import Customer
 from crm.models import Product
 from crm.models import Order
-from crm.models import validate_phone
+from crm.models import OrderItem
+from crm.models import DailyStats
+from crm.models import InsufficientStock, validate_phone
 
+from .bulk import create_customers, create_orders, order_quantities
+from .execution import in_event_loop
 from .filters import CustomerFilter, ProductFilter, OrderFilter
+from .loaders import get_loaders
+from .optimizer import OptimizedDjangoObjectType
+from .orders import place_order
+from .pagination import CountableConnection, KeysetConnectionField
+from .transactions import write_atomic
+from . import stats
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 
 
 # --- GraphQL Types ---
 
-class CustomerType(DjangoObjectType):
+# The connection fields below need `use_connection`; the FK/M2M edges are
+# declared explicitly so they resolve through the per-request DataLoaders
+# unless the optimizer already joined or prefetched them.
+
+def get_prefetched(instance, name):
+    """Returns the prefetched rows of a relation, or None if not prefetched."""
+    cache = getattr(instance, '_prefetched_objects_cache', {})
+    if name in cache:
+        return list(cache[name])
+    return None
+
+
+class CustomerType(OptimizedDjangoObjectType):
+    orders = graphene.List(graphene.NonNull(lambda: OrderType))
+
     class Meta:
         model = Customer
-        fields = ("id", "name", "email", "phone", "created_at")
+        fields = ("id", "name", "email", "phone", "created_at", "orders")
+        use_connection = True
+        connection_class = CountableConnection
 
+    def resolve_orders(self, info):
+        orders = get_prefetched(self, 'orders')
+        if orders is not None:
+            return orders
+        return get_loaders(info).customer_orders.load(self.id)
+
+
+class ProductType(OptimizedDjangoObjectType):
+    orders = graphene.List(graphene.NonNull(lambda: OrderType))
 
-class ProductType(DjangoObjectType):
     class Meta:
         model = Product
-        fields = ("id", "name", "description", "price", "stock", "created_at")
+        fields = ("id", "name", "description", "price", "stock", "created_at", "orders")
+        use_connection = True
+        connection_class = CountableConnection
 
+    def resolve_orders(self, info):
+        orders = get_prefetched(self, 'orders')
+        if orders is not None:
+            return orders
+        return get_loaders(info).product_orders.load(self.id)
+
+
+class OrderItemType(DjangoObjectType):
+    product = graphene.Field(ProductType)
+
+    class Meta:
+        model = OrderItem
+        fields = ("id", "product", "quantity", "unit_price", "line_total")
+
+    def resolve_product(self, info):
+        if OrderItem.product.is_cached(self):
+            return self.product
+        return get_loaders(info).product.load(self.product_id)
+
+
+class OrderType(OptimizedDjangoObjectType):
+    customer = graphene.Field(CustomerType)
+    products = graphene.List(graphene.NonNull(ProductType))
+    items = graphene.List(graphene.NonNull(OrderItemType))
 
-class OrderType(DjangoObjectType):
     class Meta:
         model = Order
-        fields = ("id", "customer", "products", "order_date", "total_amount", "created_at")
+        fields = ("id", "customer", "products", "items", "order_date", "total_amount", "created_at")
+        use_connection = True
+        connection_class = CountableConnection
+
+    def resolve_customer(self, info):
+        if Order.customer.is_cached(self):
+            return self.customer
+        return get_loaders(info).customer.load(self.customer_id)
+
+    def resolve_products(self, info):
+        products = get_prefetched(self, 'products')
+        if products is not None:
+            return products
+        return get_loaders(info).order_products.load(self.id)
+
+    def resolve_items(self, info):
+        items = get_prefetched(self, 'items')
+        if items is not None:
+            return items
+        return get_loaders(info).order_items.load(self.id)
+
+
+class DailyStatsType(DjangoObjectType):
+    class Meta:
+        model = DailyStats
+        fields = ("date", "customers", "orders", "revenue")
 
 
 # --- Queries ---
 
+# Under the async view (crm.views.AsyncCRMGraphQLView) resolvers run on the
+# event loop: they return coroutines using the async ORM, so independent root
+# fields such as totalCustomers and totalRevenue are awaited concurrently.
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+
+def resolve_total(name, start_date=None, end_date=None):
+    if in_event_loop():
+        async def total():
+            return (await stats.atotals(start_date, end_date))[name]
+        return total()
+    return stats.totals(start_date, end_date)[name]
+
+
 class Query(graphene.ObjectType):
     hello = graphene.String()
-    orders = graphene.List(OrderType, order_date_Gte=graphene.Date())
+    # Orders placed on or after a day, oldest first; at most `first` rows,
+    # capped by RELAY_CONNECTION_MAX_LIMIT. Use allOrders to page further.
+    orders = graphene.List(OrderType, order_date_Gte=graphene.Date(), first=graphene.Int())
 
     def resolve_hello(self, info):
         return "world"
+
+    def resolve_orders(root, info, order_date_Gte=None, first=None):
+        limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        if first is not None:
+            if first < 0:
+                raise GraphQLError("first must not be negative.")
+            limit = min(first, limit) if limit else first
+        queryset = Order.objects.order_by('order_date', 'pk')
+        if order_date_Gte is not None:
+            # a datetime bound keeps the (order_date, id) index usable
+            start = timezone.make_aware(datetime.combine(order_date_Gte, time.min))
+            queryset = queryset.filter(order_date__gte=start)
+        queryset = OrderType.get_queryset(queryset, info)[:limit]
+        if in_event_loop():
+            return alist(queryset)
+        return queryset
     
-    all_customers = DjangoFilterConnectionField(CustomerType, filterset_class=CustomerFilter)
+    all_customers = KeysetConnectionField(CustomerType, filterset_class=CustomerFilter)
     customer_by_id = graphene.Field(CustomerType, id=graphene.ID(required=True))
 
-    all_products = DjangoFilterConnectionField(ProductType, filterset_class=ProductFilter)
+    all_products = KeysetConnectionField(ProductType, filterset_class=ProductFilter)
     product_by_id = graphene.Field(ProductType, id=graphene.ID(required=True))
 
-    all_orders = DjangoFilterConnectionField(OrderType, filterset_class=OrderFilter)
+    all_orders = KeysetConnectionField(OrderType, filterset_class=OrderFilter)
     order_by_id = graphene.Field(OrderType, id=graphene.ID(required=True))
 
-    total_customers = graphene.Int()
-    total_orders = graphene.Int()
-    total_revenue = graphene.Decimal()
+    # Report totals come from the DailyStats buckets (see crm/stats.py);
+    # the optional dates restrict them to a range of days.
+    total_customers = graphene.Int(start_date=graphene.Date(), end_date=graphene.Date())
+    total_orders = graphene.Int(start_date=graphene.Date(), end_date=graphene.Date())
+    total_revenue = graphene.Decimal(start_date=graphene.Date(), end_date=graphene.Date())
+    daily_stats = graphene.List(
+        graphene.NonNull(DailyStatsType), start_date=graphene.Date(), end_date=graphene.Date()
+    )
 
     # Resolvers for fetching single objects by ID remain the same
     def resolve_customer_by_id(root, info, id):
-        try:
-            return Customer.objects.get(pk=id)
-        except Customer.DoesNotExist:
-            return None
+        # get_node goes through CustomerType.get_queryset, i.e. the optimizer
+        return CustomerType.get_node(info, id)
 
     def resolve_product_by_id(root, info, id):
-        try:
-            return Product.objects.get(pk=id)
-        except Product.DoesNotExist:
-            return None
+        return ProductType.get_node(info, id)
+
+    def resolve_total_customers(self, info, start_date=None, end_date=None):
+        return resolve_total('customers', start_date, end_date)
 
-    def resolve_totalCustomers(self, info):
-        return Customer.objects.count()
+    def resolve_total_orders(self, info, start_date=None, end_date=None):
+        return resolve_total('orders', start_date, end_date)
 
-    def resolve_totalOrders(self, info):
-        return Order.objects.count()
+    def resolve_total_revenue(self, info, start_date=None, end_date=None):
+        return resolve_total('revenue', start_date, end_date)
 
-    def resolve_totalRevenue(self, info):
-        return float(Order.objects.aggregate(total=Sum('total_amount'))['total'] or 0.0)
+    def resolve_daily_stats(self, info, start_date=None, end_date=None):
+        queryset = stats.totals_queryset(start_date, end_date).order_by('date')
+        if in_event_loop():
+            return alist(queryset)
+        return queryset
 
     def resolve_order_by_id(root, info, id):
-        try:
-            return Order.objects.get(pk=id)
-        except Order.DoesNotExist:
-            return None
+        return OrderType.get_node(info, id)
 
 
 # --- Mutations ---
@@ -127,42 +249,27 @@ class CustomerInput(graphene.InputObjectType):
 class BulkCreateCustomers(graphene.Mutation):
     class Arguments:
         customers_data = graphene.List(graphene.NonNull(CustomerInput), required=True)
+        batch_size = graphene.Int()
 
     customers = graphene.List(CustomerType)
     errors = graphene.List(graphene.String)
 
     @staticmethod
-    def mutate(root, info, customers_data):
+    def mutate(root, info, customers_data, batch_size=None):
         successful_customers = []
         error_messages = []
 
-        customers_to_create = []
-
-        for i, customer_data in enumerate(customers_data):
-            email = customer_data.get('email')
-            # Basic pre-validation
-            if Customer.objects.filter(email=email).exists():
-                error_messages.append(f"Row {i + 1}: Customer with email '{email}' already exists.")
-                continue
-            if 'phone' in customer_data and customer_data.get('phone'):
-                try:
-                    validate_phone(customer_data.get('phone'))
-                except ValidationError as e:
-                    error_messages.append(f"Row {i + 1} ({email}): {e.messages[0]}")
-                    continue
-
-            customers_to_create.append(
-                Customer(name=customer_data.name, email=email, phone=customer_data.get('phone'))
-            )
-
-        # Bulk create valid customers in a single transaction
-        if customers_to_create:
-            try:
-                with transaction.atomic():
-                    successful_customers = Customer.objects.bulk_create(customers_to_create)
-            except Exception as e:
-                # This catches database-level errors during bulk_create
-                error_messages.append(f"An unexpected error occurred during bulk creation: {str(e)}")
+        # Validation and inserts run batch by batch (one email lookup and one
+        # bulk_create each), all inside a single transaction
+        try:
+            with write_atomic():
+                for created, errors in create_customers(customers_data, batch_size):
+                    successful_customers.extend(created)
+                    error_messages.extend(errors)
+        except Exception as e:
+            # This catches database-level errors during bulk_create
+            successful_customers = []
+            error_messages.append(f"An unexpected error occurred during bulk creation: {str(e)}")
 
         return BulkCreateCustomers(customers=successful_customers, errors=error_messages)
 
@@ -191,77 +298,102 @@ class CreateProduct(graphene.Mutation):
 
 
 # 4. CreateOrder Mutation
+class OrderItemInput(graphene.InputObjectType):
+    product_id = graphene.ID(required=True)
+    quantity = graphene.Int(default_value=1)
+
+
 class CreateOrder(graphene.Mutation):
     class Arguments:
         customer_id = graphene.ID(required=True)
-        product_ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+        product_ids = graphene.List(graphene.NonNull(graphene.ID))
+        items = graphene.List(graphene.NonNull(OrderItemInput))
         order_date = graphene.DateTime()
 
     order = graphene.Field(OrderType)
 
     @staticmethod
-    @transaction.atomic
-    def mutate(root, info, customer_id, product_ids, order_date=None):
+    def mutate(root, info, customer_id, product_ids=None, items=None, order_date=None):
+        try:
+            quantities = order_quantities(product_ids, items)
+        except ValueError as e:
+            raise GraphQLError(str(e))
+        if not quantities:
+            raise GraphQLError("At least one product must be selected for an order.")
+
         try:
             customer = Customer.objects.get(pk=customer_id)
-        except ObjectDoesNotExist:
+        except (ObjectDoesNotExist, ValueError):
             raise GraphQLError(f"Customer with ID '{customer_id}' does not exist.")
 
-        if not product_ids:
-            raise GraphQLError("At least one product must be selected for an order.")
+        # Stock is reserved in the same transaction as the order is saved
+        try:
+            order = place_order(customer, quantities, order_date)
+        except (ObjectDoesNotExist, InsufficientStock) as e:
+            raise GraphQLError(str(e))
 
-        found_products = Product.objects.filter(pk__in=product_ids)
+        return CreateOrder(order=order)
 
-        if len(found_products) != len(product_ids):
-            found_ids = {str(p.id) for p in found_products}
-            invalid_ids = [pid for pid in product_ids if pid not in found_ids]
-            raise GraphQLError(f"Invalid Product IDs found: {', '.join(invalid_ids)}")
 
-        total_amount = found_products.aggregate(total=Sum('price'))['total'] or 0.00
-        
-        order_kwargs = {'customer': customer, 'total_amount': total_amount}
-        if order_date:
-            order_kwargs['order_date'] = order_date
-        
-        # Change from .create() to explicit .save()
-        order = Order(**order_kwargs)
-        order.save()
-        
-        order.products.set(found_products)
-        
-        return CreateOrder(order=order)
+# 5. BulkCreateOrders Mutation
+class OrderInput(graphene.InputObjectType):
+    customer_id = graphene.ID(required=True)
+    product_ids = graphene.List(graphene.NonNull(graphene.ID))
+    items = graphene.List(graphene.NonNull(OrderItemInput))
+    order_date = graphene.DateTime()
+
+
+class BulkCreateOrders(graphene.Mutation):
+    class Arguments:
+        orders_data = graphene.List(graphene.NonNull(OrderInput), required=True)
+        batch_size = graphene.Int()
+
+    orders = graphene.List(OrderType)
+    errors = graphene.List(graphene.String)
+
+    @staticmethod
+    def mutate(root, info, orders_data, batch_size=None):
+        successful_orders = []
+        error_messages = []
+
+        # Each batch validates its customers and products with one query
+        # each and inserts orders and order-product rows with one
+        # bulk_create each, all inside a single transaction
+        try:
+            with write_atomic():
+                for created, errors in create_orders(orders_data, batch_size):
+                    successful_orders.extend(created)
+                    error_messages.extend(errors)
+        except Exception as e:
+            successful_orders = []
+            error_messages.append(f"An unexpected error occurred during bulk creation: {str(e)}")
+
+        return BulkCreateOrders(orders=successful_orders, errors=error_messages)
 
 
 class UpdateLowStockProducts(graphene.Mutation):
-    # 2. Define the output fields of the mutation
     class Arguments:
-        # This mutation takes no input arguments
-        pass
+        threshold = graphene.Int(default_value=10)
+        increment = graphene.Int(default_value=10)
 
     success = graphene.Boolean()
     message = graphene.String()
     updated_products = graphene.List(ProductType)
 
-    # 3. The core mutation logic
     @staticmethod
-    def mutate(root, info):
-        # Find all products with stock less than 10
-        low_stock_products = Product.objects.filter(stock__lt=10)
-        updated_product_list = []
-        
-        # Loop through them and increment stock by 10
-        for product in low_stock_products:
-            product.stock += 10
-            product.save()
-            updated_product_list.append(product)
-            
-        success = True
+    def mutate(root, info, threshold=10, increment=10):
+        if increment <= 0:
+            raise GraphQLError("Increment must be a positive number.")
+        if threshold < 0:
+            raise GraphQLError("Threshold cannot be negative.")
+
+        # One UPDATE ... SET stock = stock + increment for all low-stock rows
+        updated_product_list = Product.objects.restock_low_stock(threshold, increment)
+
         message = f"Successfully restocked {len(updated_product_list)} products."
-        
-        # Return the results
         return UpdateLowStockProducts(
-            success=success, 
-            message=message, 
+            success=True,
+            message=message,
             updated_products=updated_product_list
         )
 
@@ -273,6 +405,7 @@ class Mutation(graphene.ObjectType):
     bulk_create_customers = BulkCreateCustomers.Field()
     create_product = CreateProduct.Field()
     create_order = CreateOrder.Field()
+    bulk_create_orders = BulkCreateOrders.Field()
     update_low_stock_products = UpdateLowStockProducts.Field()
 
 schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
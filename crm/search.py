@@ -0,0 +1,272 @@
+# crm/search.py
+
+"""
+Indexed substring search over customer and product names and emails.
+
+``icontains`` filters compile to ``LIKE '%x%'``, which no B-tree index can
+serve. The search index fixes that per backend:
+
+* SQLite: an external-content FTS5 table per model (``crm_customer_fts``,
+  ``crm_product_fts``) with the ``trigram`` tokenizer, kept in sync by
+  triggers. ``contains`` narrows an ``icontains`` filter to the rowids the
+  trigram index finds for the same ``LIKE`` pattern, and ``search`` joins
+  the table (``CustomerSearch``/``ProductSearch``) to rank matches with
+  FTS5's bm25 ``rank``.
+* PostgreSQL: ``pg_trgm`` GIN indexes on ``UPPER(column)``, the expression
+  Django's ``icontains`` compares, so the existing filters use them as they
+  are; ``search`` ranks by trigram similarity.
+* Anything else: plain ``icontains``, unranked.
+
+``contains`` keeps the original ``icontains`` condition next to the index
+lookup, so results never differ from the unindexed filter. The triggers are
+dropped when SQLite's schema editor remakes a table (most ``AlterField``
+operations); ``post_migrate`` recreates them and rebuilds the index.
+"""
+
+import re
+import sqlite3
+from functools import cache
+
+from django.db import connections
+from django.db.models import F, FloatField, Func, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from .models import Customer, Product
+
+# Columns covered by the search index of each model.
+SEARCH_FIELDS = {
+    Customer: ('name', 'email'),
+    Product: ('name',),
+}
+
+# The trigram tokenizer only indexes sequences of three or more characters.
+MIN_TERM_LENGTH = 3
+
+LIKE_WILDCARDS = re.compile(r'[%_\\]')
+
+
+@cache
+def fts5_trigram_available():
+    """Whether the linked SQLite library has FTS5 with the trigram tokenizer (3.34+)."""
+    db = sqlite3.connect(':memory:')
+    try:
+        db.execute("CREATE VIRTUAL TABLE t USING fts5(x, tokenize='trigram')")
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        db.close()
+
+
+def get_backend(connection):
+    """Returns ``'fts5'``, ``'trigram'`` or None for ``connection``."""
+    if connection.vendor == 'sqlite' and fts5_trigram_available():
+        return 'fts5'
+    if connection.vendor == 'postgresql':
+        return 'trigram'
+    return None
+
+
+def fts_table(model):
+    return f'{model._meta.db_table}_fts'
+
+
+def columns(model):
+    return [model._meta.get_field(name).column for name in SEARCH_FIELDS[model]]
+
+
+# --- Schema ---
+
+def fts_statements(connection, model):
+    """``{name: sql}`` for the FTS5 table of ``model`` and its triggers, in creation order."""
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    fts = fts_table(model)
+    cols = columns(model)
+    col_list = ', '.join(quote(col) for col in cols)
+    new = ', '.join(f'new.{quote(col)}' for col in cols)
+    old = ', '.join(f'old.{quote(col)}' for col in cols)
+    insert = f"INSERT INTO {quote(fts)}(rowid, {col_list}) VALUES (new.{quote(model._meta.pk.column)}, {new});"
+    delete = (
+        f"INSERT INTO {quote(fts)}({quote(fts)}, rowid, {col_list}) "
+        f"VALUES ('delete', old.{quote(model._meta.pk.column)}, {old});"
+    )
+    return {
+        fts: (
+            f"CREATE VIRTUAL TABLE {quote(fts)} USING fts5({col_list}, content={quote(table)}, "
+            f"content_rowid={quote(model._meta.pk.column)}, tokenize='trigram')"
+        ),
+        f'{fts}_ai': f"CREATE TRIGGER {quote(fts + '_ai')} AFTER INSERT ON {quote(table)} BEGIN {insert} END",
+        f'{fts}_ad': f"CREATE TRIGGER {quote(fts + '_ad')} AFTER DELETE ON {quote(table)} BEGIN {delete} END",
+        # Only the indexed columns: stock updates on every order must not
+        # rewrite the product index.
+        f'{fts}_au': (
+            f"CREATE TRIGGER {quote(fts + '_au')} AFTER UPDATE OF {col_list} ON {quote(table)} "
+            f"BEGIN {delete} {insert} END"
+        ),
+    }
+
+
+def trigram_statements(connection, model):
+    """``{name: sql}`` for the pg_trgm indexes of ``model``."""
+    quote = connection.ops.quote_name
+    table = model._meta.db_table
+    return {
+        f'{table}_{col}_trgm_idx': (
+            f"CREATE INDEX IF NOT EXISTS {quote(f'{table}_{col}_trgm_idx')} ON {quote(table)} "
+            f"USING gin (UPPER({quote(col)}::text) gin_trgm_ops)"
+        )
+        for col in columns(model)
+    }
+
+
+def install(connection):
+    """
+    Creates whatever part of the search index is missing on ``connection``
+    and rebuilds every FTS5 table that had a part (re)created. Returns the
+    names of the created objects.
+    """
+    backend = get_backend(connection)
+    created = []
+    with connection.cursor() as cursor:
+        if backend == 'trigram':
+            cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for model in SEARCH_FIELDS:
+                for name, sql in trigram_statements(connection, model).items():
+                    cursor.execute(sql)
+                    created.append(name)
+        elif backend == 'fts5':
+            cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+            existing = {name for (name,) in cursor.fetchall()}
+            for model in SEARCH_FIELDS:
+                missing = {
+                    name: sql for name, sql in fts_statements(connection, model).items()
+                    if name not in existing
+                }
+                for sql in missing.values():
+                    cursor.execute(sql)
+                if missing:
+                    fts = connection.ops.quote_name(fts_table(model))
+                    cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+                    created.extend(missing)
+    return created
+
+
+def uninstall(connection):
+    """Drops the search index from ``connection``."""
+    backend = get_backend(connection)
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in SEARCH_FIELDS:
+            if backend == 'trigram':
+                for name in trigram_statements(connection, model):
+                    cursor.execute(f'DROP INDEX IF EXISTS {quote(name)}')
+            elif backend == 'fts5':
+                # dropping the table drops its shadow tables; the triggers
+                # belong to the content table
+                for name in [*fts_statements(connection, model)][1:]:
+                    cursor.execute(f'DROP TRIGGER IF EXISTS {quote(name)}')
+                cursor.execute(f'DROP TABLE IF EXISTS {quote(fts_table(model))}')
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using='default', **kwargs):
+    # Only repairs an index the migration installed.
+    connection = connections[using]
+    if sender.name != 'crm' or get_backend(connection) != 'fts5':
+        return
+    if fts_table(Customer) in connection.introspection.table_names():
+        install(connection)
+
+
+# --- Queries ---
+
+class Similarity(Func):
+    function = 'SIMILARITY'
+    output_field = FloatField()
+
+
+def resolve_path(model, path):
+    """Splits ``customer__name`` into the model and field it ends on."""
+    *relations, name = path.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model, name
+
+
+def fts_rowids(model, sql, params):
+    fts = fts_table(model)
+    return RawSQL(f'SELECT rowid FROM "{fts}" WHERE {sql}', params)
+
+
+def contains(queryset, path, value):
+    """
+    ``queryset.filter(<path>__icontains=value)``, narrowed through the FTS5
+    index when ``path`` ends on an indexed column. The index only helps
+    patterns with a three character run and no ``LIKE`` wildcards.
+    """
+    condition = {f'{path}__icontains': value}
+    model, name = resolve_path(queryset.model, path)
+    if (
+        name in SEARCH_FIELDS.get(model, ())
+        and len(value) >= MIN_TERM_LENGTH
+        and not LIKE_WILDCARDS.search(value)
+        and get_backend(connections[queryset.db]) == 'fts5'
+    ):
+        column = model._meta.get_field(name).column
+        prefix = path.rpartition('__')[0]
+        # Same filter() call, so a multi-valued relation joins once.
+        condition[f'{prefix}__in' if prefix else 'pk__in'] = fts_rowids(
+            model, f'"{column}" LIKE %s', [f'%{value}%']
+        )
+    return queryset.filter(**condition)
+
+
+def fts_query(terms):
+    """An FTS5 query matching rows that contain every term (as a substring)."""
+    return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def search(queryset, value):
+    """
+    Filters ``queryset`` to the rows whose indexed columns contain every
+    whitespace-separated term of ``value`` and, unless it is already
+    ordered, orders them best match first by ``search_rank``.
+    """
+    model = queryset.model
+    fields = SEARCH_FIELDS[model]
+    terms = value.split()
+    if not terms:
+        return queryset
+    backend = get_backend(connections[queryset.db])
+
+    indexed = [term for term in terms if len(term) >= MIN_TERM_LENGTH]
+    if backend == 'fts5' and indexed:
+        match = fts_query(indexed)
+        terms = [term for term in terms if len(term) < MIN_TERM_LENGTH]
+        # A join, not a correlated subquery: bm25 needs the statistics of
+        # every matching row, which a per-row subquery recomputes each time.
+        queryset = queryset.filter(search_index__query__match=match)
+        rank = F('search_index__rank')
+    elif backend == 'trigram':
+        similarities = [Similarity(name, Value(value)) for name in fields]
+        rank = -(Greatest(*similarities) if len(similarities) > 1 else similarities[0])
+    else:
+        rank = None
+
+    # Terms the index cannot answer.
+    for term in terms:
+        any_field = Q()
+        for name in fields:
+            any_field |= Q(**{f'{name}__icontains': term})
+        queryset = queryset.filter(any_field)
+
+    if rank is None:
+        return queryset
+    queryset = queryset.annotate(search_rank=rank)
+    if not queryset.query.order_by:
+        queryset = queryset.order_by('search_rank', 'pk')
+    return queryset
@@ -0,0 +1,212 @@
+# crm/stats.py
+
+"""
+Incrementally maintained CRM aggregates.
+
+Customer and order writes add their deltas to the ``DailyStats`` bucket of
+the day they belong to (``Customer.created_at`` / ``Order.order_date``):
+through model signals for single saves and deletes, and through explicit
+``record_*`` calls on the ``bulk_create`` and raw delete paths, which send
+no signals.
+The report fields then sum a handful of day rows instead of scanning the
+customer and order tables.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Customer, DailyStats, Order
+from .transactions import write_atomic
+
+
+def bucket_date(value):
+    """Returns the (local) calendar day a timestamp is counted under."""
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date()
+
+
+# Days per UPDATE statement in apply_deltas.
+DELTA_BATCH_SIZE = 250
+
+
+def apply_deltas(deltas):
+    """
+    Adds ``{date: {counter: delta}}`` to the day buckets: missing buckets are
+    inserted, then one UPDATE per ``DELTA_BATCH_SIZE`` days adds every delta
+    with F() expressions, whatever the number of days.
+    """
+    changes = {}
+    for day, counters in deltas.items():
+        counters = {name: delta for name, delta in counters.items() if delta}
+        if counters:
+            changes[day] = counters
+    days = sorted(changes)
+    for start in range(0, len(days), DELTA_BATCH_SIZE):
+        batch = days[start:start + DELTA_BATCH_SIZE]
+        with write_atomic():
+            DailyStats.objects.bulk_create(
+                [DailyStats(date=day) for day in batch], ignore_conflicts=True,
+            )
+            updates = {}
+            for name in ('customers', 'orders', 'revenue'):
+                whens = [
+                    When(date=day, then=Value(changes[day][name]))
+                    for day in batch if name in changes[day]
+                ]
+                if whens:
+                    field = DailyStats._meta.get_field(name)
+                    updates[name] = F(name) + Case(*whens, default=Value(0), output_field=field)
+            DailyStats.objects.filter(date__in=batch).update(**updates)
+
+
+def record_customers(customers, sign=1):
+    """Counts created (``sign=1``) or deleted (``sign=-1``) customers."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for customer in customers:
+        deltas[bucket_date(customer.created_at)]['customers'] += sign
+    apply_deltas(deltas)
+
+
+def record_orders(orders, sign=1):
+    """Counts created (``sign=1``) or deleted (``sign=-1``) orders and their revenue."""
+    deltas = defaultdict(lambda: defaultdict(int))
+    for order in orders:
+        bucket = deltas[bucket_date(order.order_date)]
+        bucket['orders'] += sign
+        bucket['revenue'] += sign * Decimal(str(order.total_amount or 0))
+    apply_deltas(deltas)
+
+
+def totals_queryset(start_date=None, end_date=None):
+    queryset = DailyStats.objects.all()
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    return queryset
+
+
+TOTALS = {'customers': Sum('customers'), 'orders': Sum('orders'), 'revenue': Sum('revenue')}
+
+CENT = Decimal('0.01')
+
+
+def totals_result(result):
+    # SQLite sums the decimals as floats and Django pads the result to the
+    # field's precision ('3039.95000000000'); revenue is in cents.
+    return {
+        'customers': result['customers'] or 0,
+        'orders': result['orders'] or 0,
+        'revenue': (result['revenue'] or Decimal('0.00')).quantize(CENT),
+    }
+
+
+def totals(start_date=None, end_date=None):
+    """
+    Returns ``{'customers', 'orders', 'revenue'}`` summed over the day buckets
+    between ``start_date`` and ``end_date`` (inclusive, both optional).
+    """
+    return totals_result(totals_queryset(start_date, end_date).aggregate(**TOTALS))
+
+
+async def atotals(start_date=None, end_date=None):
+    """``totals`` through the async ORM (``aaggregate``)."""
+    return totals_result(await totals_queryset(start_date, end_date).aaggregate(**TOTALS))
+
+
+def day_buckets(customers, orders):
+    """
+    Groups the ``customers`` and ``orders`` querysets into
+    ``{date: {'customers', 'orders', 'revenue'}}`` in the database.
+    """
+    buckets = defaultdict(dict)
+    customers = (
+        customers.annotate(day=TruncDate('created_at'))
+        .values('day').annotate(count=Count('id')).order_by()
+    )
+    for row in customers:
+        buckets[row['day']]['customers'] = row['count']
+    orders = (
+        orders.annotate(day=TruncDate('order_date'))
+        .values('day').annotate(count=Count('id'), revenue=Sum('total_amount')).order_by()
+    )
+    for row in orders:
+        buckets[row['day']]['orders'] = row['count']
+        buckets[row['day']]['revenue'] = row['revenue'] or 0
+    return buckets
+
+
+def record_deleted(customers, orders):
+    """
+    Takes the rows of the ``customers`` and ``orders`` querysets off their
+    buckets. For raw deletes, which send no ``post_delete`` signals; call it
+    before deleting, in the same transaction.
+    """
+    apply_deltas({
+        day: {name: -value for name, value in values.items()}
+        for day, values in day_buckets(customers, orders).items()
+    })
+
+
+@write_atomic
+def rebuild():
+    """Recomputes every bucket from the customer and order tables."""
+    buckets = day_buckets(Customer.objects.all(), Order.objects.all())
+    DailyStats.objects.all().delete()
+    DailyStats.objects.bulk_create(
+        [DailyStats(date=day, **values) for day, values in sorted(buckets.items())]
+    )
+    return len(buckets)
+
+
+# --- Signal receivers (connected in CrmConfig.ready) ---
+
+@receiver(post_save, sender=Customer)
+def customer_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_customers([instance])
+
+
+@receiver(post_delete, sender=Customer)
+def customer_deleted(sender, instance, **kwargs):
+    record_customers([instance], sign=-1)
+
+
+@receiver(pre_save, sender=Order)
+def order_saving(sender, instance, raw=False, **kwargs):
+    # Remember what an existing order was counted as, so that a changed date
+    # or total moves it between buckets.
+    instance._stats_previous = None
+    if instance.pk is not None and not raw:
+        instance._stats_previous = (
+            Order.objects.filter(pk=instance.pk).only('order_date', 'total_amount').first()
+        )
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_orders([instance])
+        return
+    previous = getattr(instance, '_stats_previous', None)
+    if previous is None:
+        return
+    if (bucket_date(previous.order_date), Decimal(str(previous.total_amount))) != (
+        bucket_date(instance.order_date), Decimal(str(instance.total_amount))
+    ):
+        record_orders([previous], sign=-1)
+        record_orders([instance])
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    record_orders([instance], sign=-1)
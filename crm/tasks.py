@@ -1,39 +1,70 @@
-import requests
-from celery import shared_task
-from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
-from datetime import datetime
+from celery import chord, shared_task
+from datetime import datetime, timedelta
 import logging
 
+from django.utils import timezone
+
+from crm import reminders
+from crm.client import execute
+from crm.routers import use_replica
+
 # Configure logging to append to a file
 logging.basicConfig(filename='/tmp/crm_report_log.txt', level=logging.INFO,
                     format='%(message)s')
 
 @shared_task
 def generate_crm_report():
-    # GraphQL endpoint
-    graphql_url = "http://localhost:8000/graphql"
-    transport = RequestsHTTPTransport(url=graphql_url, verify=True, retries=3)
-    client = Client(transport=transport, fetch_schema_from_transport=True)
-
-    # GraphQL query to fetch CRM report data
-    query = gql("""
+    # GraphQL query to fetch CRM report data (run in process, see crm/client.py)
+    query = """
         query {
             totalCustomers
             totalOrders
             totalRevenue
         }
-    """)
+    """
+
+    # Generate timestamp
+    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
     try:
-        result = client.execute(query)
+        result = execute(query)
         total_customers = result.get('totalCustomers', 0)
         total_orders = result.get('totalOrders', 0)
         total_revenue = result.get('totalRevenue', 0.0)
 
-        # Generate timestamp
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         report_message = f"{timestamp} - Report: {total_customers} customers, {total_orders} orders, {total_revenue} revenue"
         logging.info(report_message)
     except Exception as e:
-        logging.error(f"{timestamp} - Error generating CRM report: {str(e)}")
\ No newline at end of file
+        logging.error(f"{timestamp} - Error generating CRM report: {str(e)}")
+
+
+# --- Order reminders (see crm/reminders.py) ---
+
+@shared_task
+def send_order_reminders(days=None, chunk_size=None):
+    """
+    Fans the pending orders out to one send_order_reminder_chunk task per
+    ``chunk_size`` orders; summarize_order_reminders gets their counts.
+    """
+    config = reminders.get_config()
+    since = timezone.now() - timedelta(days=days or config['DAYS'])
+    chunk_size = chunk_size or config['CHUNK_SIZE']
+    with use_replica():
+        header = [
+            send_order_reminder_chunk.s(since.isoformat(), first_id, last_id)
+            for first_id, last_id in reminders.order_ranges(since, chunk_size)
+        ]
+    if not header:
+        return reminders.summarize([])
+    return chord(header)(summarize_order_reminders.s()).id
+
+
+@shared_task(rate_limit=reminders.get_config()['CHUNK_RATE_LIMIT'])
+def send_order_reminder_chunk(since, first_id, last_id):
+    with use_replica():
+        return reminders.send_reminders(datetime.fromisoformat(since), first_id, last_id)
+
+
+@shared_task
+def summarize_order_reminders(results):
+    return reminders.summarize(results)
@@ -1,3 +1,2063 @@
-from django.test import TestCase
+import json
+import os
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.backends.sqlite3 import base as django_sqlite_backend
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from graphene_django.settings import graphene_settings
+from graphql import FragmentDefinitionNode, execute, get_operation_ast, parse, validate
+
+from .backends.sqlite3 import base as sqlite_backend
+from .bulk import create_customers, create_orders
+from .cost import QueryCostRule
+from .execution import DataLoaderExecutionContext
+from .models import Customer, DailyStats, InsufficientStock, Order, OrderItem, Product
+from .optimizer import collect_fields, plan
+from .orders import place_order
+from .transactions import write_atomic
+from . import (
+    cleanup, documents, filters, importers, metrics, reminders, routers, search, stats, tasks, tracing,
+)
+from .client import GraphQLClientError, execute as execute_local
+from .management.commands import bench_filter_indexes
+from .views import AsyncCRMGraphQLView
+
+# The ASGI deployment (CRM_GRAPHQL_ASYNC) for AsyncGraphQLViewTests.
+urlpatterns = [
+    path('graphql/', csrf_exempt(AsyncCRMGraphQLView.as_view())),
+]
+
+
+def create_order(customer, products, quantity=1, **kwargs):
+    """An order for ``quantity`` of each of ``products``, with its lines."""
+    items = [OrderItem.for_product(product, quantity) for product in products]
+    order = Order.objects.create(
+        customer=customer, total_amount=sum(item.line_total for item in items), **kwargs
+    )
+    for item in items:
+        item.order = order
+    OrderItem.objects.bulk_create(items)
+    return order
+
+
+class CRMTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.customers = Customer.objects.bulk_create(
+            Customer(name=f'Customer {i}', email=f'customer{i}@example.com') for i in range(3)
+        )
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=10 * (i + 1), stock=100) for i in range(3)
+        )
+
+    def graphql(self, query, variables=None, **extra):
+        """POSTs ``query`` to the GraphQL view; returns the decoded response."""
+        response = self.client.post(
+            '/graphql/', json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json', **extra,
+        )
+        self.response = response
+        return response.json()
+
+
+class DataLoaderExecutionTests(CRMTestCase):
+
+    def execute(self, query, variables=None):
+        # A plain graphql.execute call, with graphql-core's default
+        # awaitable check.
+        result = execute(
+            graphene_settings.SCHEMA.graphql_schema,
+            parse(query),
+            context_value=SimpleNamespace(),
+            variable_values=variables,
+            execution_context_class=DataLoaderExecutionContext,
+        )
+        self.assertIsNone(result.errors)
+        return result.data
+
+    def test_connection_edges_batch_per_relation(self):
+        for i in range(12):
+            create_order(self.customers[i % 3], self.products[:i % 3 + 1])
+        query = 'query { allOrders { edges { node { customer { name } products { name } } } } }'
+        # The page with its customers joined, then one query for the
+        # products of all orders.
+        with self.assertNumQueries(2):
+            data = self.execute(query)
+
+        nodes = [edge['node'] for edge in data['allOrders']['edges']]
+        self.assertEqual(len(nodes), 12)
+        self.assertEqual(nodes[0]['customer'], {'name': 'Customer 0'})
+        self.assertEqual(nodes[2]['products'], [{'name': f'Product {i}'} for i in range(3)])
+
+    def test_mutation_payload_resolves_loader_fields(self):
+        query = '''
+            mutation($customer: ID!, $products: [ID!]) {
+                createOrder(customerId: $customer, productIds: $products) {
+                    order { customer { name } products { name } items { quantity product { name } } }
+                }
+            }
+        '''
+        data = self.execute(query, {
+            'customer': self.customers[1].pk, 'products': [self.products[0].pk, self.products[2].pk],
+        })
+        self.assertEqual(data['createOrder']['order'], {
+            'customer': {'name': 'Customer 1'},
+            'products': [{'name': 'Product 0'}, {'name': 'Product 2'}],
+            'items': [
+                {'quantity': 1, 'product': {'name': 'Product 0'}},
+                {'quantity': 1, 'product': {'name': 'Product 2'}},
+            ],
+        })
+
+        data = self.execute(
+            'mutation { createCustomer(name: "New", email: "new@example.com") { customer { orders { id } } } }'
+        )
+        self.assertEqual(data['createCustomer']['customer'], {'orders': []})
+
+
+class OptimizerTests(CRMTestCase):
+
+    def capture(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.graphql(query)
+        self.assertNotIn('errors', response)
+        return response['data'], [query['sql'] for query in queries]
+
+    def test_unselected_columns_are_deferred(self):
+        data, queries = self.capture('query { allProducts { edges { node { name price } } } }')
+        self.assertEqual(len(data['allProducts']['edges']), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"crm_product"."price"', queries[0])
+        for column in ('description', 'stock', 'created_at'):
+            self.assertNotIn(f'"crm_product"."{column}"', queries[0])
+
+    def test_forward_foreign_keys_are_joined(self):
+        for customer in self.customers:
+            create_order(customer, self.products[:1])
+        data, queries = self.capture('query { allOrders { edges { node { totalAmount customer { name } } } } }')
+        self.assertEqual(
+            [edge['node']['customer']['name'] for edge in data['allOrders']['edges']],
+            ['Customer 0', 'Customer 1', 'Customer 2'],
+        )
+        self.assertEqual(len(queries), 1)
+        self.assertIn('JOIN "crm_customer"', queries[0])
+        self.assertNotIn('"crm_customer"."email"', queries[0])
+
+    def test_nested_page_prefetches_in_a_fixed_number_of_queries(self):
+        query = '''
+            query {
+                allCustomers {
+                    edges { node { name orders { totalAmount products { name } items { quantity } } } }
+                }
+            }
+        '''
+        # The page, its orders, their products and their items: the same four
+        # queries however many rows each level has.
+        for count in (1, 9):
+            for i in range(count):
+                create_order(self.customers[i % 3], self.products[:i % 3 + 1])
+            with self.assertNumQueries(4):
+                data, queries = self.capture(query)
+            self.assertEqual(
+                sum(len(edge['node']['orders']) for edge in data['allCustomers']['edges']),
+                Order.objects.count(),
+            )
+        self.assertIn('"crm_order"', queries[1])
+        self.assertNotIn('"crm_order"."order_date"', queries[1])
+
+    def test_plan(self):
+        document = parse('''
+            query { allOrders { edges { node { ...Order } } } }
+            fragment Order on OrderType { totalAmount customer { email } products { name } }
+        ''')
+        fragments = {
+            definition.name.value: definition
+            for definition in document.definitions if isinstance(definition, FragmentDefinitionNode)
+        }
+        edges = collect_fields(document.definitions[0].selection_set.selections, fragments)
+        node = collect_fields(collect_fields(edges['edges'], fragments)['node'], fragments)
+
+        only, select, prefetch = plan(Order, node, fragments)
+        self.assertEqual(only, ['id', 'total_amount', 'customer', 'customer__id', 'customer__email'])
+        self.assertEqual(select, ['customer'])
+        self.assertEqual([lookup.prefetch_to for lookup in prefetch], ['products'])
+        self.assertEqual(prefetch[0].queryset.query.deferred_loading, ({'id', 'name'}, False))
+
+
+class KeysetPaginationTests(CRMTestCase):
+
+    QUERY = '''
+        query($first: Int, $after: String, $last: Int, $before: String, $orderBy: String) {
+            allCustomers(first: $first, after: $after, last: $last, before: $before, orderBy: $orderBy) {
+                edges { cursor node { id } }
+                pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Ties on the name: the primary key orders them.
+        Customer.objects.bulk_create(
+            Customer(name=f'Customer {i % 2}', email=f'tie{i}@example.com') for i in range(6)
+        )
+
+    def page(self, **variables):
+        response = self.graphql(self.QUERY, variables)
+        self.assertNotIn('errors', response)
+        connection = response['data']['allCustomers']
+        return [int(edge['node']['id']) for edge in connection['edges']], connection['pageInfo']
+
+    def walk_forward(self, size, order_by=None):
+        ids, after = [], None
+        while True:
+            page, info = self.page(first=size, after=after, orderBy=order_by)
+            ids += page
+            if not info['hasNextPage']:
+                return ids
+            self.assertTrue(page)
+            after = info['endCursor']
+
+    def walk_backward(self, size, order_by=None):
+        ids, before = [], None
+        while True:
+            page, info = self.page(last=size, before=before, orderBy=order_by)
+            ids = page + ids
+            if not info['hasPreviousPage']:
+                return ids
+            self.assertTrue(page)
+            before = info['startCursor']
+
+    def expected(self, *ordering):
+        return list(Customer.objects.order_by(*ordering, 'pk').values_list('pk', flat=True))
+
+    def test_first_after_and_last_before(self):
+        expected = self.expected()
+        for size in (1, 2, 4, 9, 20):
+            self.assertEqual(self.walk_forward(size), expected)
+            self.assertEqual(self.walk_backward(size), expected)
+
+        ids, info = self.page(first=3)
+        self.assertFalse(info['hasPreviousPage'])
+        self.assertTrue(info['hasNextPage'])
+        ids, info = self.page(first=3, after=info['endCursor'])
+        self.assertEqual(ids, expected[3:6])
+        self.assertTrue(info['hasPreviousPage'])
+        ids, info = self.page(last=2, before=info['startCursor'])
+        self.assertEqual(ids, expected[1:3])
+
+    def test_ties_on_the_ordering_column(self):
+        for order_by in ('name', '-name'):
+            expected = self.expected(order_by)
+            for size in (1, 2, 3, 4):
+                self.assertEqual(self.walk_forward(size, order_by), expected)
+                self.assertEqual(self.walk_backward(size, order_by), expected)
+
+    def test_invalid_cursor(self):
+        _, info = self.page(first=1, orderBy='name')
+        name_cursor = info['endCursor']
+        # not base64, a key that is not a primary key, a cursor of another ordering
+        for cursor in ('not a cursor', 'WyJ4Il0=', name_cursor):
+            response = self.graphql(self.QUERY, {'first': 2, 'after': cursor})
+            self.assertIsNone(response['data']['allCustomers'])
+            self.assertEqual(
+                response['errors'][0]['message'],
+                f"Invalid cursor '{cursor}' for the current ordering.",
+            )
+
+    def test_negative_page_size(self):
+        for arguments in ({'first': -1}, {'last': -2}, {'first': 2, 'last': -1}):
+            response = self.graphql(self.QUERY, arguments)
+            self.assertIsNone(response['data']['allCustomers'])
+            name = [name for name, value in arguments.items() if value < 0][0]
+            self.assertEqual(response['errors'][0]['message'], f"{name} must not be negative.")
+        response = self.graphql('query { allCustomers(first: 1, offset: -1) { edges { node { id } } } }')
+        self.assertEqual(response['errors'][0]['message'], "offset must not be negative.")
+
+    def test_total_count_only_when_selected(self):
+        with self.assertNumQueries(1):
+            self.page(first=2)
+        with self.assertNumQueries(2):
+            response = self.graphql('query { allCustomers(first: 2) { totalCount edges { node { id } } } }')
+        self.assertEqual(response['data']['allCustomers']['totalCount'], Customer.objects.count())
+
+
+class BulkCreateCustomersTests(CRMTestCase):
+
+    MUTATION = '''
+        mutation($customers: [CustomerInput!]!, $batchSize: Int) {
+            bulkCreateCustomers(customersData: $customers, batchSize: $batchSize) {
+                customers { name email }
+                errors
+            }
+        }
+    '''
+
+    def test_duplicates_and_per_row_errors(self):
+        rows = [
+            {'name': 'A', 'email': 'a@example.com'},
+            {'name': 'A again', 'email': 'a@example.com'},
+            {'name': 'Existing', 'email': 'customer0@example.com'},
+            {'name': 'B', 'email': 'b@example.com', 'phone': 'not a phone'},
+            {'name': 'C', 'email': 'c@example.com', 'phone': '123-456-7890'},
+            # stored by the first batch when batches hold two rows
+            {'name': 'A later', 'email': 'a@example.com'},
+        ]
+        row_6 = {
+            None: "Row 6: Duplicate email 'a@example.com' in the same request.",
+            2: "Row 6: Customer with email 'a@example.com' already exists.",
+        }
+        for batch_size in (None, 2):
+            with self.subTest(batch_size=batch_size):
+                Customer.objects.exclude(pk__in=[customer.pk for customer in self.customers]).delete()
+                response = self.graphql(self.MUTATION, {'customers': rows, 'batchSize': batch_size})
+                result = response['data']['bulkCreateCustomers']
+                self.assertEqual(result['customers'], [
+                    {'name': 'A', 'email': 'a@example.com'},
+                    {'name': 'C', 'email': 'c@example.com'},
+                ])
+                self.assertEqual(result['errors'], [
+                    "Row 2: Duplicate email 'a@example.com' in the same request.",
+                    "Row 3: Customer with email 'customer0@example.com' already exists.",
+                    "Row 4 (b@example.com): Phone number must be entered in the format: "
+                    "'+999999999' or '123-456-7890'.",
+                    row_6[batch_size],
+                ])
+                self.assertEqual(Customer.objects.count(), 5)
+
+    def test_queries_per_batch(self):
+        rows = [{'name': f'New {i}', 'email': f'new{i}@example.com'} for i in range(10)]
+        # Per batch: the email lookup, the INSERT, and the DailyStats INSERT
+        # and UPDATE inside their savepoint.
+        for batch_size, batches in ((10, 1), (4, 3)):
+            Customer.objects.filter(name__startswith='New').delete()
+            with self.assertNumQueries(6 * batches):
+                results = list(create_customers(rows, batch_size))
+            self.assertEqual([len(created) for created, _ in results], [
+                min(batch_size, 10 - start) for start in range(0, 10, batch_size)
+            ])
+            self.assertEqual(Customer.objects.filter(name__startswith='New').count(), 10)
+
+
+class ImportTests(TestCase):
+
+    CUSTOMERS_CSV = [
+        b'name,email,phone\n',
+        b'Ann,ann@example.com,\n',
+        b'Bob,bob@example.com,123-456-7890\n',
+        b'Ann again,ann@example.com,\n',
+        b'No email,not-an-email,\n',
+        b'Cat,cat@example.com,12\n',
+    ]
+
+    def test_read_csv(self):
+        self.assertEqual(list(importers.read_csv(self.CUSTOMERS_CSV[:3])), [
+            {'name': 'Ann', 'email': 'ann@example.com', 'phone': None},
+            {'name': 'Bob', 'email': 'bob@example.com', 'phone': '123-456-7890'},
+        ])
+
+    def test_read_ndjson(self):
+        rows = list(importers.read_ndjson([
+            b'{"name": "Ann"}\n', b'\n', b'{"name": \n', b'[1, 2]\n', '{"name": "Bob"}',
+        ]))
+        self.assertEqual(rows[0], {'name': 'Ann'})
+        self.assertIsInstance(rows[1], ValueError)
+        self.assertTrue(str(rows[1]).startswith('Invalid JSON: '))
+        self.assertEqual(str(rows[2]), 'Each NDJSON line must be a JSON object.')
+        self.assertEqual(rows[3], {'name': 'Bob'})
+
+    def test_row_errors_are_numbered(self):
+        report = importers.import_rows('customers', self.CUSTOMERS_CSV)
+        self.assertEqual((report.created, report.rejected, report.batches), (2, 3, 1))
+        self.assertEqual(report.errors, [
+            "Row 3: Duplicate email 'ann@example.com' in the same request.",
+            "Row 4 (not-an-email): email: Enter a valid email address.",
+            "Row 5 (cat@example.com): Phone number must be entered in the format: "
+            "'+999999999' or '123-456-7890'.",
+        ])
+
+        lines = [
+            b'{"name": "Desk", "price": "120.00", "stock": 3}\n',
+            b'not json\n',
+            b'{"name": "Free", "price": "0"}\n',
+        ]
+        report = importers.import_rows('products', lines, 'ndjson')
+        self.assertEqual(report.created, 1)
+        self.assertEqual([error.split(':')[0] for error in report.errors], ['Row 2', 'Row 3 (Free)'])
+
+    def test_batches_commit_separately(self):
+        lines = [b'{"name": "P%d", "price": "1.00"}\n' % i for i in range(5)]
+        batches = []
+        report = importers.import_rows(
+            'products', lines, 'ndjson', batch_size=2,
+            on_batch=lambda report, errors: batches.append(report.created),
+        )
+        self.assertEqual(batches, [2, 4, 5])
+        self.assertEqual(report.as_dict()['batches'], 3)
+        self.assertEqual(Product.objects.count(), 5)
+
+    def test_unknown_kind_or_format(self):
+        with self.assertRaisesMessage(ValueError, "Unknown import kind 'orders'"):
+            importers.import_rows('orders', [])
+        with self.assertRaisesMessage(ValueError, "Unknown format 'xml'"):
+            importers.import_rows('products', [], 'xml')
+
+
+@override_settings(CRM_IMPORT={'TOKEN': 'import-secret'})
+class ImportEndpointTests(TestCase):
+
+    NDJSON = b'{"name": "Desk", "price": "120.00"}\n{"name": "Lamp", "price": "15.50", "stock": 4}\n'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('staff', password='x', is_staff=True)
+        cls.user = User.objects.create_user('user', password='x')
+
+    def post(self, path='/import/products/', client=None, **extra):
+        client = client or self.client
+        return client.post(path, self.NDJSON, content_type='application/x-ndjson', **extra)
+
+    def test_token(self):
+        response = self.post(HTTP_AUTHORIZATION='Bearer import-secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(self.post(HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        with override_settings(CRM_IMPORT={'TOKEN': None}):
+            self.assertEqual(self.post(HTTP_AUTHORIZATION='Bearer None').status_code, 401)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_staff_session_with_csrf(self):
+        self.assertEqual(self.post().status_code, 401)
+        self.client.force_login(self.user)
+        self.assertEqual(self.post().status_code, 403)
+
+        client = self.client_class(enforce_csrf_checks=True)
+        client.force_login(self.staff)
+        self.assertEqual(self.post(client=client).status_code, 403)
+        self.assertFalse(Product.objects.exists())
+
+        token = 'a' * 32
+        client.cookies['csrftoken'] = token
+        response = self.post(client=client, HTTP_X_CSRFTOKEN=token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 2)
+
+    def test_upload_and_unknown_kind(self):
+        self.client.force_login(self.staff)
+        upload = SimpleUploadedFile('customers.csv', b'name,email\nAnn,ann@example.com\nBad,bad\n')
+        response = self.client.post('/import/customers/', {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report['kind'], report['created'], report['rejected']), ('customers', 1, 1))
+        self.assertEqual(report['errors'], ['Row 2 (bad): email: Enter a valid email address.'])
+
+        response = self.post('/import/orders/')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Unknown import kind 'orders'", response.json()['error'])
+        response = self.post('/import/products/?format=xml')
+        self.assertEqual(response.json(), {'error': "Unknown format 'xml'."})
+
+
+class ReportTotalsTests(CRMTestCase):
+
+    def test_total_revenue_has_two_decimal_places(self):
+        for price in ('1019.95', '1010.00', '1010.00'):
+            Order.objects.create(customer=self.customers[0], total_amount=price)
+        response = self.graphql('query { totalOrders totalRevenue dailyStats { orders } }')
+        self.assertEqual(response['data']['totalOrders'], 3)
+        self.assertEqual(response['data']['totalRevenue'], '3039.95')
+        self.assertEqual(DailyStats.objects.get().orders, 3)
+
+        DailyStats.objects.all().delete()
+        self.assertEqual(self.graphql('query { totalRevenue }')['data']['totalRevenue'], '0.00')
+
+
+class DailyStatsTests(TestCase):
+    # Not CRMTestCase: its bulk-created fixture customers are not counted.
+
+    def setUp(self):
+        self.product = Product.objects.create(name='Product', price='12.50', stock=100)
+
+    def assertStatsMatchTables(self):
+        expected = {
+            day: (values.get('customers', 0), values.get('orders', 0),
+                  Decimal(values.get('revenue', 0)).quantize(stats.CENT))
+            for day, values in stats.day_buckets(Customer.objects.all(), Order.objects.all()).items()
+        }
+        actual = {
+            row.date: (row.customers, row.orders, row.revenue.quantize(stats.CENT))
+            for row in DailyStats.objects.all()
+            if row.customers or row.orders or row.revenue
+        }
+        self.assertEqual(actual, expected)
+
+    def days_ago(self, days):
+        return timezone.now() - timedelta(days=days)
+
+    def test_saves_and_deletes(self):
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        recent = Order.objects.create(customer=customer, total_amount='10.00')
+        old = Order.objects.create(customer=customer, total_amount='5.25', order_date=self.days_ago(3))
+        self.assertStatsMatchTables()
+
+        recent.total_amount = Decimal('11.00')
+        recent.save()
+        old.order_date = self.days_ago(5)
+        old.save()
+        self.assertStatsMatchTables()
+
+        recent.delete()
+        self.assertStatsMatchTables()
+        # cascades to the remaining order
+        customer.delete()
+        self.assertStatsMatchTables()
+        self.assertEqual(stats.totals(), {'customers': 0, 'orders': 0, 'revenue': Decimal('0.00')})
+
+    def test_bulk_create_and_raw_delete(self):
+        rows = [{'name': f'C{i}', 'email': f'c{i}@example.com'} for i in range(4)]
+        customers = [customer for created, _ in create_customers(rows, 3) for customer in created]
+        rows = [
+            {'customer_id': customer.pk, 'product_ids': [self.product.pk], 'order_date': self.days_ago(i)}
+            for i, customer in enumerate(customers * 2)
+        ]
+        for _ in create_orders(rows, 3):
+            pass
+        self.assertEqual(stats.totals(), {'customers': 4, 'orders': 8, 'revenue': Decimal('100.00')})
+        self.assertStatsMatchTables()
+
+        with write_atomic():
+            cleanup.delete_batch([customer.pk for customer in customers[:3]])
+        self.assertEqual(stats.totals(), {'customers': 1, 'orders': 2, 'revenue': Decimal('25.00')})
+        self.assertStatsMatchTables()
+
+    def test_record_deleted(self):
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        Order.objects.create(customer=customer, total_amount='7.00', order_date=self.days_ago(2))
+        stats.record_deleted(Customer.objects.all(), Order.objects.all())
+        self.assertEqual(stats.totals(), {'customers': 0, 'orders': 0, 'revenue': Decimal('0.00')})
+
+    def test_rebuild(self):
+        customer = Customer.objects.create(name='Ann', email='ann@example.com')
+        Order.objects.create(customer=customer, total_amount='7.00', order_date=self.days_ago(2))
+        Order.objects.create(customer=customer, total_amount='3.00')
+        DailyStats.objects.update(customers=F('customers') + 5, revenue=0)
+        DailyStats.objects.create(date=self.days_ago(30).date(), orders=2)
+
+        out = StringIO()
+        call_command('rebuild_crm_stats', stdout=out)
+        self.assertIn('Rebuilt CRM stats for 2 days.', out.getvalue())
+        self.assertStatsMatchTables()
+        self.assertEqual(DailyStats.objects.count(), 2)
+
+
+@override_settings(CRM_GRAPHQL_CACHE={'ENABLED': True, 'CACHE_ALIAS': 'graphql', 'TIMEOUT': 60})
+class ResponseCacheTests(CRMTestCase):
+
+    QUERY = 'query { allProducts { edges { node { name stock } } } }'
+
+    def setUp(self):
+        caches['graphql'].clear()
+
+    def stock(self):
+        response = self.graphql(self.QUERY)
+        return [edge['node']['stock'] for edge in response['data']['allProducts']['edges']]
+
+    def assertCache(self, status, stock):
+        self.assertEqual(self.stock(), stock)
+        self.assertEqual(self.response['X-GraphQL-Cache'], status)
+
+    def test_miss_hit_invalidate(self):
+        self.assertCache('MISS', [100, 100, 100])
+        self.assertCache('HIT', [100, 100, 100])
+
+        # Product signals
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[0].pk).update(stock=5)
+        self.assertCache('HIT', [100, 100, 100])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk=self.products[1].pk).save()
+        self.assertCache('MISS', [5, 100, 100])
+        self.assertCache('HIT', [5, 100, 100])
+
+    def test_stock_updates_invalidate(self):
+        self.assertCache('MISS', [100, 100, 100])
+        for optimistic in (False, True):
+            with self.captureOnCommitCallbacks(execute=True):
+                Product.objects.reserve_stock({self.products[0].pk: 1}, optimistic=optimistic)
+            stock = [99 - optimistic, 100, 100]
+            self.assertCache('MISS', stock)
+            self.assertCache('HIT', stock)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.products[2].pk).update(stock=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.restock_low_stock(threshold=10, increment=10)
+        self.assertCache('MISS', [98, 100, 13])
+
+    def test_counters_on_metrics(self):
+        def count(metric, *labels):
+            return metric.values.get(labels, 0)
+
+        before = [
+            count(metrics.GRAPHQL_CACHE_LOOKUPS, 'hit'),
+            count(metrics.GRAPHQL_CACHE_LOOKUPS, 'miss'),
+            count(metrics.GRAPHQL_CACHE_INVALIDATIONS, 'product'),
+        ]
+        self.assertCache('MISS', [100, 100, 100])
+        self.assertCache('HIT', [100, 100, 100])
+        self.assertCache('HIT', [100, 100, 100])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(pk=self.products[1].pk).save()
+        after = [
+            count(metrics.GRAPHQL_CACHE_LOOKUPS, 'hit'),
+            count(metrics.GRAPHQL_CACHE_LOOKUPS, 'miss'),
+            count(metrics.GRAPHQL_CACHE_INVALIDATIONS, 'product'),
+        ]
+        self.assertEqual([b - a for a, b in zip(before, after)], [2, 1, 1])
+
+        exposition = self.client.get('/metrics').content.decode()
+        self.assertIn(f'crm_graphql_cache_lookups_total{{result="hit"}} {after[0]}\n', exposition)
+        self.assertIn(f'crm_graphql_cache_invalidations_total{{tag="product"}} {after[2]}\n', exposition)
+
+
+class GraphQLViewTests(CRMTestCase):
+
+    CREATE_ORDER = '''
+        mutation($customer: ID!, $products: [ID!]) {
+            createOrder(customerId: $customer, productIds: $products) {
+                order { totalAmount customer { name } products { name } items { product { name } } }
+            }
+        }
+    '''
+
+    def test_mutation_payload_with_loader_fields(self):
+        variables = {'customer': self.customers[0].pk, 'products': [self.products[1].pk]}
+        response = self.graphql(self.CREATE_ORDER, variables)
+        self.assertNotIn('errors', response)
+        self.assertEqual(response['data']['createOrder']['order'], {
+            'totalAmount': '20.00',
+            'customer': {'name': 'Customer 0'},
+            'products': [{'name': 'Product 1'}],
+            'items': [{'product': {'name': 'Product 1'}}],
+        })
+
+        response = self.graphql(
+            'mutation { createCustomer(name: "New", email: "new@example.com") { customer { orders { id } } } }'
+        )
+        self.assertEqual(response['data']['createCustomer']['customer'], {'orders': []})
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class PersistedQueryTests(CRMTestCase):
+
+    QUERY = 'query { allProducts { edges { node { name } } } }'
+
+    def setUp(self):
+        caches['graphql-apq'].clear()
+
+    def post(self, query=None, digest=None, **persisted):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': digest, **persisted}}
+        response = self.client.post(
+            '/graphql/', json.dumps({'query': query, 'extensions': extensions}),
+            content_type='application/json',
+        )
+        return response.json()
+
+    def assertError(self, response, message, code=None):
+        self.assertEqual(response['errors'][0]['message'], message)
+        if code is not None:
+            self.assertEqual(response['errors'][0]['extensions']['code'], code)
+
+    def test_not_found_register_hit(self):
+        digest = documents.query_hash(self.QUERY)
+        self.assertError(self.post(digest=digest), 'PersistedQueryNotFound', 'PERSISTED_QUERY_NOT_FOUND')
+        self.assertEqual(len(self.post(self.QUERY, digest)['data']['allProducts']['edges']), 3)
+        # Response cache churn leaves the registered query alone.
+        caches['graphql'].clear()
+        self.assertEqual(len(self.post(digest=digest)['data']['allProducts']['edges']), 3)
+
+    def test_invalid_requests(self):
+        self.assertError(
+            self.post(self.QUERY, documents.query_hash('query { hello }')),
+            'Provided sha256Hash does not match the query.', 'PERSISTED_QUERY_HASH_MISMATCH',
+        )
+        self.assertError(self.post(digest=None), 'Persisted query is missing its sha256Hash.')
+        self.assertError(
+            self.post(digest=documents.query_hash(self.QUERY), version=2),
+            'Unsupported persisted query version.',
+        )
+        with override_settings(CRM_GRAPHQL_DOCUMENTS={'PERSISTED_QUERIES': False}):
+            self.assertError(
+                self.post(digest=documents.query_hash(self.QUERY)),
+                'PersistedQueryNotSupported', 'PERSISTED_QUERY_NOT_SUPPORTED',
+            )
+
+        response = self.client.get('/graphql/', {'query': self.QUERY, 'extensions': '{"persistedQuery":'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertError(response.json(), 'Extensions must be a JSON object.')
+        # Extensions that are not an object are ignored.
+        response = self.client.get('/graphql/', {'query': self.QUERY, 'extensions': '[1]'},
+                                   HTTP_ACCEPT='application/json')
+        self.assertNotIn('errors', response.json())
+
+
+class DocumentCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.schema = graphene_settings.SCHEMA.graphql_schema
+        self.cache = documents.DocumentCache(2)
+
+    def test_lru_eviction(self):
+        queries = ['query { hello }', 'query { totalOrders }', 'query { totalCustomers }']
+        self.cache.get(self.schema, queries[0])
+        self.cache.get(self.schema, queries[1])
+        self.cache.get(self.schema, queries[0])
+        self.cache.get(self.schema, queries[2])
+        self.assertEqual(
+            list(self.cache._entries), [(self.schema, documents.query_hash(query)) for query in queries[::2]],
+        )
+        self.assertEqual(self.cache.stats(), {'size': 2, 'hits': 1, 'misses': 3})
+
+    def test_cached_document_skips_parse_and_validate(self):
+        query = 'query { hello }'
+        with mock.patch('crm.documents.parse', wraps=parse) as parse_, \
+                mock.patch('crm.documents.validate', wraps=validate) as validate_:
+            first, errors = self.cache.get(self.schema, query)
+            self.assertEqual(errors, [])
+            timings = {}
+            second, _ = self.cache.get(self.schema, query, timings)
+        self.assertIs(second, first)
+        self.assertEqual((parse_.call_count, validate_.call_count), (1, 1))
+        self.assertEqual(timings, {'parse': 0, 'validate': 0})
+
+    def test_invalid_documents_are_not_kept(self):
+        document, errors = self.cache.get(self.schema, 'query {')
+        self.assertIsNone(document)
+        self.assertEqual(len(errors), 1)
+        document, errors = self.cache.get(self.schema, 'query { nope }')
+        self.assertIsNotNone(document)
+        self.assertEqual(errors[0].message, "Cannot query field 'nope' on type 'Query'.")
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+
+class QueryCostTests(CRMTestCase):
+
+    ORDERS = 'query($n: Int) { allOrders(first: $n) { edges { node { id customer { name } } } } }'
+
+    def measure(self, query, variables=None, **limits):
+        rule = QueryCostRule.bind(variables)
+        with override_settings(GRAPHENE={**settings.GRAPHENE, **limits}):
+            errors = validate(graphene_settings.SCHEMA.graphql_schema, parse(query), [rule])
+        return rule.result, [error.message for error in errors]
+
+    def test_connection_multipliers(self):
+        # allOrders 1 + n * (edges 1 + node 1 + customer 1); depth 5 at name
+        self.assertEqual(self.measure(self.ORDERS, {'n': 5}), ({'cost': 16, 'depth': 5}, []))
+        self.assertEqual(self.measure(self.ORDERS, {'n': 20})[0]['cost'], 61)
+        self.assertEqual(self.measure(self.ORDERS.replace('($n: Int)', '').replace('$n', '3'))[0]['cost'], 10)
+        self.assertEqual(
+            self.measure('query { allCustomers(last: 4) { edges { node { name } } } }')[0]['cost'], 9,
+        )
+        # neither first nor last: RELAY_CONNECTION_MAX_LIMIT rows
+        limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+        self.assertEqual(self.measure(self.ORDERS)[0]['cost'], 1 + limit * 3)
+        # a list with a first argument counts like a connection
+        self.assertEqual(self.measure('query { orders(first: 7) { customer { name } } }')[0]['cost'], 8)
+
+    def test_default_list_size(self):
+        query = 'query($id: ID!) { customerById(id: $id) { orders { id customer { name } } } }'
+        # customerById 1 + orders (1 + DEFAULT_LIST_SIZE * customer 1)
+        self.assertEqual(self.measure(query, {'id': 1})[0]['cost'], 12)
+        self.assertEqual(self.measure(query, {'id': 1}, DEFAULT_LIST_SIZE=3)[0]['cost'], 5)
+
+    def test_fragments(self):
+        query = '''
+            query { allOrders(first: 5) { edges { ...Edge } } }
+            fragment Edge on OrderTypeEdge { node { id ... on OrderType { customer { name } } } }
+        '''
+        self.assertEqual(self.measure(query), ({'cost': 16, 'depth': 5}, []))
+
+    def test_query_costs_overrides(self):
+        costs = {'Query.totalRevenue': 5, 'OrderType.customer': 3}
+        self.assertEqual(self.measure('query { totalRevenue }', QUERY_COSTS=costs)[0]['cost'], 5)
+        self.assertEqual(self.measure(self.ORDERS, {'n': 2}, QUERY_COSTS=costs)[0]['cost'], 1 + 2 * 5)
+
+    def test_limits(self):
+        self.assertEqual(self.measure(self.ORDERS, {'n': 5}, MAX_QUERY_DEPTH=4)[1], [
+            'Query depth 5 exceeds the maximum of 4.',
+        ])
+        self.assertEqual(self.measure(self.ORDERS, {'n': 5}, MAX_QUERY_COST=15)[1], [
+            'Query cost 16 exceeds the maximum of 15.',
+        ])
+        self.assertEqual(self.measure(self.ORDERS, {'n': 5}, MAX_QUERY_COST=16)[1], [])
+
+        with override_settings(GRAPHENE={**settings.GRAPHENE, 'MAX_QUERY_COST': 15}):
+            response = self.graphql(self.ORDERS, {'n': 5})
+        self.assertNotIn('data', response)
+        self.assertEqual(response['errors'][0]['extensions'], {'code': 'QUERY_TOO_COSTLY', 'cost': 16})
+
+    def test_cost_extension(self):
+        response = self.graphql(self.ORDERS, {'n': 5})
+        self.assertEqual(response['data'], {'allOrders': {'edges': []}})
+        self.assertEqual(response['extensions']['cost'], {'estimated': 16, 'depth': 5})
+
+
+class RecordingSink:
+    """Trace sink for TracingTests."""
+
+    traces = []
+
+    def emit(self, trace):
+        self.traces.append(trace)
+
+
+TRACING = {
+    'ENABLED': True,
+    'RESOLVERS': True,
+    'HEADER': 'X-GraphQL-Trace',
+    'SINKS': [
+        'crm.tests.RecordingSink',
+        'crm.tracing.LogSink',
+        {'class': 'crm.tracing.StatsdSink', 'host': 'statsd.example', 'port': 9125},
+        'crm.tracing.HistogramSink',
+    ],
+}
+
+
+@override_settings(CRM_GRAPHQL_TRACING=TRACING)
+class TracingTests(CRMTestCase):
+
+    QUERY = 'query Orders { allOrders { edges { node { customer { name } products { name } } } } }'
+
+    def setUp(self):
+        RecordingSink.traces = []
+        tracing._sinks.clear()
+        self.addCleanup(tracing._sinks.clear)
+        patch = mock.patch('crm.tracing.socket.socket')
+        self.socket = patch.start().return_value
+        self.addCleanup(patch.stop)
+
+    def traced(self, **extra):
+        with self.assertLogs('crm.tracing', 'INFO') as logs:
+            response = self.graphql(self.QUERY, **extra)
+        self.assertNotIn('errors', response)
+        self.log = logs.records
+        return response.get('extensions', {}).get('tracing')
+
+    def test_extension_needs_the_header_and_debug_or_staff(self):
+        self.assertIsNone(self.traced())
+        self.assertIsNone(self.traced(HTTP_X_GRAPHQL_TRACE='1'))
+        with override_settings(DEBUG=True):
+            self.assertIsNone(self.traced())
+            self.assertEqual(self.traced(HTTP_X_GRAPHQL_TRACE='1'), RecordingSink.traces[-1])
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.traced(HTTP_X_GRAPHQL_TRACE='1'), RecordingSink.traces[-1])
+        # every operation reaches the sinks, with or without the header
+        self.assertEqual(len(RecordingSink.traces), 5)
+
+        with override_settings(CRM_GRAPHQL_TRACING={**TRACING, 'ENABLED': False}, DEBUG=True):
+            response = self.graphql(self.QUERY, HTTP_X_GRAPHQL_TRACE='1')
+        self.assertNotIn('tracing', response.get('extensions', {}))
+        self.assertEqual(len(RecordingSink.traces), 5)
+
+    def test_trace_contents(self):
+        for i in range(3):
+            create_order(self.customers[i], self.products[:i + 1])
+        with override_settings(DEBUG=True), CaptureQueriesContext(connection) as queries:
+            trace = self.traced(HTTP_X_GRAPHQL_TRACE='1')
+
+        self.assertEqual(trace['operationName'], 'Orders')
+        self.assertEqual(set(trace['phases']), {'parse', 'validate', 'execute'})
+        self.assertTrue(all(duration >= 0 for duration in trace['phases'].values()))
+        self.assertEqual(trace['sql']['count'], len(queries))
+        self.assertEqual(trace['sql']['count'], 2)
+        self.assertGreater(trace['sql']['time'], 0)
+
+        resolvers = {resolver['path']: resolver for resolver in trace['resolvers']}
+        self.assertEqual(resolvers['allOrders']['parentType'], 'Query')
+        self.assertEqual(resolvers['allOrders']['returnType'], 'OrderTypeConnection')
+        self.assertEqual(resolvers['allOrders.edges.2.node.products']['fieldName'], 'products')
+        self.assertIn('allOrders.edges.0.node.customer.name', resolvers)
+        for resolver in trace['resolvers']:
+            self.assertGreaterEqual(resolver['duration'], 0)
+            self.assertGreaterEqual(resolver['startOffset'], 0)
+
+        self.assertEqual(trace, RecordingSink.traces[-1])
+
+    def test_sinks(self):
+        self.traced()
+        trace = RecordingSink.traces[-1]
+
+        summary = json.loads(self.log[-1].getMessage())
+        self.assertEqual(summary['operation'], 'Orders')
+        self.assertEqual(summary['sql'], trace['sql'])
+        self.assertLessEqual(len(summary['slowest']), 3)
+
+        lines = []
+        for call in self.socket.sendto.call_args_list:
+            data, address = call.args
+            self.assertEqual(address, ('statsd.example', 9125))
+            self.assertLess(len(data), 1400)
+            lines.extend(data.decode().split('\n'))
+        self.assertIn(f"crm.graphql.operation.Orders.duration:{trace['duration']}|ms", lines)
+        self.assertIn(f"crm.graphql.sql.count:{trace['sql']['count']}|c", lines)
+        self.assertIn(f"crm.graphql.phase.execute:{trace['phases']['execute']}|ms", lines)
+        self.assertTrue(any(line.startswith('crm.graphql.resolver.Query.allOrders:') for line in lines))
+
+        histograms = tracing.get_sinks()[3].snapshot()
+        self.assertEqual(histograms['operation:Orders']['count'], 1)
+        self.assertEqual(histograms['sql_count']['sum'], trace['sql']['count'])
+        self.assertEqual(histograms['resolver:Query.allOrders']['count'], 1)
+        self.assertEqual(set(name for name in histograms if name.startswith('phase:')), {
+            'phase:parse', 'phase:validate', 'phase:execute',
+        })
+
+
+class MetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        self.requests = metrics.Counter('requests_total', 'Requests.', ('path',), registry=self.registry)
+        self.latency = metrics.Histogram(
+            'latency_seconds', 'Latency.', registry=self.registry, buckets=(0.1, 1.0),
+        )
+
+    def test_exposition(self):
+        self.requests.inc(path='/a')
+        self.requests.inc(2, path='say "hi"\n')
+        for value in (0.05, 0.1, 0.5, 3):
+            self.latency.observe(value)
+        self.assertEqual(self.registry.expose(), '\n'.join([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{path="/a"} 1',
+            'requests_total{path="say \\"hi\\"\\n"} 2',
+            '# HELP latency_seconds Latency.',
+            '# TYPE latency_seconds histogram',
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1.0"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 3.65',
+            'latency_seconds_count 4',
+        ]) + '\n')
+
+    def test_operation_labels(self):
+        def label(query):
+            document = parse(query)
+            return metrics.operation_label(get_operation_ast(document), document)
+
+        self.assertEqual(label('mutation Anything { createOrder(customerId: 1) { order { id } } }'),
+                         ('createOrder', 'mutation'))
+        self.assertEqual(label('query { b: totalOrders totalCustomers totalOrders }'),
+                         ('totalCustomers,totalOrders', 'query'))
+        self.assertEqual(
+            label('query Q { ...F ... on Query { hello } } fragment F on Query { totalRevenue }'),
+            ('hello,totalRevenue', 'query'),
+        )
+        self.assertEqual(metrics.operation_label(None), ('unknown', 'unknown'))
+        with override_settings(CRM_METRICS={'OPERATION_NAMES': ['Dashboard']}):
+            self.assertEqual(label('query Dashboard { totalOrders }'), ('Dashboard', 'query'))
+            self.assertEqual(label('query Other { totalOrders }'), ('totalOrders', 'query'))
+
+
+class MultiprocessMetricsTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings = override_settings(CRM_METRICS={'MULTIPROCESS_DIR': directory.name, 'FLUSH_INTERVAL': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+        exited = subprocess.Popen([sys.executable, '-c', ''])
+        exited.wait()
+        self.exited_pid = exited.pid
+
+    def process(self, pid=None, requests=0, latency=()):
+        """A registry standing for a worker process with ``pid``."""
+        registry = metrics.Registry()
+        counter = metrics.Counter('requests_total', 'Requests.', registry=registry)
+        histogram = metrics.Histogram('latency_seconds', 'Latency.', registry=registry, buckets=(1.0,))
+        registry.pid = pid or os.getpid()
+        if requests:
+            counter.inc(requests)
+        for value in latency:
+            histogram.observe(value)
+        return registry
+
+    def totals(self, registry):
+        samples = registry.aggregate()
+        return samples['requests_total'].get('[]', 0), samples['latency_seconds'].get('[]')
+
+    def files(self):
+        return sorted(path.name for path in self.directory.glob('metrics-*.json'))
+
+    def test_reused_pid_does_not_overwrite(self):
+        first = self.process(requests=5)
+        first.flush()
+        second = self.process(requests=1)
+        self.assertEqual(second.pid, first.pid)
+        self.assertEqual(self.totals(second)[0], 6)
+        self.assertEqual(len(self.files()), 2)
+
+    def test_exited_processes_are_retired(self):
+        exited = self.process(self.exited_pid, requests=5, latency=(0.5, 2))
+        exited.started = True  # it ran before this test
+        exited.flush()
+
+        current = self.process(requests=1, latency=(0.5,))
+        self.assertEqual(self.totals(current), (6, [2, 1, 3.0]))
+        self.assertEqual(self.files(), sorted(['metrics-retired.json', current.filename]))
+
+        # Another exited worker adds to the retired totals.
+        another = self.process(self.exited_pid, requests=1)
+        another.started = True
+        another.flush()
+        later = self.process(requests=2)
+        self.assertEqual(self.totals(later)[0], 9)
+        self.assertEqual(
+            self.files(), sorted(['metrics-retired.json', current.filename, later.filename]),
+        )
+
+    def test_retired_file_is_counted_once(self):
+        exited = self.process(self.exited_pid, requests=5)
+        exited.started = True
+        exited.flush()
+        self.process().flush()
+        # As if removing the merged file had failed.
+        exited.flush()
+        self.assertEqual(self.totals(self.process())[0], 5)
+        self.assertNotIn(exited.filename, self.files())
+
+    def test_forked_child_starts_over(self):
+        registry = self.process(requests=3)
+        filename = registry.filename
+        registry.reset()
+        self.assertNotEqual(registry.filename, filename)
+        self.assertEqual(registry.collect(), {'requests_total': {}, 'latency_seconds': {}})
+
+
+class MetricsEndpointTests(CRMTestCase):
+
+    def test_requests_by_root_field(self):
+        def count(operation, operation_type='query', status='ok'):
+            key = (operation, operation_type, status)
+            return metrics.GRAPHQL_REQUESTS.values.get(key, 0)
+
+        before = count('allProducts'), count('createCustomer', 'mutation')
+        self.graphql('query Named { allProducts { edges { node { name } } } }')
+        self.graphql('mutation M { createCustomer(name: "New", email: "new@example.com") { customer { id } } }')
+        self.assertEqual((count('allProducts'), count('createCustomer', 'mutation')),
+                         (before[0] + 1, before[1] + 1))
+        self.assertNotIn('Named', {key[0] for key in metrics.GRAPHQL_REQUESTS.values})
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode()
+        self.assertIn(
+            'crm_graphql_requests_total{operation="createCustomer",operation_type="mutation",status="ok"} '
+            f'{before[1] + 1}\n', body,
+        )
+        self.assertIn(
+            'crm_graphql_request_duration_seconds_bucket{operation="allProducts",operation_type="query",le="+Inf"}',
+            body,
+        )
+
+
+class AsyncGraphQLViewTests(CRMTestCase):
+
+    async def agraphql(self, query, variables=None):
+        response = await self.async_client.post(
+            '/graphql/', json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json',
+        )
+        return response.json()
+
+    async def test_mutation_payload_with_loader_fields(self):
+        variables = {'customer': self.customers[2].pk, 'products': [self.products[0].pk, self.products[1].pk]}
+        response = await self.agraphql(GraphQLViewTests.CREATE_ORDER, variables)
+        self.assertNotIn('errors', response)
+        self.assertEqual(response['data']['createOrder']['order'], {
+            'totalAmount': '30.00',
+            'customer': {'name': 'Customer 2'},
+            'products': [{'name': 'Product 0'}, {'name': 'Product 1'}],
+            'items': [{'product': {'name': 'Product 0'}}, {'product': {'name': 'Product 1'}}],
+        })
+
+    async def test_query_with_loader_fields(self):
+        await Order.objects.acreate(customer=self.customers[1], total_amount=0)
+        response = await self.agraphql(
+            'query { allCustomers(first: 2) { edges { node { name orders { customer { name } } } } } }'
+        )
+        self.assertNotIn('errors', response)
+        self.assertEqual(response['data']['allCustomers']['edges'], [
+            {'node': {'name': 'Customer 0', 'orders': []}},
+            {'node': {'name': 'Customer 1', 'orders': [{'customer': {'name': 'Customer 1'}}]}},
+        ])
+
+
+@override_settings(CRM_GRAPHQL_CONCURRENCY={'ENABLED': True, 'MAX_WORKERS': 2, 'MAX_FIELDS_PER_REQUEST': 2})
+class ConcurrentExecutionTests(TransactionTestCase):
+    # The pool threads need committed rows, hence no TestCase transaction.
+
+    def setUp(self):
+        Customer.objects.create(name='Customer', email='customer@example.com')
+        # The test database is an in-memory SQLite database in shared-cache
+        # mode, which the pool threads' connections see as well.
+        in_memory = mock.patch.object(type(connections['default']), 'is_in_memory_db', return_value=False)
+        in_memory.start()
+        self.addCleanup(in_memory.stop)
+
+        self.closed = []
+
+        def record_close():
+            close_old_connections()
+            self.closed.append((threading.current_thread().name, connection.connection is None))
+
+        close = mock.patch('crm.execution.close_old_connections', side_effect=record_close)
+        close.start()
+        self.addCleanup(close.stop)
+
+    def graphql(self, query):
+        return self.client.post('/graphql/', json.dumps({'query': query}), content_type='application/json').json()
+
+    def test_root_fields_run_in_the_pool(self):
+        response = self.graphql(
+            'query { hello allCustomers { edges { node { name } } } totalCustomers }'
+        )
+        self.assertEqual(response['data'], {
+            'hello': 'world',
+            'allCustomers': {'edges': [{'node': {'name': 'Customer'}}]},
+            'totalCustomers': 1,
+        })
+        # One close per root field, in pool threads, each closing the
+        # connection it opened (CONN_MAX_AGE = 0).
+        self.assertEqual(len(self.closed), 3)
+        for thread, closed in self.closed:
+            self.assertTrue(thread.startswith('graphql-field'))
+            self.assertTrue(closed)
+
+    def test_resolver_error_in_the_pool(self):
+        response = self.graphql('query { orders(first: -1) { id } totalCustomers hello }')
+        self.assertEqual(response['data'], {'orders': None, 'totalCustomers': 1, 'hello': 'world'})
+        self.assertEqual(response['errors'], [{
+            'message': 'first must not be negative.',
+            'locations': [{'line': 1, 'column': 9}],
+            'path': ['orders'],
+        }])
+        self.assertEqual(len(self.closed), 3)
+        self.assertTrue(all(closed for _, closed in self.closed))
+
+
+class BulkCreateOrdersTests(CRMTestCase):
+
+    MUTATION = '''
+        mutation($orders: [OrderInput!]!, $batchSize: Int) {
+            bulkCreateOrders(ordersData: $orders, batchSize: $batchSize) {
+                orders { customer { name } totalAmount items { product { name } quantity } }
+                errors
+            }
+        }
+    '''
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def test_dedup_and_per_row_errors(self):
+        p0, p1, p2 = (product.pk for product in self.products)
+        customer = self.customers[0].pk
+        rows = [
+            # product_ids repeated and merged with items: one line each
+            {'customerId': customer, 'productIds': [p0, p0, p1], 'items': [{'productId': p1, 'quantity': 2}]},
+            {'customerId': 999, 'productIds': [p0]},
+            {'customerId': customer, 'productIds': [p0, 998, 'x']},
+            {'customerId': customer, 'productIds': []},
+            {'customerId': customer, 'items': [{'productId': p2, 'quantity': 0}]},
+            {'customerId': customer, 'items': [{'productId': p2, 'quantity': 60}]},
+            # the row before took 60 of the 100 in stock
+            {'customerId': customer, 'items': [{'productId': p2, 'quantity': 60}]},
+        ]
+        for batch_size in (None, 2):
+            Order.objects.all().delete()
+            Product.objects.update(stock=100)
+            response = self.graphql(self.MUTATION, {'orders': rows, 'batchSize': batch_size})
+            result = response['data']['bulkCreateOrders']
+            self.assertEqual(result['orders'], [
+                {
+                    'customer': {'name': 'Customer 0'},
+                    'totalAmount': '50.00',
+                    'items': [
+                        {'product': {'name': 'Product 0'}, 'quantity': 1},
+                        {'product': {'name': 'Product 1'}, 'quantity': 2},
+                    ],
+                },
+                {
+                    'customer': {'name': 'Customer 0'},
+                    'totalAmount': '1800.00',
+                    'items': [{'product': {'name': 'Product 2'}, 'quantity': 60}],
+                },
+            ])
+            self.assertEqual(result['errors'], [
+                "Row 2: Customer with ID '999' does not exist.",
+                "Row 3: Invalid Product IDs found: x",
+                "Row 4: At least one product must be selected for an order.",
+                f"Row 5: Quantity for product ID {p2} must be at least 1.",
+                f"Row 7: Insufficient stock for product IDs {p2}.",
+            ])
+            self.assertEqual(self.stock(), [99, 98, 40])
+            self.assertEqual(OrderItem.objects.count(), 3)
+
+    def test_unknown_product(self):
+        p0 = self.products[0].pk
+        response = self.graphql(self.MUTATION, {'orders': [
+            {'customerId': self.customers[0].pk, 'productIds': [p0, 998]},
+        ]})
+        self.assertEqual(response['data']['bulkCreateOrders'], {
+            'orders': [], 'errors': ['Row 1: Invalid Product IDs found: 998'],
+        })
+        self.assertEqual(self.stock(), [100, 100, 100])
+
+
+class StockReservationTests(CRMTestCase):
+
+    def test_insufficient_stock_leaves_stock_unchanged(self):
+        p0, p1, p2 = self.products
+        # Product 0 is reserved before product 1 turns out to be short.
+        quantities = {p0.pk: 5, p1.pk: 101, p2.pk: 1}
+        for mode in ('lock', 'optimistic'):
+            with self.subTest(mode=mode):
+                with self.assertRaises(InsufficientStock) as raised:
+                    place_order(self.customers[0], quantities, mode=mode)
+                self.assertEqual([product.pk for product in raised.exception.products], [p1.pk])
+                self.assertEqual(
+                    str(raised.exception),
+                    f"Insufficient stock for Product 1 (ID {p1.pk}): 100 available.",
+                )
+                self.assertEqual(
+                    list(Product.objects.order_by('pk').values_list('stock', flat=True)), [100, 100, 100]
+                )
+                self.assertFalse(Order.objects.exists())
+
+    def test_reservation_decrements_stock(self):
+        p0, p1, _ = self.products
+        for mode in ('lock', 'optimistic'):
+            order = place_order(self.customers[0], {p0.pk: 2, p1.pk: 1}, mode=mode)
+            self.assertEqual(order.total_amount, 40)
+        self.assertEqual(
+            list(Product.objects.order_by('pk').values_list('stock', flat=True)), [96, 98, 100]
+        )
+
+
+class OrderItemMigrationTests(TransactionTestCase):
+
+    before = [('crm', '0002_daily_stats')]
+    after = [('crm', '0003_order_items')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfills_existing_orders(self):
+        apps = self.migrate(self.before)
+        Customer = apps.get_model('crm', 'Customer')
+        Product = apps.get_model('crm', 'Product')
+        Order = apps.get_model('crm', 'Order')
+        customer = Customer.objects.create(name='Customer', email='customer@example.com')
+        cheap = Product.objects.create(name='Cheap', price='2.50')
+        dear = Product.objects.create(name='Dear', price='40.00')
+        first = Order.objects.create(customer=customer, total_amount='30.00')
+        first.products.add(cheap, dear)
+        second = Order.objects.create(customer=customer, total_amount='2.00')
+        second.products.add(cheap)
+        Order.objects.create(customer=customer, total_amount='0.00')
+
+        apps = self.migrate(self.after)
+        OrderItem = apps.get_model('crm', 'OrderItem')
+        Order = apps.get_model('crm', 'Order')
+        lines = OrderItem.objects.order_by('order_id', 'product_id').values_list(
+            'order_id', 'product_id', 'quantity', 'unit_price', 'line_total'
+        )
+        self.assertEqual(list(lines), [
+            (first.pk, cheap.pk, 1, Decimal('2.50'), Decimal('2.50')),
+            (first.pk, dear.pk, 1, Decimal('40.00'), Decimal('40.00')),
+            (second.pk, cheap.pk, 1, Decimal('2.50'), Decimal('2.50')),
+        ])
+        self.assertEqual(
+            sorted(Order.objects.get(pk=first.pk).products.values_list('name', flat=True)), ['Cheap', 'Dear']
+        )
+        # Totals stay as charged.
+        self.assertEqual(
+            list(Order.objects.order_by('pk').values_list('total_amount', flat=True)),
+            [Decimal('30.00'), Decimal('2.00'), Decimal('0.00')],
+        )
+
+        apps = self.migrate(self.before)
+        Order = apps.get_model('crm', 'Order')
+        self.assertEqual(Order.products.through.objects.count(), 3)
+
+
+class OrderTotalTests(CRMTestCase):
+
+    def total(self, order):
+        order.refresh_from_db(fields=['total_amount'])
+        return order.total_amount
+
+    def test_line_saves_and_deletes(self):
+        p0, p1, _ = self.products
+        order = create_order(self.customers[0], [p0])
+        self.assertEqual(self.total(order), 10)
+
+        line = OrderItem.for_product(p1, 3, order=order)
+        line.save()
+        self.assertEqual(self.total(order), 70)
+        line.quantity = 1
+        line.save()
+        self.assertEqual(line.line_total, 20)
+        self.assertEqual(self.total(order), 30)
+        line.delete()
+        self.assertEqual(self.total(order), 10)
+
+    def test_products_add_remove_clear(self):
+        p0, p1, p2 = self.products
+        order = create_order(self.customers[0], [p0])
+        order.products.add(p1, p2, through_defaults={'unit_price': 5, 'line_total': 0, 'quantity': 2})
+        self.assertEqual(self.total(order), 30)
+        order.products.remove(p1)
+        self.assertEqual(self.total(order), 20)
+        order.products.clear()
+        self.assertEqual(self.total(order), 0)
+
+        other = create_order(self.customers[1], [p0])
+        p1.orders.add(order, other, through_defaults={'unit_price': 7, 'line_total': 0})
+        self.assertEqual((self.total(order), self.total(other)), (7, 17))
+
+    def test_deleting_a_product_keeps_totals_as_charged(self):
+        p0, p1, _ = self.products
+        order = create_order(self.customers[0], [p0, p1])
+        Product.objects.get(pk=p1.pk).delete()
+        self.assertEqual(self.total(order), 30)
+        self.assertEqual(order.items.count(), 1)
+
+
+class FilterIndexTests(TestCase):
+    """The filtered and ordered connection queries use their indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        bench = bench_filter_indexes.Command(stdout=StringIO())
+        cls.now = bench.seed({'customers': 500, 'products': 200, 'orders': 5000})
+        cls.customer_id, cls.phone_prefix = bench.customer_id, bench.phone_prefix
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+
+    def test_filter_querysets(self):
+        bench = bench_filter_indexes.Command(stdout=StringIO())
+        bench.customer_id, bench.phone_prefix = self.customer_id, self.phone_prefix
+        cases = bench.cases(self.now)
+        # The connection queries cover the name ordering the bench leaves out.
+        self.assertEqual({index for _, index, _ in cases} | {'crm_customer_name_id_idx'}, {
+            index.name for model in (Customer, Product, Order) for index in model._meta.indexes
+        })
+        for label, index, queryset in cases:
+            with self.subTest(label):
+                self.assertIn(index, queryset[:20].explain())
+
+    def test_connection_queries(self):
+        month_ago = (self.now - timedelta(days=30)).isoformat()
+        cases = [
+            ('crm_order_date_id_idx',
+             f'allOrders(first: 20, orderBy: "-order_date", orderDate_Gte: "{month_ago}")'),
+            ('crm_order_total_id_idx', 'allOrders(first: 20, orderBy: "total_amount", totalAmount_Gte: "4900")'),
+            ('crm_product_low_stock_idx', 'allProducts(first: 20, lowStock: true, orderBy: "stock")'),
+            ('crm_product_price_id_idx', 'allProducts(first: 20, orderBy: "price")'),
+            ('crm_customer_created_id_idx',
+             f'allCustomers(first: 20, orderBy: "created_at", createdAt_Gte: "{month_ago}")'),
+            ('crm_customer_name_id_idx', 'allCustomers(first: 20, orderBy: "name")'),
+        ]
+        for index, field in cases:
+            with self.subTest(field):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.post(
+                        '/graphql/', json.dumps({'query': f'query {{ {field} {{ edges {{ cursor }} }} }}'}),
+                        content_type='application/json',
+                    )
+                self.assertNotIn('errors', response.json())
+                self.assertEqual(len(queries), 1)
+                self.assertIn(index, self.plan(queries[0]['sql']))
+
+
+class SearchIndexTests(CRMTestCase):
+
+    NAMES = ['Alice Smith', 'alicia keys', 'Malik Ali', 'Bob', '50% off', 'under_score', 'Ümit Alı']
+    VALUES = ['ali', 'ALIC', 'smith', 'al', 'b', 'ice sm', '50%', '_sc', 'ümi', 'nobody', '']
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Customer.objects.bulk_create(
+            Customer(name=name, email=f'{name.split()[0].lower()}@example.com') for name in cls.NAMES
+        )
+
+    def without_index(self):
+        return mock.patch.object(search, 'get_backend', return_value=None)
+
+    def ids(self, queryset):
+        return sorted(queryset.values_list('pk', flat=True))
+
+    def test_index_is_installed(self):
+        self.assertEqual(search.get_backend(connection), 'fts5')
+        sql = str(search.contains(Customer.objects.all(), 'name', 'ali').query)
+        self.assertIn('crm_customer_fts', sql)
+
+    def test_contains_matches_icontains(self):
+        for field in ('name', 'email'):
+            for value in self.VALUES:
+                with self.subTest(field=field, value=value):
+                    indexed = self.ids(search.contains(Customer.objects.all(), field, value))
+                    with self.without_index():
+                        fallback = self.ids(search.contains(Customer.objects.all(), field, value))
+                    self.assertEqual(indexed, fallback)
+                    self.assertEqual(indexed, self.ids(Customer.objects.filter(**{f'{field}__icontains': value})))
+
+    def test_contains_through_a_relation(self):
+        for customer in Customer.objects.all():
+            create_order(customer, self.products[:1])
+        for value in self.VALUES:
+            with self.subTest(value=value):
+                indexed = self.ids(search.contains(Order.objects.all(), 'customer__name', value))
+                with self.without_index():
+                    fallback = self.ids(search.contains(Order.objects.all(), 'customer__name', value))
+                self.assertEqual(indexed, fallback)
+
+    def test_search_matches_the_fallback(self):
+        for value in ['ali', 'ali smi', 'keys ALI', 'al', 'al ice', 'example', 'nobody']:
+            with self.subTest(value=value):
+                ranked = search.search(Customer.objects.all(), value)
+                with self.without_index():
+                    fallback = self.ids(search.search(Customer.objects.all(), value))
+                self.assertEqual(self.ids(ranked), fallback)
+
+        ranked = search.search(Customer.objects.all(), 'alice')
+        self.assertEqual(list(ranked.values_list('name', flat=True)), ['Alice Smith'])
+
+    def test_search_orders(self):
+        alice = Customer.objects.get(name='Alice Smith')
+        keyboard = Product.objects.create(name='Keyboard', price=Decimal('30.00'), stock=10)
+        first = create_order(alice, self.products[:1])
+        second = create_order(self.customers[0], [keyboard, self.products[1]])
+        third = create_order(Customer.objects.get(name='Bob'), self.products[2:])
+        query = '''
+            query($search: String) {
+                allOrders(search: $search, orderBy: "-order_date") { edges { node { id } } }
+            }
+        '''
+        for value, expected in [
+            ('alice', [first]),
+            ('bob@example', [third]),
+            ('keyb', [second]),
+            ('product', [third, second, first]),
+            ('product customer', [second]),
+            ('keyboard alice', []),
+            ('al', [first]),
+        ]:
+            with self.subTest(value=value):
+                edges = self.graphql(query, {'search': value})['data']['allOrders']['edges']
+                self.assertEqual([int(edge['node']['id']) for edge in edges], [order.pk for order in expected])
+                with self.without_index():
+                    fallback = filters.OrderFilter({'search': value}, Order.objects.all()).qs
+                self.assertEqual(self.ids(fallback), sorted(order.pk for order in expected))
+
+    def test_triggers_follow_writes(self):
+        customer = Customer.objects.get(name='Bob')
+        customer.name = 'Roberto'
+        customer.save()
+        Customer.objects.filter(name='Malik Ali').delete()
+        for value in ('bob', 'robert', 'malik', 'ali'):
+            with self.subTest(value=value):
+                self.assertEqual(
+                    self.ids(search.contains(Customer.objects.all(), 'name', value)),
+                    self.ids(Customer.objects.filter(name__icontains=value)),
+                )
+        self.assertEqual(
+            self.graphql('query { allCustomers(search: "robert") { edges { node { name } } } }')
+            ['data']['allCustomers']['edges'],
+            [{'node': {'name': 'Roberto'}}],
+        )
+
+
+class OrderProductFilterTests(CRMTestCase):
+
+    QUERY = '''
+        query($name: String, $id: Decimal, $first: Int, $after: String) {
+            allOrders(productName: $name, productId: $id, first: $first, after: $after, orderBy: "-total_amount") {
+                totalCount
+                edges { node { id } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        p0, p1, p2 = cls.products
+        # Every order but the last has several lines named "Product".
+        cls.orders = [
+            create_order(cls.customers[0], [p0, p1, p2]),
+            create_order(cls.customers[1], [p0, p1]),
+            create_order(cls.customers[2], [p1, p2], quantity=2),
+            create_order(cls.customers[0], [p2]),
+        ]
+
+    def setUp(self):
+        filters.clear_plan_cache()
+        self.addCleanup(filters.clear_plan_cache)
+
+    def walk(self, **variables):
+        ids, after = [], None
+        while True:
+            response = self.graphql(self.QUERY, {**variables, 'first': 1, 'after': after})
+            self.assertNotIn('errors', response)
+            connection = response['data']['allOrders']
+            ids += [int(edge['node']['id']) for edge in connection['edges']]
+            if not connection['pageInfo']['hasNextPage']:
+                return ids, connection['totalCount']
+            after = connection['pageInfo']['endCursor']
+
+    def expected(self, *orders):
+        return sorted((order.pk for order in orders), key=lambda pk: -Order.objects.get(pk=pk).total_amount)
+
+    def assertOrders(self, variables, orders):
+        ids, total = self.walk(**variables)
+        self.assertEqual(ids, self.expected(*orders))
+        self.assertEqual(total, len(orders))
+
+    def test_each_order_once(self):
+        first, second, third, fourth = self.orders
+        for selective_lines in (filters.SELECTIVE_LINES, 1):
+            filters.clear_plan_cache()
+            with self.subTest(selective_lines=selective_lines), \
+                    mock.patch.object(filters, 'SELECTIVE_LINES', selective_lines):
+                self.assertOrders({'name': 'product'}, self.orders)
+                self.assertOrders({'name': 'Product 1'}, [first, second, third])
+                self.assertOrders({'id': self.products[2].pk}, [first, third, fourth])
+                self.assertOrders({'name': 'nothing'}, [])
+
+    def test_semi_join_in_pages_and_counts(self):
+        queryset = filters.OrderFilter({'product_name': 'Product'}, Order.objects.all()).qs
+        self.assertIn('IN (SELECT', str(queryset.query))
+        filters.clear_plan_cache()
+        with mock.patch.object(filters, 'SELECTIVE_LINES', 1):
+            queryset = filters.OrderFilter({'product_name': 'Product'}, Order.objects.all()).qs
+        self.assertIn('EXISTS', str(queryset.order_by('pk')[:2].query))
+        self.assertNotIn('EXISTS', str(queryset.query))
+        self.assertEqual(queryset.count(), 4)
+        self.assertEqual(len(queryset.order_by('pk')[:10]), 4)
+
+    def test_line_count_is_cached(self):
+        query = 'query($id: Decimal) { allOrders(productId: $id) { edges { node { id } } } }'
+        variables = {'id': self.products[0].pk}
+        with self.assertNumQueries(2):
+            self.graphql(query, variables)
+        with self.assertNumQueries(1):
+            self.graphql(query, variables)
+
+
+class InProcessClientTests(CRMTestCase):
+
+    def test_query_with_loader_fields(self):
+        create_order(self.customers[1], self.products[1:])
+        data = execute_local('''
+            query { allCustomers(first: 2) { edges { node { name orders { products { name } } } } } }
+        ''')
+        self.assertEqual(data['allCustomers']['edges'], [
+            {'node': {'name': 'Customer 0', 'orders': []}},
+            {'node': {'name': 'Customer 1', 'orders': [{'products': [{'name': 'Product 1'}, {'name': 'Product 2'}]}]}},
+        ])
+
+    def test_mutation_with_loader_fields(self):
+        data = execute_local(GraphQLViewTests.CREATE_ORDER, {
+            'customer': self.customers[0].pk, 'products': [self.products[0].pk],
+        })
+        self.assertEqual(data['createOrder']['order']['products'], [{'name': 'Product 0'}])
+        self.assertEqual(data['createOrder']['order']['customer'], {'name': 'Customer 0'})
+
+    def test_errors_raise(self):
+        with self.assertRaisesMessage(GraphQLClientError, "Customer with ID '999' does not exist."):
+            execute_local(GraphQLViewTests.CREATE_ORDER, {'customer': 999, 'products': [self.products[0].pk]})
+        with self.assertRaisesMessage(GraphQLClientError, "Cannot query field 'nope'"):
+            execute_local('query { nope }')
+
+    def test_report_task(self):
+        from .tasks import generate_crm_report
+
+        # The fixture customers are bulk-created, outside the day buckets.
+        customer = Customer.objects.create(name='New', email='new@example.com')
+        create_order(customer, self.products[:2])
+        with mock.patch('crm.tasks.logging') as logging:
+            generate_crm_report()
+        logging.error.assert_not_called()
+        message = logging.info.call_args.args[0]
+        self.assertTrue(message.endswith(' - Report: 1 customers, 1 orders, 30.00 revenue'), message)
+
+    def test_low_stock_job(self):
+        from .cron import update_low_stock
+
+        Product.objects.filter(pk=self.products[2].pk).update(stock=4)
+        with mock.patch('crm.cron.logging') as logging:
+            update_low_stock()
+        logging.error.assert_not_called()
+        message = logging.info.call_args.args[0]
+        self.assertTrue(message.endswith(' - Product: Product 2, New Stock: 14'), message)
+
+
+class OrderReminderTests(CRMTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Five pending orders and one placed before the reminder window.
+        cls.orders = [create_order(cls.customers[i % 3], cls.products[:1]) for i in range(5)]
+        cls.old = create_order(cls.customers[0], cls.products[:1], order_date=timezone.now() - timedelta(days=30))
+        cls.since = timezone.now() - timedelta(days=7)
+
+    def test_order_ranges(self):
+        pks = [order.pk for order in self.orders]
+        self.assertEqual(
+            list(reminders.order_ranges(self.since, 2)),
+            [(pks[0], pks[1]), (pks[2], pks[3]), (pks[4], pks[4])],
+        )
+        self.assertEqual(list(reminders.order_ranges(self.since, 5)), [(pks[0], pks[4])])
+        self.assertEqual(list(reminders.order_ranges(timezone.now() + timedelta(days=1), 2)), [])
+
+    def test_send_reminders_for_one_range(self):
+        first, second = self.orders[1], self.orders[2]
+        with self.assertLogs('crm.reminders', 'INFO') as logs, self.assertNumQueries(1):
+            counts = reminders.send_reminders(self.since, first.pk, second.pk)
+        self.assertEqual(counts, {'sent': 2, 'failed': 0})
+        self.assertEqual(logs.output, [
+            f'INFO:crm.reminders:Order ID: {order.pk}, Customer Email: {order.customer.email}'
+            for order in (first, second)
+        ])
+
+        # The old order is in the range but outside the window.
+        self.assertEqual(
+            reminders.send_reminders(self.since, self.old.pk, self.old.pk), {'sent': 0, 'failed': 0}
+        )
+
+    def test_failed_reminders_are_counted(self):
+        with mock.patch.object(reminders, 'send_reminder', side_effect=[None, OSError, None]):
+            with self.assertLogs('crm.reminders', 'ERROR'):
+                counts = reminders.send_reminders(self.since, self.orders[0].pk, self.orders[2].pk)
+        self.assertEqual(counts, {'sent': 2, 'failed': 1})
+
+    def test_summarize(self):
+        with self.assertLogs('crm.reminders', 'INFO') as logs:
+            totals = reminders.summarize([{'sent': 2, 'failed': 0}, {'sent': 1, 'failed': 1}])
+        self.assertEqual(totals, {'chunks': 2, 'sent': 3, 'failed': 1})
+        self.assertEqual(logs.output, ['INFO:crm.reminders:Order reminders: 3 sent, 1 failed in 2 chunks'])
+        self.assertEqual(reminders.summarize([]), {'chunks': 0, 'sent': 0, 'failed': 0})
+
+    def test_chord(self):
+        conf = tasks.send_order_reminders.app.conf
+        self.addCleanup(setattr, conf, 'task_always_eager', conf.task_always_eager)
+        conf.task_always_eager = True
+        with mock.patch.object(tasks.summarize_order_reminders, 'run',
+                                  wraps=tasks.summarize_order_reminders.run) as summarize, \
+                self.assertLogs('crm.reminders', 'INFO') as logs:
+            tasks.send_order_reminders.delay(chunk_size=2)
+        summarize.assert_called_once_with([{'sent': 2, 'failed': 0}] * 2 + [{'sent': 1, 'failed': 0}])
+        self.assertEqual(logs.output[-1], 'INFO:crm.reminders:Order reminders: 5 sent, 0 failed in 3 chunks')
+
+    def test_local_script(self):
+        script = Path(settings.BASE_DIR) / 'crm' / 'cron_jobs' / 'send_order_reminders.py'
+        stdout = StringIO()
+        with mock.patch.object(sys, 'argv', [str(script), '--local']), \
+                mock.patch.object(sys, 'path', list(sys.path)), \
+                mock.patch('logging.basicConfig'), \
+                mock.patch('crm.tasks.send_order_reminders.delay') as delay, \
+                mock.patch('sys.stdout', stdout), \
+                self.assertLogs('crm.reminders', 'INFO') as logs:
+            runpy.run_path(str(script), run_name='__main__')
+        delay.assert_not_called()
+        self.assertEqual(stdout.getvalue(), 'Order reminders processed!\n')
+        self.assertEqual(logs.output[-1], 'INFO:crm.reminders:Order reminders: 5 sent, 0 failed in 1 chunks')
+
+    def test_query_orders_is_capped(self):
+        query = 'query($first: Int) { orders(first: $first) { id } }'
+        pks = [str(order.pk) for order in [self.old, *self.orders]]
+        with mock.patch('crm.schema.graphene_settings.RELAY_CONNECTION_MAX_LIMIT', 3):
+            self.assertEqual([order['id'] for order in self.graphql(query)['data']['orders']], pks[:3])
+            self.assertEqual(len(self.graphql(query, {'first': 10})['data']['orders']), 3)
+            self.assertEqual(len(self.graphql(query, {'first': 2})['data']['orders']), 2)
+        response = self.graphql(query, {'first': -1})
+        self.assertEqual(response['errors'][0]['message'], 'first must not be negative.')
+
+
+class InactiveCustomerCleanupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cutoff = timezone.now() - timedelta(days=365)
+        product = Product.objects.create(name='Product', price=10, stock=0)
+        cls.inactive = []
+        cls.active = []
+        for i in range(9):
+            customer = Customer.objects.create(name=f'Customer {i}', email=f'customer{i}@example.com')
+            if i % 3 == 0:
+                # never ordered
+                cls.inactive.append(customer.pk)
+                continue
+            order = create_order(customer, [product])
+            if i % 3 == 1:
+                Order.objects.filter(pk=order.pk).update(created_at=cls.cutoff - timedelta(days=30))
+                cls.inactive.append(customer.pk)
+            else:
+                cls.active.append(customer.pk)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.checkpoint = Path(directory.name) / 'cleanup.json'
+        settings = override_settings(CRM_CUSTOMER_CLEANUP={'CHECKPOINT': str(self.checkpoint), 'SLEEP': 0})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def remaining(self):
+        return sorted(Customer.objects.values_list('pk', flat=True))
+
+    def test_primary_key_batches_with_sleep(self):
+        batches = []
+        with mock.patch('crm.cleanup.time.sleep') as sleep:
+            report = cleanup.delete_inactive_customers(
+                self.cutoff, batch_size=2, sleep=0.25,
+                on_batch=lambda report: batches.append((report.last_pk, report.customers)),
+            )
+        # 6 inactive customers: three full batches, then an empty one.
+        self.assertEqual(batches, [
+            (self.inactive[1], 2), (self.inactive[3], 4), (self.inactive[5], 6),
+        ])
+        self.assertEqual(sleep.call_args_list, [mock.call(0.25)] * 3)
+        self.assertEqual((report.customers, report.orders, report.items, report.batches), (6, 3, 3, 3))
+        self.assertEqual(self.remaining(), self.active)
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertEqual(DailyStats.objects.get().customers, 3)
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_dry_run(self):
+        report = cleanup.delete_inactive_customers(self.cutoff, batch_size=4, dry_run=True)
+        self.assertEqual((report.customers, report.orders, report.items), (6, 3, 3))
+        self.assertEqual(len(self.remaining()), 9)
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_cutoff_edge(self):
+        customer = Customer.objects.get(pk=self.inactive[1])
+        order = customer.orders.get()
+        # An order created at the cutoff keeps its customer ...
+        Order.objects.filter(pk=order.pk).update(created_at=self.cutoff)
+        self.assertNotIn(customer.pk, cleanup.inactive_customers(self.cutoff).values_list('pk', flat=True))
+        # ... one just before it does not.
+        Order.objects.filter(pk=order.pk).update(created_at=self.cutoff - timedelta(microseconds=1))
+        self.assertIn(customer.pk, cleanup.inactive_customers(self.cutoff).values_list('pk', flat=True))
+
+        Order.objects.filter(pk=order.pk).update(created_at=self.cutoff)
+        cleanup.delete_inactive_customers(self.cutoff, batch_size=100)
+        self.assertEqual(self.remaining(), sorted([*self.active, customer.pk]))
+
+    def test_resume_after_an_interruption(self):
+        class Interrupted(Exception):
+            pass
+
+        def interrupt(report):
+            raise Interrupted
+
+        with self.assertRaises(Interrupted):
+            cleanup.delete_inactive_customers(self.cutoff, batch_size=4, on_batch=interrupt)
+        self.assertEqual(cleanup.load_checkpoint(), (self.cutoff, self.inactive[3]))
+        self.assertEqual(self.remaining(), sorted([*self.active, *self.inactive[4:]]))
+
+        # A later customer who orders now is no longer inactive.
+        create_order(Customer.objects.get(pk=self.inactive[5]), [Product.objects.get()])
+        out = StringIO()
+        call_command('clean_inactive_customers', '--resume', '--days', '1', stdout=out)
+        self.assertIn(f'Resuming after customer {self.inactive[3]}', out.getvalue())
+        self.assertIn('Deleted 1 inactive customers', out.getvalue())
+        self.assertEqual(self.remaining(), sorted([*self.active, self.inactive[5]]))
+        self.assertIsNone(cleanup.load_checkpoint())
+
+
+REPLICA_ROUTING = {'REPLICAS': ['replica1', 'replica2'], 'STICKY_SECONDS': 5, 'RETRY_SECONDS': 30}
+
+
+class SQLiteBackendTests(TransactionTestCase):
+
+    # What the configured pragmas read back as.
+    EXPECTED = {
+        'busy_timeout': 5000,
+        'journal_mode': 'wal',
+        'synchronous': 1,
+        'cache_size': -20000,
+        'mmap_size': 134217728,
+        'temp_store': 2,
+    }
+
+    def open(self, backend=sqlite_backend, **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        wrapper = backend.DatabaseWrapper(
+            {**connection.settings_dict, 'NAME': os.path.join(directory.name, 'db.sqlite3'), 'OPTIONS': options},
+            alias='sqlite-backend-test',
+        )
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_on_connect(self):
+        pragmas = settings.DATABASES['default']['OPTIONS']['pragmas']
+        self.assertEqual(set(pragmas), set(self.EXPECTED))
+        wrapper = self.open(pragmas=pragmas)
+        for name, value in self.EXPECTED.items():
+            with self.subTest(name):
+                self.assertEqual(self.pragma(wrapper, name), value)
+
+        # Again on a new connection.
+        wrapper.close()
+        self.assertEqual(self.pragma(wrapper, 'busy_timeout'), 5000)
+
+        plain = self.open(backend=django_sqlite_backend)
+        self.assertEqual(self.pragma(plain, 'journal_mode'), 'delete')
+
+    def test_transaction_mode(self):
+        wrapper = self.open(transaction_mode='exclusive')
+        wrapper.ensure_connection()
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper._start_transaction_under_autocommit()
+        self.assertEqual([query['sql'] for query in queries], ['BEGIN EXCLUSIVE'])
+        wrapper.connection.rollback()
+
+        with self.assertRaises(ImproperlyConfigured):
+            self.open(transaction_mode='LATER')
+
+    def begins(self, queries):
+        return [query['sql'] for query in queries if query['sql'].startswith('BEGIN')]
+
+    def test_write_atomic_begins_immediate(self):
+        with CaptureQueriesContext(connection) as queries:
+            with write_atomic():
+                Customer.objects.create(name='Ada', email='ada@example.com')
+            with transaction.atomic():
+                Customer.objects.create(name='Bob', email='bob@example.com')
+        self.assertEqual(self.begins(queries), ['BEGIN IMMEDIATE', 'BEGIN'])
+        self.assertIsNone(connection.next_transaction_mode)
+
+    def test_write_atomic_nests(self):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries, write_atomic():
+                Customer.objects.create(name='Ada', email='ada@example.com')
+        self.assertEqual(self.begins(queries), [])
+        self.assertTrue(queries[0]['sql'].startswith('SAVEPOINT'))
+
+        with CaptureQueriesContext(connection) as queries:
+            with write_atomic():
+                with transaction.atomic(), write_atomic():
+                    Customer.objects.create(name='Bob', email='bob@example.com')
+        self.assertEqual(self.begins(queries), ['BEGIN IMMEDIATE'])
+        self.assertEqual(Customer.objects.count(), 2)
+
+    def test_write_atomic_rolls_back(self):
+        with self.assertRaises(ValueError), write_atomic():
+            Customer.objects.create(name='Ada', email='ada@example.com')
+            raise ValueError
+        self.assertFalse(Customer.objects.exists())
+        self.assertIsNone(connection.next_transaction_mode)
+
+    def test_write_atomic_on_other_backends(self):
+        # Backends without next_transaction_mode get plain atomic.
+        connections['plain'] = plain = self.open(backend=django_sqlite_backend)
+        self.addCleanup(delattr, connections._connections, 'plain')
+        with CaptureQueriesContext(plain) as queries, write_atomic('plain'):
+            with plain.cursor() as cursor:
+                cursor.execute('CREATE TABLE t (x)')
+        self.assertEqual(self.begins(queries), ['BEGIN'])
+        self.assertFalse(hasattr(plain, 'next_transaction_mode'))
+
+
+class ReplicaTestMixin:
+    """Two replica aliases that always connect, with fresh health and writes."""
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(CRM_DATABASE_ROUTING=REPLICA_ROUTING)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        probe = mock.patch.object(routers, 'probe', return_value=True)
+        probe.start()
+        self.addCleanup(probe.stop)
+        for state in (routers._down_until, routers._latency):
+            self.addCleanup(state.clear)
+            state.clear()
+        scope = routers.request_scope()
+        scope.__enter__()
+        self.addCleanup(scope.__exit__, None, None, None)
+
+
+class ReadReplicaRouterTests(ReplicaTestMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.router = routers.ReadReplicaRouter()
+
+    def read(self):
+        return self.router.db_for_read(Customer)
+
+    def test_reads_go_to_a_replica_only_inside_use_replica(self):
+        self.assertIsNone(self.read())
+        with routers.use_replica() as alias:
+            self.assertIn(alias, REPLICA_ROUTING['REPLICAS'])
+            # one replica for the whole block
+            self.assertEqual({self.read() for _ in range(20)}, {alias})
+        self.assertIsNone(self.read())
+        with routers.use_replica(primary=True) as alias:
+            self.assertEqual(alias, 'default')
+            self.assertIsNone(self.read())
+
+    def test_writes_always_go_to_the_primary(self):
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_write(Customer), 'default')
+
+    def test_reads_after_a_write_stay_on_the_primary(self):
+        with routers.use_replica() as alias:
+            self.assertEqual(self.read(), alias)
+            self.router.db_for_write(Order)
+            self.assertEqual(self.read(), 'default')
+        with routers.use_replica() as alias:
+            self.assertEqual(alias, 'default')
+
+        with override_settings(CRM_DATABASE_ROUTING={**REPLICA_ROUTING, 'STICKY_SECONDS': 0}):
+            with routers.use_replica() as alias:
+                self.assertIn(alias, REPLICA_ROUTING['REPLICAS'])
+
+        # another request served by this thread
+        with routers.request_scope(), routers.use_replica() as alias:
+            self.assertIn(alias, REPLICA_ROUTING['REPLICAS'])
+
+    def test_reads_inside_a_primary_transaction_stay_on_the_primary(self):
+        with routers.use_replica() as alias, \
+                mock.patch.object(connections['default'], 'in_atomic_block', True):
+            self.assertNotEqual(alias, 'default')
+            self.assertEqual(self.read(), 'default')
+
+    def test_unhealthy_replicas_are_skipped(self):
+        with self.assertLogs('crm.routers', 'WARNING'):
+            routers.mark_down('replica1', 'gone')
+        self.assertEqual(routers.healthy_replicas(), ['replica2'])
+        for _ in range(10):
+            with routers.use_replica() as alias:
+                self.assertEqual(alias, 'replica2')
+        with self.assertLogs('crm.routers', 'WARNING'):
+            routers.mark_down('replica2', 'gone')
+        with routers.use_replica() as alias:
+            self.assertEqual(alias, 'default')
+
+    def test_the_faster_replica_wins(self):
+        routers.record_latency('replica1', 0.050)
+        routers.record_latency('replica2', 0.002)
+        for _ in range(10):
+            self.assertEqual(routers.choose_replica(), 'replica2')
+
+    def test_sticky_cookie(self):
+        factory = RequestFactory()
+        future, past = timezone.now().timestamp() + 5, timezone.now().timestamp() - 5
+        for value, expected in ((future, True), (past, False), ('garbage', False), (None, False)):
+            request = factory.get('/graphql/')
+            if value is not None:
+                request.COOKIES['crm_read_primary'] = str(value)
+            self.assertIs(routers.reads_primary(request), expected)
+
+
+class StickyReadsViewTests(ReplicaTestMixin, TransactionTestCase):
+    # Reads inside a transaction always go to the primary, hence no TestCase.
+
+    QUERY = 'query { allCustomers { edges { node { name } } } }'
+
+    def setUp(self):
+        super().setUp()
+        self.decisions = []
+        route = routers.ReadReplicaRouter.db_for_read
+
+        def record(router, model, **hints):
+            # The test database has no replicas: note where the read would
+            # go, then read from the primary.
+            self.decisions.append(route(router, model, **hints) or 'default')
+            return None
+
+        patch = mock.patch.object(routers.ReadReplicaRouter, 'db_for_read', record)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def post(self, client, query):
+        response = client.post('/graphql/', json.dumps({'query': query}), content_type='application/json')
+        self.assertNotIn('errors', response.json())
+        decisions, self.decisions = self.decisions, []
+        return response, set(decisions)
+
+    def test_read_your_writes_through_the_cookie(self):
+        _, reads = self.post(self.client, self.QUERY)
+        self.assertIn(reads, [{'replica1'}, {'replica2'}])
+
+        response, _ = self.post(
+            self.client, 'mutation { createCustomer(name: "New", email: "new@example.com") { customer { id } } }'
+        )
+        cookie = response.cookies['crm_read_primary']
+        self.assertEqual(cookie['max-age'], 5)
+        self.assertTrue(cookie['httponly'])
+
+        _, reads = self.post(self.client, self.QUERY)
+        self.assertEqual(reads, {'default'})
+
+        # Another client, on the same thread, still reads from a replica.
+        _, reads = self.post(self.client_class(), self.QUERY)
+        self.assertIn(reads, [{'replica1'}, {'replica2'}])
+
+    def test_a_query_sets_no_cookie(self):
+        response, _ = self.post(self.client, self.QUERY)
+        self.assertNotIn('crm_read_primary', response.cookies)
@@ -0,0 +1,339 @@
+# crm/tracing.py
+
+"""
+Per-operation tracing for the GraphQL endpoint.
+
+When ``CRM_GRAPHQL_TRACING['ENABLED']`` is set, ``CRMGraphQLView`` attaches
+a ``Trace`` to each request. The trace records parse/validate/execute phase
+timings, the SQL query count and time (through ``connection.execute_wrapper``)
+and, via ``TracingMiddleware``, the wall time of every resolver path. Each
+finished trace goes to the configured sinks. A request that sends the debug
+header (``HEADER``) also gets it back under ``extensions.tracing``, if
+``DEBUG`` is on or the user is staff.
+
+When tracing is disabled no middleware or execute wrapper is installed.
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, asynccontextmanager, contextmanager, nullcontext
+from inspect import isawaitable
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils.module_loading import import_string
+from promise import Promise
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': False,
+    'RESOLVERS': True,
+    'HEADER': 'X-GraphQL-Trace',
+    'SINKS': ['crm.tracing.LogSink'],
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, 'CRM_GRAPHQL_TRACING', {})}
+
+
+def elapsed_ms(start, end=None):
+    return round(((end if end is not None else time.perf_counter()) - start) * 1000, 3)
+
+
+class Trace:
+    """Timings collected while executing one GraphQL operation."""
+
+    def __init__(self, operation_name=None, resolvers=True):
+        self.operation_name = operation_name
+        self.record_resolvers = resolvers
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.phases = {}
+        self.resolvers = []
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.sql_lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + elapsed_ms(start)
+
+    def sql_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # root fields may run on several threads (crm.execution)
+            with self.sql_lock:
+                self.sql_count += 1
+                self.sql_time += time.perf_counter() - start
+
+    @contextmanager
+    def capture_sql(self):
+        """Counts and times the queries run on every database connection."""
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self.sql_wrapper))
+            yield
+
+    def add_resolver(self, info, start, end):
+        self.resolvers.append({
+            'path': '.'.join(str(key) for key in info.path.as_list()),
+            'parentType': info.parent_type.name,
+            'fieldName': info.field_name,
+            'returnType': str(info.return_type),
+            'startOffset': elapsed_ms(self.start, start),
+            'duration': elapsed_ms(start, end),
+        })
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def as_dict(self):
+        return {
+            'version': 1,
+            'operationName': self.operation_name,
+            'startTime': self.start_time,
+            'duration': elapsed_ms(self.start, self.end),
+            'phases': self.phases,
+            'sql': {'count': self.sql_count, 'time': round(self.sql_time * 1000, 3)},
+            'resolvers': self.resolvers,
+        }
+
+
+class TracingMiddleware:
+    """Graphene middleware timing each resolver, including promises and coroutines."""
+
+    def resolve(self, next, root, info, **args):
+        trace = getattr(info.context, 'graphql_trace', None)
+        if trace is None or not trace.record_resolvers:
+            return next(root, info, **args)
+
+        start = time.perf_counter()
+        result = next(root, info, **args)
+        if isawaitable(result):
+            async def timed():
+                try:
+                    return await result
+                finally:
+                    trace.add_resolver(info, start, time.perf_counter())
+            return timed()
+        if not Promise.is_thenable(result):
+            trace.add_resolver(info, start, time.perf_counter())
+            return result
+
+        def on_resolve(value):
+            trace.add_resolver(info, start, time.perf_counter())
+            return value
+
+        def on_error(error):
+            trace.add_resolver(info, start, time.perf_counter())
+            raise error
+
+        return Promise.resolve(result).then(on_resolve, on_error)
+
+
+tracing_middleware = TracingMiddleware()
+
+
+# --- Sinks ---
+# A sink is any object with ``emit(trace_dict)``; configure them in
+# CRM_GRAPHQL_TRACING['SINKS'] as dotted paths or {'class': path, **options}.
+
+class LogSink:
+    """Logs a one-line summary of each operation."""
+
+    def __init__(self, logger_name=__name__, level=logging.INFO):
+        self.logger = logging.getLogger(logger_name)
+        self.level = level
+
+    def emit(self, trace):
+        slowest = sorted(trace['resolvers'], key=lambda r: r['duration'], reverse=True)[:3]
+        self.logger.log(self.level, json.dumps({
+            'operation': trace['operationName'],
+            'duration': trace['duration'],
+            'phases': trace['phases'],
+            'sql': trace['sql'],
+            'slowest': [{'path': r['path'], 'duration': r['duration']} for r in slowest],
+        }))
+
+
+class StatsdSink:
+    """Sends StatsD timers and counters over UDP (fire and forget)."""
+
+    def __init__(self, host='localhost', port=8125, prefix='crm.graphql'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setblocking(False)
+
+    def metrics(self, trace):
+        operation = trace['operationName'] or 'anonymous'
+        yield f"{self.prefix}.operation.{operation}.duration:{trace['duration']}|ms"
+        for phase, duration in trace['phases'].items():
+            yield f"{self.prefix}.phase.{phase}:{duration}|ms"
+        yield f"{self.prefix}.sql.count:{trace['sql']['count']}|c"
+        yield f"{self.prefix}.sql.time:{trace['sql']['time']}|ms"
+        for resolver in trace['resolvers']:
+            yield f"{self.prefix}.resolver.{resolver['parentType']}.{resolver['fieldName']}:{resolver['duration']}|ms"
+
+    def emit(self, trace):
+        packet = []
+        for line in self.metrics(trace):
+            packet.append(line)
+            # keep datagrams under a typical MTU
+            if sum(len(p) + 1 for p in packet) > 1200:
+                self.send('\n'.join(packet))
+                packet = []
+        if packet:
+            self.send('\n'.join(packet))
+
+    def send(self, data):
+        try:
+            self.socket.sendto(data.encode(), self.address)
+        except OSError:
+            pass
+
+
+class Histogram:
+    """Fixed-bucket histogram of millisecond durations."""
+
+    BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {
+            'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts)),
+            'count': self.count,
+            'sum': round(self.sum, 3),
+        }
+
+
+class HistogramSink:
+    """Aggregates durations in process, per operation, phase and resolver."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = defaultdict(Histogram)
+
+    def emit(self, trace):
+        operation = trace['operationName'] or 'anonymous'
+        with self.lock:
+            self.histograms[f"operation:{operation}"].observe(trace['duration'])
+            self.histograms['sql_count'].observe(trace['sql']['count'])
+            for phase, duration in trace['phases'].items():
+                self.histograms[f"phase:{phase}"].observe(duration)
+            for resolver in trace['resolvers']:
+                self.histograms[f"resolver:{resolver['parentType']}.{resolver['fieldName']}"].observe(
+                    resolver['duration']
+                )
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+
+
+_sinks = {}
+
+
+def get_sinks():
+    """Returns the configured sink instances (created once per config)."""
+    specs = get_config()['SINKS']
+    key = json.dumps(specs, sort_keys=True, default=str)
+    if key not in _sinks:
+        sinks = []
+        for spec in specs:
+            if isinstance(spec, str):
+                spec = {'class': spec}
+            options = {name: value for name, value in spec.items() if name != 'class'}
+            sinks.append(import_string(spec['class'])(**options))
+        _sinks.clear()
+        _sinks[key] = sinks
+    return _sinks[key]
+
+
+def emit(trace):
+    """Sends a finished trace to every sink; sink failures are only logged."""
+    data = trace.as_dict()
+    for sink in get_sinks():
+        try:
+            sink.emit(data)
+        except Exception:
+            logger.exception("GraphQL trace sink %r failed", sink)
+    return data
+
+
+def start_trace(request, operation_name=None):
+    """
+    Returns a Trace for ``request`` (also stored as ``request.graphql_trace``)
+    when tracing is enabled, else None.
+    """
+    config = get_config()
+    if not config['ENABLED']:
+        return None
+    trace = Trace(operation_name, resolvers=config['RESOLVERS'])
+    request.graphql_trace = trace
+    return trace
+
+
+def trace_phase(request, name):
+    """Times a phase on the request's trace, if there is one."""
+    trace = getattr(request, 'graphql_trace', None)
+    return trace.phase(name) if trace is not None else nullcontext()
+
+
+def capture_sql(request):
+    """Counts SQL on the request's trace, if there is one."""
+    trace = getattr(request, 'graphql_trace', None)
+    return trace.capture_sql() if trace is not None else nullcontext()
+
+
+@asynccontextmanager
+async def acapture_sql(request):
+    """
+    ``capture_sql`` for the async view. The async ORM runs its queries on
+    the thread-sensitive ``sync_to_async`` thread, whose connections differ
+    from the event loop's, so the wrappers are installed there.
+    """
+    trace = getattr(request, 'graphql_trace', None)
+    if trace is None:
+        yield
+        return
+    context = trace.capture_sql()
+    await sync_to_async(context.__enter__)()
+    try:
+        yield
+    finally:
+        await sync_to_async(context.__exit__)(None, None, None)
+
+
+def wants_trace(request):
+    """Whether the response should include ``extensions.tracing``."""
+    header = get_config()['HEADER']
+    if not header or not request.headers.get(header):
+        return False
+    user = getattr(request, 'user', None)
+    return settings.DEBUG or bool(user is not None and user.is_staff)
@@ -0,0 +1,33 @@
+# crm/transactions.py
+
+"""
+``write_atomic``: ``transaction.atomic`` for blocks that write.
+
+On the project's SQLite backend (``crm.backends.sqlite3``) the outermost
+block begins with ``BEGIN IMMEDIATE``, so it queues for the write lock under
+``busy_timeout`` up front instead of failing with "database is locked" when
+its first write cannot upgrade the read lock. Nested blocks, and other
+backends, get plain ``atomic``.
+"""
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+
+class WriteAtomic(transaction.Atomic):
+
+    def __enter__(self):
+        connection = transaction.get_connection(self.using)
+        if not connection.in_atomic_block and hasattr(connection, 'next_transaction_mode'):
+            connection.next_transaction_mode = 'IMMEDIATE'
+        try:
+            super().__enter__()
+        finally:
+            if hasattr(connection, 'next_transaction_mode'):
+                connection.next_transaction_mode = None
+
+
+def write_atomic(using=None, savepoint=True, durable=False):
+    """Same signature and uses as ``transaction.atomic``."""
+    if callable(using):
+        return WriteAtomic(DEFAULT_DB_ALIAS, savepoint, durable)(using)
+    return WriteAtomic(using, savepoint, durable)
@@ -1,3 +1,438 @@
-from django.shortcuts import render
+import time
+from inspect import isawaitable
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse
+from django.middleware.csrf import CsrfViewMiddleware
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.views.generic import View
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionContext, ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, validate
+
+from .cost import QueryCostRule
+from .documents import get_document, get_extensions, resolve_persisted_query
+from .execution import ConcurrentExecutionContext, execute_sync
+from .importers import FORMATS, guess_format, import_rows
+from .metrics import REGISTRY, operation_label, record_graphql_request
+from .response_cache import get_response_cache, invalidate, mutation_tags
+from .routers import read_alias, reads_primary, request_scope, route_reads, set_sticky_cookie, use_replica
+from .tracing import acapture_sql, capture_sql, emit, start_trace, trace_phase, tracing_middleware, wants_trace
+from .transactions import write_atomic
+
+
+class CRMGraphQLView(GraphQLView):
+    """
+    GraphQLView with batched loaders, persisted queries and the opt-in
+    response cache.
+
+    Queries may be sent as an automatic persisted query hash. Parsed and
+    validated documents are reused from ``crm.documents``, so a repeated
+    operation goes straight to the cost check (``crm.cost``) and execution.
+    Query responses without errors are cached when ``CRM_GRAPHQL_CACHE`` is
+    enabled; mutations invalidate the model tags they write. The response
+    carries ``X-GraphQL-Cache: HIT`` or ``MISS`` for cacheable requests.
+    With ``CRM_GRAPHQL_TRACING`` enabled every operation is traced
+    (``crm.tracing``); latency and outcome always go to ``crm.metrics``.
+    Root query fields run in parallel when ``CRM_GRAPHQL_CONCURRENCY`` is
+    enabled (``crm.execution``).
+    """
+
+    execution_context_class = ConcurrentExecutionContext
+
+    def dispatch(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        with request_scope():
+            response = super().dispatch(request, *args, **kwargs)
+        return self.finalize_response(request, response, start)
+
+    def finalize_response(self, request, response, start):
+        """Sets the cache header and records the request metrics."""
+        cache_status = getattr(request, 'graphql_cache_status', None)
+        if cache_status:
+            response['X-GraphQL-Cache'] = cache_status
+        if getattr(request, 'graphql_wrote', False):
+            # The client's next queries read its writes from the primary.
+            set_sticky_cookie(response)
+
+        operation = getattr(request, 'graphql_operation', None)
+        if operation is None and response.status_code >= 400:
+            operation = operation_label(None)
+        if operation is not None:
+            execution_result = getattr(request, 'graphql_execution_result', None)
+            record_graphql_request(
+                operation,
+                time.perf_counter() - start,
+                error=response.status_code >= 400 or bool(execution_result and execution_result.errors),
+            )
+        return response
+
+    def get_graphql_params(self, request, data):
+        query, variables, operation_name, id = super().get_graphql_params(request, data)
+        # Errors are reported from execute_graphql_request, where they become
+        # a regular GraphQL error response.
+        request.graphql_error = None
+        try:
+            query = resolve_persisted_query(query, get_extensions(request, data))
+        except GraphQLError as e:
+            request.graphql_error = e
+        return query, variables, operation_name, id
+
+    def get_response(self, request, data, show_graphiql=False):
+        cached, key = self.get_cached_response(request, data, show_graphiql)
+        if cached is not None:
+            return cached
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.build_response(request, execution_result, id, key, show_graphiql)
+
+    def get_cached_response(self, request, data, show_graphiql=False):
+        """
+        Returns ``(cached, key)``: the cached ``(result, status_code)`` if
+        there is one, and the key to store the response under (None when the
+        request is not cacheable).
+        """
+        response_cache = get_response_cache()
+        if response_cache is None or self.batch:
+            return None, None
+
+        query, variables, operation_name, _ = self.get_graphql_params(request, data)
+        key = None
+        if query and request.graphql_error is None:
+            document, errors = get_document(self.schema.graphql_schema, query)
+            if not errors:
+                pretty = bool(self.pretty or show_graphiql or request.GET.get('pretty'))
+                key = response_cache.make_key(
+                    self.schema.graphql_schema, document, variables, operation_name, variant=pretty
+                )
+        if key is None:
+            return None, None
+
+        request.graphql_operation = operation_label(get_operation_ast(document, operation_name), document)
+        cached = response_cache.get(key)
+        if cached is not None:
+            request.graphql_cache_status = 'HIT'
+            return cached, key
+        request.graphql_cache_status = 'MISS'
+        return None, key
+
+    def build_response(self, request, execution_result, id=None, key=None, show_graphiql=False):
+        """
+        Serializes ``execution_result`` as ``GraphQLView.get_response`` does
+        and stores it under the response cache ``key``, if any.
+        """
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if not execution_result:
+            return None, status_code
+
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response['errors'] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.errors and any(not getattr(e, 'path', None) for e in execution_result.errors):
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+        if self.batch:
+            response['id'] = id
+            response['status'] = status_code
+        result = self.json_encode(request, response, pretty=show_graphiql)
+
+        traced = 'tracing' in getattr(request, 'graphql_extensions', {})
+        if key is not None and status_code == 200 and not execution_result.errors and not traced:
+            get_response_cache().set(key, (result, status_code))
+        return result, status_code
+
+    def get_middleware(self, request):
+        middleware = super().get_middleware(request)
+        if getattr(request, 'graphql_trace', None) is not None:
+            return [tracing_middleware, *(middleware or [])]
+        return middleware
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        trace = start_trace(request, operation_name)
+        try:
+            prepared = self.prepare_graphql_request(request, query, variables, operation_name, show_graphiql)
+            if not isinstance(prepared, tuple):
+                return prepared
+            document, operation, is_mutation = prepared
+            try:
+                with trace_phase(request, 'execute'), capture_sql(request):
+                    result = self.execute_operation(request, document, variables, operation_name, is_mutation)
+            except Exception as e:
+                return ExecutionResult(errors=[e])
+            return self.complete_graphql_request(request, operation, result)
+        finally:
+            if trace is not None:
+                self.finish_trace(request, trace)
+
+    def finish_trace(self, request, trace):
+        trace.finish()
+        trace_data = emit(trace)
+        if wants_trace(request):
+            self.add_extension(request, 'tracing', trace_data)
+
+    def prepare_graphql_request(self, request, query, variables, operation_name, show_graphiql=False):
+        """
+        Parses, validates and cost-checks ``query``. Returns
+        ``(document, operation, is_mutation)`` when it is ready to execute,
+        otherwise the ExecutionResult (or None) to respond with.
+        """
+        if getattr(request, 'graphql_error', None) is not None:
+            return ExecutionResult(errors=[request.graphql_error])
+        if not query:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        trace = getattr(request, 'graphql_trace', None)
+        document, errors = get_document(
+            self.schema.graphql_schema, query, trace.phases if trace is not None else None
+        )
+        if document is None:
+            return ExecutionResult(errors=errors)
+
+        operation = get_operation_ast(document, operation_name)
+        if trace is not None and operation is not None and operation.name:
+            trace.operation_name = operation.name.value
+        if request.method.lower() == 'get' and operation and operation.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'],
+                f"Can only perform a {operation.operation.value} operation from a POST request.",
+            ))
+        if errors:
+            return ExecutionResult(errors=errors)
+        # Only valid operations get their own metric labels.
+        request.graphql_operation = operation_label(operation, document)
+
+        # Depth/cost limits depend on the variables, so they are checked per
+        # request rather than cached with the document.
+        cost_rule = QueryCostRule.bind(variables, operation_name)
+        with trace_phase(request, 'validate'):
+            errors = validate(self.schema.graphql_schema, document, [cost_rule])
+        if cost_rule.result:
+            self.add_extension(request, 'cost', {
+                'estimated': cost_rule.result['cost'],
+                'depth': cost_rule.result['depth'],
+            })
+        if errors:
+            return ExecutionResult(errors=errors)
+
+        is_mutation = operation is not None and operation.operation == OperationType.MUTATION
+        return document, operation, is_mutation
+
+    def complete_graphql_request(self, request, operation, result):
+        request.graphql_execution_result = result
+        if operation is not None and operation.operation == OperationType.MUTATION and result.data is not None:
+            # Also covers writes that send no model signals (bulk_create,
+            # queryset.update).
+            invalidate(*mutation_tags(operation))
+            request.graphql_wrote = True
+        return result
+
+    def execute_operation(self, request, document, variables, operation_name, is_mutation):
+        if is_mutation and (
+            graphene_settings.ATOMIC_MUTATIONS is True
+            or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+        ):
+            with write_atomic():
+                result = self.execute_document(request, document, variables, operation_name)
+                if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                    transaction.set_rollback(True)
+            return result
+        if is_mutation:
+            return self.execute_document(request, document, variables, operation_name)
+        # Queries read from a replica (see crm/routers.py).
+        with use_replica(primary=reads_primary(request)):
+            return self.execute_document(request, document, variables, operation_name)
+
+    def add_extension(self, request, name, value):
+        """Adds ``value`` under ``extensions.<name>`` in the response."""
+        if not hasattr(request, 'graphql_extensions'):
+            request.graphql_extensions = {}
+        request.graphql_extensions[name] = value
+
+    def json_encode(self, request, d, pretty=False):
+        extensions = getattr(request, 'graphql_extensions', None)
+        if extensions and isinstance(d, dict):
+            d = {**d, 'extensions': {**d.get('extensions', {}), **extensions}}
+        return super().json_encode(request, d, pretty)
+
+    def execute_document(self, request, document, variables, operation_name, execution_context_class=None):
+        """
+        Executes an already validated document (no parse or validate). With
+        an ``execution_context_class`` the result may be awaitable (the
+        async view); otherwise nothing is awaited.
+        """
+        kwargs = dict(
+            root_value=self.get_root_value(request),
+            context_value=self.get_context(request),
+            variable_values=variables,
+            operation_name=operation_name,
+            middleware=self.get_middleware(request),
+        )
+        if execution_context_class is None:
+            return execute_sync(
+                self.schema.graphql_schema, document, self.execution_context_class, **kwargs
+            )
+        return execute(
+            self.schema.graphql_schema, document, execution_context_class=execution_context_class, **kwargs
+        )
+
+
+class AsyncCRMGraphQLView(CRMGraphQLView):
+    """
+    ``CRMGraphQLView`` for ASGI deployments (``CRM_GRAPHQL_ASYNC``).
+
+    Queries execute on the event loop: resolvers that return coroutines
+    (async ORM calls, the ``AsyncLoaders``) are awaited by graphql-core, so
+    independent root fields and loader batches overlap instead of holding a
+    worker thread each. Mutations keep the sync ORM and transaction handling
+    and run through ``sync_to_async``. GraphiQL and batched requests are
+    delegated to the sync view.
+    """
+
+    # Both handlers are coroutines, so Django serves the view as async.
+    dispatch = View.dispatch
+
+    async def post(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            data = self.parse_body(request)
+        except HttpError:
+            # The sync view renders the error response.
+            data = None
+        if data is None or self.batch or (self.graphiql and self.can_display_graphiql(request, data)):
+            return await sync_to_async(CRMGraphQLView.dispatch)(self, request, *args, **kwargs)
+
+        try:
+            result, status_code = await self.aget_response(request, data)
+            response = HttpResponse(status=status_code, content=result, content_type='application/json')
+        except HttpError as e:
+            response = e.response
+            response['Content-Type'] = 'application/json'
+            response.content = self.json_encode(request, {'errors': [self.format_error(e)]})
+        return self.finalize_response(request, response, start)
+
+    get = post
+
+    async def aget_response(self, request, data):
+        cached, key = self.get_cached_response(request, data)
+        if cached is not None:
+            return cached
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = await self.aexecute_graphql_request(request, query, variables, operation_name)
+        return self.build_response(request, execution_result, id, key)
+
+    async def aexecute_graphql_request(self, request, query, variables, operation_name):
+        trace = start_trace(request, operation_name)
+        try:
+            prepared = self.prepare_graphql_request(request, query, variables, operation_name)
+            if not isinstance(prepared, tuple):
+                return prepared
+            document, operation, is_mutation = prepared
+            try:
+                async with acapture_sql(request):
+                    with trace_phase(request, 'execute'):
+                        result = await self.aexecute_operation(
+                            request, document, variables, operation_name, is_mutation
+                        )
+            except Exception as e:
+                return ExecutionResult(errors=[e])
+            return self.complete_graphql_request(request, operation, result)
+        finally:
+            if trace is not None:
+                self.finish_trace(request, trace)
+
+    async def aexecute_operation(self, request, document, variables, operation_name, is_mutation):
+        if is_mutation:
+            # Mutations keep the sync ORM and ATOMIC_MUTATIONS handling.
+            return await sync_to_async(self.execute_operation)(
+                request, document, variables, operation_name, is_mutation
+            )
+        alias = await sync_to_async(read_alias)(reads_primary(request))
+        with route_reads(alias):
+            result = self.execute_document(request, document, variables, operation_name, ExecutionContext)
+            if isawaitable(result):
+                result = await result
+        return result
+
+
+def has_import_token(request):
+    """Whether the request carries ``CRM_IMPORT['TOKEN']`` as a bearer token."""
+    token = getattr(settings, 'CRM_IMPORT', {}).get('TOKEN')
+    return bool(token) and constant_time_compare(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    )
+
+
+def check_import_access(request):
+    """
+    Returns an error response unless the caller may import: a bearer token
+    (no cookies, so no CSRF check) or a staff session that passes the CSRF
+    check.
+    """
+    if has_import_token(request):
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+    if not user.is_staff:
+        return JsonResponse({'error': 'Staff access required.'}, status=403)
+    return CsrfViewMiddleware(lambda request: None).process_view(request, None, (), {})
+
+
+@csrf_exempt
+@require_POST
+def import_data(request, kind):
+    """
+    Streams an uploaded CSV/NDJSON file into the database.
+
+    Accepts either a multipart upload in the ``file`` field or the raw request
+    body. The format comes from ``?format=``, the file name or the content type.
+    Only staff users and holders of ``CRM_IMPORT['TOKEN']`` may import (see
+    ``check_import_access``).
+    """
+    denied = check_import_access(request)
+    if denied is not None:
+        return denied
+
+    upload = request.FILES.get('file')
+    if upload is not None:
+        lines = upload
+        fmt = request.GET.get('format') or guess_format(upload.name, upload.content_type)
+    else:
+        # HttpRequest iterates its body line by line without buffering it all.
+        lines = request
+        fmt = request.GET.get('format') or guess_format(content_type=request.content_type)
+
+    if fmt not in FORMATS:
+        return JsonResponse({'error': f"Unknown format '{fmt}'."}, status=400)
+
+    batch_size = request.GET.get('batch_size')
+    try:
+        report = import_rows(kind, lines, fmt, int(batch_size) if batch_size else None)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse(report.as_dict())
+
+
+def metrics(request):
+    """Serves ``crm.metrics.REGISTRY`` in the Prometheus text format."""
+    return HttpResponse(
+        REGISTRY.expose(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )